@@ -1,9 +1,12 @@
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for
+from flask import Flask, request, jsonify, render_template, session, redirect, url_for, Response, stream_with_context
 from flask_cors import CORS
 from functools import wraps
+import json
 import os
-from groq import Groq
-from chatbot import Chatbot, CourseManager, ExplanationManager, QuizManager, ScoreManager
+import threading
+from chatbot import (Chatbot, CourseManager, ExplanationManager, QuizManager, ScoreManager, ContentCache, ClarificationCache, UsageLedger, Prefetcher,
+                     SQLiteScoreStore, ScoreAggregates, migrate_json_scores, InMemorySessionStore, SQLiteSessionStore, JournalSessionStore,
+                     LazyProvider, call_configs_from_env, provider_from_env, gateway_from_env, metrics, span)
 from login import UserManager
 
 app = Flask(__name__)
@@ -16,19 +19,244 @@ CORS(app, supports_credentials=True, resources={
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "supersecretkey")
 
 # Initialize components
+# LLM_PROVIDER=stub swaps in a local stand-in for load tests and benchmarks (LLM_STUB_*
+# settings) that needs no API key
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "groq")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-if not GROQ_API_KEY:
-    raise ValueError("API key is missing! Please set the GROQ_API_KEY environment variable.")
-
-client = Groq(api_key=GROQ_API_KEY)
-user_manager = UserManager()
-chatbot = Chatbot(
-    CourseManager(),
-    ExplanationManager(client),
-    QuizManager(client),
-    ScoreManager()
+llm_configs = call_configs_from_env()
+
+# The catalog is the one thing loaded at import: under a preloading, forking server
+# (gunicorn --preload) the master reads data.json once and workers share it copy-on-write
+course_manager = CourseManager(reload_interval=float(os.getenv("CATALOG_RELOAD_INTERVAL", 2)))
+
+def _component(build):
+    """A Services attribute built on first access, once"""
+    name = build.__name__
+
+    @property
+    @wraps(build)
+    def component(self):
+        if name not in self._built:
+            with self._lock:
+                if name not in self._built:
+                    self._built[name] = build(self)
+        return self._built[name]
+    return component
+
+class Services:
+    """The stores, LLM client and managers behind the routes, each built on first use.
+
+    Nothing here is created at import, so a worker boots without touching the LLM
+    or opening databases, and routes such as /login work even when the LLM isn't
+    configured. SQLite connections and threads don't survive fork, so each process
+    builds its own (see services()).
+    """
+
+    COMPONENTS = (
+        "llm", "content_cache", "clarification_cache", "llm_usage", "explanation_manager", "quiz_manager",
+        "prefetcher", "score_store", "score_aggregates", "session_store", "user_manager", "chatbot",
+    )
+
+    def __init__(self):
+        self._built = {}
+        self._lock = threading.RLock()
+
+    def built(self, name):
+        """The component if it has been built already, else None"""
+        return self._built.get(name)
+
+    def warm(self):
+        """Which components have been built"""
+        return {name: name in self._built for name in self.COMPONENTS}
+
+    def warm_up(self):
+        """Build every component now (the LLM client itself still connects on its first call)"""
+        for name in self.COMPONENTS:
+            getattr(self, name)
+
+    @_component
+    def llm(self):
+        # One quota for the whole process: identical prompts are coalesced, bursts queue
+        # (interactive turns ahead of prefetch) and 429s back off instead of failing.
+        # The provider (and the groq client) is only created on the first LLM call.
+        return gateway_from_env(LazyProvider(provider_from_env))
+
+    @_component
+    def content_cache(self):
+        return ContentCache(
+            os.getenv("CONTENT_CACHE_DB", "content_cache.db"),
+            ttl=int(os.getenv("CONTENT_CACHE_TTL", 7 * 24 * 3600)),
+            max_entries=int(os.getenv("CONTENT_CACHE_MAX_ENTRIES", 5000)),
+            quiz_variants=int(os.getenv("QUIZ_VARIANTS", 3))
+        )
+
+    @_component
+    def clarification_cache(self):
+        # Answers to clarifications, reused for similarly worded ones on the same topic
+        return ClarificationCache(
+            threshold=float(os.getenv("CLARIFICATION_CACHE_THRESHOLD", 0.9)),
+            max_entries=int(os.getenv("CLARIFICATION_CACHE_SIZE", 2000))
+        )
+
+    @_component
+    def llm_usage(self):
+        # Token usage per course/topic; sizes each call's quota reservation to what the topic needs
+        return UsageLedger()
+
+    @_component
+    def explanation_manager(self):
+        return ExplanationManager(
+            self.llm, self.content_cache, configs=llm_configs, clarification_cache=self.clarification_cache,
+            usage=self.llm_usage
+        )
+
+    @_component
+    def quiz_manager(self):
+        return QuizManager(self.llm, self.content_cache, configs=llm_configs, usage=self.llm_usage)
+
+    @_component
+    def prefetcher(self):
+        return Prefetcher(
+            self.explanation_manager,
+            self.quiz_manager,
+            max_workers=int(os.getenv("PREFETCH_WORKERS", 2)),
+            max_in_flight=int(os.getenv("PREFETCH_MAX_IN_FLIGHT", 4)),
+            tokens_per_minute=int(os.getenv("PREFETCH_TOKENS_PER_MINUTE", 20000)),
+            max_age=float(os.getenv("PREFETCH_MAX_AGE", 900))
+        )
+
+    @_component
+    def score_store(self):
+        score_store = SQLiteScoreStore(os.getenv("SCORE_DB", "scores.db"))
+        migrate_json_scores("score.json", score_store)
+        return score_store
+
+    @_component
+    def score_aggregates(self):
+        # Running totals per course, topic and user behind the leaderboard and progress endpoints
+        return ScoreAggregates(os.getenv("AGGREGATES_DB", "aggregates.db"))
+
+    @_component
+    def session_store(self):
+        session_ttl = int(os.getenv("SESSION_TTL", 6 * 3600))
+        if os.getenv("SESSION_STORE", "memory") == "sqlite":
+            # Shared by every worker on the host, so a learner can land on any of them
+            return SQLiteSessionStore(os.getenv("SESSION_DB", "sessions.db"), ttl=session_ttl)
+        if os.getenv("SESSION_STORE") == "journal":
+            # Single-process deployments: sessions survive restarts by replaying an append-only journal
+            return JournalSessionStore(
+                os.getenv("SESSION_JOURNAL_DIR", "session_journal"),
+                max_sessions=int(os.getenv("MAX_SESSIONS", 10000)),
+                ttl=session_ttl,
+                snapshot_every=int(os.getenv("SESSION_SNAPSHOT_EVERY", 5000))
+            )
+        return InMemorySessionStore(max_sessions=int(os.getenv("MAX_SESSIONS", 10000)), ttl=session_ttl)
+
+    @_component
+    def user_manager(self):
+        return UserManager(users_db=os.getenv("USERS_DB", "users.db"), aggregates=self.score_aggregates)
+
+    @_component
+    def chatbot(self):
+        return Chatbot(
+            course_manager,
+            self.explanation_manager,
+            self.quiz_manager,
+            ScoreManager(store=self.score_store, aggregates=self.score_aggregates),
+            max_llm_workers=int(os.getenv("LLM_WORKERS", 8)),
+            llm_timeout=float(os.getenv("LLM_TIMEOUT", 30)),
+            prefetcher=self.prefetcher,
+            session_store=self.session_store
+        )
+
+_services = None
+_services_pid = None
+_services_lock = threading.Lock()
+
+def services():
+    """This process's Services; a worker forked after import starts with a fresh set"""
+    global _services, _services_pid
+    if _services_pid != os.getpid():
+        with _services_lock:
+            if _services_pid != os.getpid():
+                _services, _services_pid = Services(), os.getpid()
+    return _services
+
+def preload():
+    """Import the heavy modules the workers will need, so forked workers share them
+    copy-on-write instead of each importing them on its first request"""
+    import numpy  # noqa: F401  (clarification similarity)
+    if LLM_PROVIDER != "stub":
+        import groq  # noqa: F401
+
+if os.getenv("APP_PRELOAD"):
+    preload()
+
+# Requests slower than SLOW_REQUEST_MS are logged with a per-span breakdown
+slow_request_ms = os.getenv("SLOW_REQUEST_MS")
+metrics.configure(
+    slow_request_ms=float(slow_request_ms) if slow_request_ms else None,
+    slow_log=os.getenv("SLOW_REQUEST_LOG")
 )
 
+def collect_app_metrics():
+    """Cache, prefetch, session and quiz-parsing figures sampled when /metrics is scraped.
+
+    Only components already in use are reported; a scrape never builds one.
+    """
+    built = services().built
+    samples = []
+    content_cache = built("content_cache")
+    if content_cache:
+        cache = content_cache.stats()
+        samples += [
+            ("chatbot_cache_hits_total", "counter", "Content cache hits", {}, cache["hits"]),
+            ("chatbot_cache_misses_total", "counter", "Content cache misses", {}, cache["misses"]),
+            ("chatbot_cache_entries", "gauge", "Entries in the content cache", {}, cache["entries"]),
+        ]
+    clarification_cache = built("clarification_cache")
+    if clarification_cache:
+        clarifications = clarification_cache.stats()
+        samples += [
+            ("chatbot_clarification_hits_total", "counter", "Clarifications answered from a similar cached one", {}, clarifications["hits"]),
+            ("chatbot_clarification_misses_total", "counter", "Clarifications sent to the LLM", {}, clarifications["misses"]),
+            ("chatbot_clarification_entries", "gauge", "Entries in the clarification cache", {}, clarifications["entries"]),
+        ]
+    prefetcher = built("prefetcher")
+    if prefetcher:
+        prefetch = prefetcher.stats()
+        samples += [
+            ("chatbot_prefetch_jobs_total", "counter", "Prefetch jobs by outcome", {"outcome": "scheduled"}, prefetch["scheduled"]),
+            ("chatbot_prefetch_jobs_total", "counter", "Prefetch jobs by outcome", {"outcome": "used"}, prefetch["used"]),
+            ("chatbot_prefetch_jobs_total", "counter", "Prefetch jobs by outcome", {"outcome": "dropped"}, prefetch["dropped"]),
+            ("chatbot_prefetch_in_flight", "gauge", "Prefetch calls running now", {}, prefetch["in_flight"]),
+        ]
+    chatbot = built("chatbot")
+    if chatbot:
+        sessions = chatbot.memory_usage()
+        samples += [
+            ("chatbot_sessions", "gauge", "Chat sessions in the session store", {}, sessions["sessions"]),
+            ("chatbot_session_bytes", "gauge", "Total size of the stored chat sessions", {}, sessions["total_bytes"]),
+        ]
+    llm_usage = built("llm_usage")
+    for site, totals in (llm_usage.stats()["sites"] if llm_usage else {}).items():
+        samples.append(("chatbot_llm_site_calls_total", "counter", "LLM calls per call site", {"site": site}, totals["calls"]))
+        samples.append(("chatbot_llm_site_tokens_total", "counter", "LLM tokens per call site (counted locally)",
+                        {"site": site, "kind": "prompt"}, totals["prompt_tokens"]))
+        samples.append(("chatbot_llm_site_tokens_total", "counter", "LLM tokens per call site (counted locally)",
+                        {"site": site, "kind": "completion"}, totals["completion_tokens"]))
+        samples.append(("chatbot_llm_site_truncated_total", "counter", "Replies cut off at their max_tokens budget",
+                        {"site": site}, totals["truncated"]))
+    quiz_manager = built("quiz_manager")
+    quiz_stats = quiz_manager.quiz_stats() if quiz_manager else {}
+    for model, stats in quiz_stats.items():
+        samples.append(("chatbot_quiz_replies_total", "counter", "Quiz replies parsed", {"model": model}, stats["replies"]))
+    for model, stats in quiz_stats.items():
+        samples.append(("chatbot_quiz_parse_failures_total", "counter", "Quiz replies with no valid question", {"model": model}, stats["failures"]))
+    return samples
+
+metrics.register_collector(collect_app_metrics)
+
 # Login required decorator
 def login_required(f):
     @wraps(f)
@@ -57,7 +285,7 @@ def login():
             username = request.form.get('username')
             password = request.form.get('password')
         
-        success, message = user_manager.authenticate_user(username, password)
+        success, message = services().user_manager.authenticate_user(username, password)
         if success:
             session['username'] = username
             # If form POST, redirect to chatbot page
@@ -85,7 +313,7 @@ def register():
         username = data.get('username')
         password = data.get('password')
         
-        success, message = user_manager.register_user(username, password)
+        success, message = services().user_manager.register_user(username, password)
         if success:
             session['username'] = username
             return jsonify({"success": True, "message": message})
@@ -109,7 +337,80 @@ def check_auth():
 
 @app.route('/api/courses', methods=['GET'])
 def get_courses():
-    return jsonify(chatbot.course_manager.get_courses())
+    return jsonify(course_manager.get_courses())
+
+@app.route('/api/cache-stats', methods=['GET'])
+@login_required
+def cache_stats():
+    components = services()
+    stats = components.content_cache.stats()
+    stats["prefetch"] = components.prefetcher.stats()
+    stats["clarifications"] = components.clarification_cache.stats()
+    stats["quiz_parsing"] = components.quiz_manager.quiz_stats()
+    stats["llm_gateway"] = components.llm.stats()
+    stats["llm_usage"] = components.llm_usage.stats()
+    return jsonify(stats)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Readiness: 200 once the catalog is loaded, with which components are warm.
+
+    Components are built on first use; ?warm=1 builds them all now (the LLM client
+    still connects on its first call), e.g. from a deploy hook before taking traffic.
+    """
+    components = services()
+    if request.args.get('warm'):
+        try:
+            components.warm_up()
+        except Exception as e:
+            print(f"Error warming up components: {e}")
+    llm = components.built("llm")
+    courses = course_manager.get_courses()
+    ready = bool(courses)
+    return jsonify({
+        "ready": ready,
+        "pid": os.getpid(),
+        "catalog": {"loaded": ready, "courses": len(courses)},
+        "components": components.warm(),
+        "llm": {
+            "provider": LLM_PROVIDER,
+            "configured": LLM_PROVIDER == "stub" or bool(GROQ_API_KEY),
+            "client_ready": bool(llm and llm.provider.ready),
+        },
+    }), 200 if ready else 503
+
+@app.route('/api/leaderboard', methods=['GET'])
+@login_required
+def leaderboard():
+    """Top users by best score, overall or for ?course=; ?limit= caps the list (1-100)"""
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 100)
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+    course = request.args.get('course')
+    if course:
+        course = course_manager.get_matched_course(course) or course
+    return jsonify({"course": course, "leaderboard": services().score_aggregates.leaderboard(course, limit)})
+
+@app.route('/api/progress', methods=['GET'])
+@login_required
+def progress():
+    """The logged-in user's totals per course, next to each course's overall and per-topic totals"""
+    components = services()
+    user_progress = components.user_manager.get_user_progress(session['username'])
+    for course, totals in user_progress["courses"].items():
+        course_stats = components.score_aggregates.course_stats(course)
+        user_progress["courses"][course] = {"you": totals, "course": course_stats["totals"], "topics": course_stats["topics"]}
+    return jsonify(user_progress)
+
+@app.route('/api/session-stats', methods=['GET'])
+@login_required
+def session_stats():
+    return jsonify(services().chatbot.memory_usage())
 
 @app.route('/api/chat', methods=['POST'])
 @login_required
@@ -118,16 +419,48 @@ def chat():
     session_id = data.get('session_id', session.get('username', 'default'))  # Use username as session ID
     message = data.get('message')
     
-    response = chatbot.handle_message(session_id, message)
+    with metrics.request("/api/chat"):
+        response = services().chatbot.handle_message(session_id, message)
+        sync_user_session(session['username'], session_id)
+    
+    return jsonify(response)
+
+@app.route('/api/chat/stream', methods=['POST'])
+@login_required
+def chat_stream():
+    """Server-sent events variant of /api/chat that forwards LLM tokens as they arrive"""
+    data = request.json
+    session_id = data.get('session_id', session.get('username', 'default'))
+    message = data.get('message')
+    username = session['username']
+    chatbot = services().chatbot
+
+    def generate():
+        with metrics.request("/api/chat/stream"):
+            try:
+                for delta in chatbot.handle_message_stream(session_id, message):
+                    yield f"data: {json.dumps({'delta': delta})}\n\n"
+            except Exception as e:
+                yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+                return
+            sync_user_session(username, session_id)
+        yield "event: done\ndata: {}\n\n"
 
-    # Proper access to SessionState attributes
-    session_state = chatbot.sessions.get(session_id)
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def sync_user_session(username, session_id):
+    """Copy the chatbot session's totals for its current course onto the user record"""
+    components = services()
+    session_state = components.chatbot.sessions.get(session_id)
     if session_state and session_state.selected_course:
         course = session_state.selected_course
-        score = session_state.score
-        user_manager.update_user_session(session['username'], session_id, course, score)
-    
-    return jsonify(response)
+        score, answered, best = session_state.course_scores.get(course, (0, 0, 0))
+        with span("store.user_session"):
+            components.user_manager.update_user_session(username, session_id, course, score, answered, best)
 
 if __name__ == "__main__":
     app.run(debug=True, port=5000)
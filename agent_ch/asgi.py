@@ -0,0 +1,90 @@
+"""ASGI entry point: /api/chat runs on asyncio, everything else is served by the Flask app.
+
+Run with:  uvicorn asgi:application --workers 2
+"""
+import os
+import threading
+from asgiref.wsgi import WsgiToAsgi
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+from app import app, services, sync_user_session, GROQ_API_KEY, LLM_PROVIDER, llm_configs
+from chatbot import (metrics, AsyncChatbot, AsyncExplanationManager, AsyncQuizManager, AsyncGroqProvider, AsyncStubProvider,
+                     AsyncLazyProvider, AsyncLLMGateway, create_async_client, stub_provider_from_env)
+
+def async_provider():
+    if LLM_PROVIDER == "stub":
+        return stub_provider_from_env(AsyncStubProvider)
+    return AsyncGroqProvider(create_async_client(
+        GROQ_API_KEY,
+        max_connections=int(os.getenv("GROQ_MAX_CONNECTIONS", 100)),
+        max_keepalive_connections=int(os.getenv("GROQ_MAX_KEEPALIVE", 20))
+    ))
+
+def build_async_chatbot(components):
+    """An AsyncChatbot sharing this process's caches, quota and sessions with the WSGI routes"""
+    chatbot = components.chatbot
+    # Draw on the same quota as the WSGI routes and the prefetcher
+    async_llm = AsyncLLMGateway(AsyncLazyProvider(async_provider), components.llm.budget, max_retries=components.llm.max_retries)
+    async_chatbot = AsyncChatbot(
+        chatbot.course_manager,
+        AsyncExplanationManager(
+            async_llm, components.content_cache, configs=llm_configs, clarification_cache=components.clarification_cache,
+            usage=components.llm_usage
+        ),
+        AsyncQuizManager(async_llm, components.content_cache, configs=llm_configs, usage=components.llm_usage),
+        chatbot.score_manager,
+        max_llm_workers=chatbot.max_llm_workers,
+        llm_timeout=chatbot.llm_timeout,
+        prefetcher=chatbot.prefetcher
+    )
+    # Share conversation state with the WSGI routes (e.g. /api/chat/stream)
+    async_chatbot.sessions = chatbot.sessions
+    return async_chatbot
+
+_async_chatbots = {}   # Services -> AsyncChatbot; a forked worker gets a new Services, so a new entry
+_async_chatbots_lock = threading.Lock()
+
+def async_chatbot():
+    """This process's AsyncChatbot, built on its first chat (in a worker thread: it opens databases)"""
+    components = services()
+    if components not in _async_chatbots:
+        with _async_chatbots_lock:
+            if components not in _async_chatbots:
+                _async_chatbots.clear()
+                _async_chatbots[components] = build_async_chatbot(components)
+    return _async_chatbots[components]
+
+def session_username(request):
+    """Read the logged-in username from Flask's signed session cookie"""
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookie = request.cookies.get(app.config["SESSION_COOKIE_NAME"])
+    if serializer is None or not cookie:
+        return None
+    try:
+        max_age = int(app.permanent_session_lifetime.total_seconds())
+        return serializer.loads(cookie, max_age=max_age).get("username")
+    except Exception:
+        return None
+
+async def chat(request):
+    username = session_username(request)
+    if not username:
+        return JSONResponse({"error": "Please login first"}, status_code=401)
+
+    data = await request.json()
+    session_id = data.get('session_id', username)
+    message = data.get('message')
+
+    with metrics.request("/api/chat"):
+        chatbot = await run_in_threadpool(async_chatbot)
+        response = await chatbot.handle_message(session_id, message)
+        await run_in_threadpool(sync_user_session, username, session_id)
+
+    return JSONResponse(response)
+
+application = Starlette(routes=[
+    Route('/api/chat', chat, methods=['POST']),
+    Mount('/', app=WsgiToAsgi(app))
+])
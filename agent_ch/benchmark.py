@@ -0,0 +1,428 @@
+"""Load test for the chat state machine, run against the stub LLM provider.
+
+Simulated learners walk the full flow (course selection, explanation, quiz,
+answers, next topic, the odd clarification) either straight through
+Chatbot.handle_message, through /api/chat with the Flask test client, or against
+a running server. The report is JSON: latency percentiles per step, throughput,
+session memory growth and score/session store I/O cost.
+
+    python benchmark.py --learners 2000 --concurrency 32 --output bench.json
+    python benchmark.py --target flask --learners 500
+    LLM_PROVIDER=stub python app.py &  python benchmark.py --target http --url http://localhost:5000
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def percentiles(samples):
+    """Summarize durations (seconds) as count/mean/p50/p95/p99/max in milliseconds"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+class Recorder:
+    """Thread-safe collection of named duration samples"""
+
+    def __init__(self):
+        self.samples = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def timed(self, name, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def report(self, prefix=""):
+        with self._lock:
+            return {
+                name[len(prefix):]: percentiles(samples)
+                for name, samples in sorted(self.samples.items()) if name.startswith(prefix)
+            }
+
+def instrument_stores(chatbot, recorder):
+    """Time every score and session store call the chatbot makes"""
+    from chatbot import ScoreStore, SessionStore
+
+    class TimedScoreStore(ScoreStore):
+        def __init__(self, store):
+            self.store = store
+
+        def set_score(self, session_id, course, score):
+            recorder.timed("io.score_store.write", self.store.set_score, session_id, course, score)
+
+        def set_scores(self, updates):
+            recorder.timed("io.score_store.write_batch", self.store.set_scores, updates)
+
+        def get_scores(self, session_id):
+            return recorder.timed("io.score_store.read", self.store.get_scores, session_id)
+
+        def all_scores(self):
+            return self.store.all_scores()
+
+        def __getattr__(self, name):
+            return getattr(self.store, name)
+
+    class TimedSessionStore(SessionStore):
+        def __init__(self, store):
+            self.store = store
+
+        def get(self, session_id):
+            return recorder.timed("io.session_store.read", self.store.get, session_id)
+
+        def set(self, session_id, state):
+            recorder.timed("io.session_store.write", self.store.set, session_id, state)
+
+        def delete(self, session_id):
+            self.store.delete(session_id)
+
+        def evict_idle(self):
+            return self.store.evict_idle()
+
+        def memory_usage(self):
+            return self.store.memory_usage()
+
+        def __getattr__(self, name):
+            return getattr(self.store, name)
+
+    chatbot.score_manager.store = TimedScoreStore(chatbot.score_manager.store)
+    chatbot.sessions = TimedSessionStore(chatbot.sessions)
+
+def stub_settings(args):
+    return {
+        "latency": args.llm_latency_dist,
+        "median_latency": args.llm_latency,
+        "latency_spread": args.llm_latency_spread,
+        "failure_rate": args.llm_failure_rate,
+        "malformed_rate": args.llm_malformed_rate,
+        "words": args.llm_reply_words,
+        "seed": args.seed,
+    }
+
+def build_chatbot(args, workdir):
+    """Assemble the service the way app.py does, with the stub provider and stores under workdir"""
+    from chatbot import (Chatbot, CourseManager, ExplanationManager, QuizManager, ScoreManager, ContentCache,
+                         Prefetcher, JsonScoreStore, SQLiteScoreStore, InMemorySessionStore, SQLiteSessionStore,
+                         JournalSessionStore, StubProvider, LLMGateway, RateBudget, UsageLedger)
+
+    stub = StubProvider(**stub_settings(args))
+    llm = LLMGateway(stub, RateBudget(args.llm_rpm, args.llm_tpm))
+    cache = None if args.no_cache else ContentCache(os.path.join(workdir, "content_cache.db"))
+    usage = UsageLedger()
+    explanation_manager = ExplanationManager(llm, cache, usage=usage)
+    quiz_manager = QuizManager(llm, cache, usage=usage)
+    prefetcher = None if args.no_prefetch else Prefetcher(explanation_manager, quiz_manager)
+    if args.score_store == "json":
+        score_store = JsonScoreStore(os.path.join(workdir, "score.json"))
+    else:
+        score_store = SQLiteScoreStore(os.path.join(workdir, "scores.db"))
+    if args.session_store == "sqlite":
+        session_store = SQLiteSessionStore(os.path.join(workdir, "sessions.db"))
+    elif args.session_store == "journal":
+        session_store = JournalSessionStore(os.path.join(workdir, "session_journal"), max_sessions=max(10000, args.learners))
+    else:
+        session_store = InMemorySessionStore(max_sessions=max(10000, args.learners))
+    chatbot = Chatbot(
+        CourseManager(os.path.join(BASE_DIR, "data.json")),
+        explanation_manager,
+        quiz_manager,
+        ScoreManager(store=score_store),
+        max_llm_workers=args.llm_workers,
+        prefetcher=prefetcher,
+        session_store=session_store
+    )
+    return chatbot, stub, cache
+
+def import_app(args, workdir):
+    """Import app.py configured for the stub provider, with every store under workdir"""
+    settings = stub_settings(args)
+    os.environ.update({
+        "LLM_PROVIDER": "stub",
+        "LLM_STUB_LATENCY": settings["latency"],
+        "LLM_STUB_MEDIAN_LATENCY": str(settings["median_latency"]),
+        "LLM_STUB_LATENCY_SPREAD": str(settings["latency_spread"]),
+        "LLM_STUB_FAILURE_RATE": str(settings["failure_rate"]),
+        "LLM_STUB_MALFORMED_RATE": str(settings["malformed_rate"]),
+        "LLM_STUB_WORDS": str(settings["words"]),
+        "CONTENT_CACHE_DB": os.path.join(workdir, "content_cache.db"),
+        "SCORE_DB": os.path.join(workdir, "scores.db"),
+        "SESSION_STORE": args.session_store,
+        "SESSION_DB": os.path.join(workdir, "sessions.db"),
+        "SESSION_JOURNAL_DIR": os.path.join(workdir, "session_journal"),
+        "MAX_SESSIONS": str(max(10000, args.learners)),
+        "USERS_DB": os.path.join(workdir, "users.db"),
+        "AGGREGATES_DB": os.path.join(workdir, "aggregates.db"),
+        "LLM_WORKERS": str(args.llm_workers),
+        "LLM_REQUESTS_PER_MINUTE": str(args.llm_rpm),
+        "LLM_TOKENS_PER_MINUTE": str(args.llm_tpm),
+    })
+    if args.seed is not None:
+        os.environ["LLM_STUB_SEED"] = str(args.seed)
+    # app.py reads data.json and the legacy JSON files relative to the working directory
+    os.chdir(BASE_DIR)
+    sys.path.insert(0, BASE_DIR)
+    import app
+    return app
+
+def direct_sender(chatbot):
+    def connect(learner_id):
+        session_id = f"bench-{learner_id}"
+        return lambda message: chatbot.handle_message(session_id, message)["response"]
+    return connect
+
+def flask_sender(app_module):
+    def connect(learner_id):
+        client = app_module.app.test_client()
+        username = f"bench-{learner_id}"
+        with client.session_transaction() as flask_session:
+            flask_session["username"] = username
+
+        def send(message):
+            reply = client.post("/api/chat", json={"session_id": username, "message": message})
+            return reply.get_json()["response"]
+        return send
+    return connect
+
+def http_sender(base_url, run_id):
+    import http.cookiejar
+    import urllib.request
+
+    def connect(learner_id):
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        username = f"bench-{run_id}-{learner_id}"
+
+        def post(path, payload):
+            request = urllib.request.Request(
+                base_url + path, data=json.dumps(payload).encode("utf-8"),
+                headers={"Content-Type": "application/json"}
+            )
+            with opener.open(request) as response:
+                return json.loads(response.read().decode("utf-8"))
+
+        post("/register", {"username": username, "password": "benchmark"})
+        return lambda message: post("/api/chat", {"session_id": username, "message": message})["response"]
+    return connect
+
+def walk(send, rng, course, topics, clarify_rate, recorder):
+    """Drive one learner through the flow by reading the bot's replies.
+
+    Returns "completed", or "stalled" if a reply didn't match any step of the flow.
+    """
+    def step(name, message):
+        start = time.perf_counter()
+        reply = send(message)
+        elapsed = time.perf_counter() - start
+        recorder.add("step." + name, elapsed)
+        recorder.add("all", elapsed)
+        if "Error" in reply or "Sorry, I couldn't" in reply:
+            recorder.count("llm_error_replies")
+        return reply
+
+    reply = step("select_course", course)
+    topics_done = 0
+    for _ in range(200):
+        if "completed all the topics" in reply:
+            return "completed"
+        if "quiz on this topic? (yes/no)" in reply:
+            if rng.random() < clarify_rate:
+                step("quiz_choice", "no")
+                reply = step("clarify", "I didn't understand the example, can you explain it more simply?")
+            else:
+                reply = step("quiz_choice", "yes")
+        elif "Type 'next'" in reply:
+            reply = step("next_question", "next")
+        elif "next topic? (yes/no)" in reply:
+            topics_done += 1
+            if topics_done >= topics:
+                return "completed"
+            reply = step("next_topic", "yes")
+        elif "start the quiz" in reply or reply.startswith("Q"):
+            reply = step("answer", rng.choice("ABCD"))
+        else:
+            return "stalled"
+    return "stalled"
+
+def sample_memory(chatbot):
+    usage = chatbot.memory_usage()
+    return {"sessions": usage["sessions"], "total_bytes": usage["total_bytes"], "avg_bytes": usage["avg_bytes"]}
+
+def score_file_io(workdir, ops, sessions=50):
+    """Micro-benchmark the score stores: per-op write/read cost and file size after `ops` updates"""
+    from chatbot import JsonScoreStore, SQLiteScoreStore
+
+    results = {}
+    for name, store in (
+        ("json", JsonScoreStore(os.path.join(workdir, "io_score.json"))),
+        ("sqlite", SQLiteScoreStore(os.path.join(workdir, "io_scores.db"))),
+    ):
+        recorder = Recorder()
+        for i in range(ops):
+            recorder.timed("write", store.set_score, f"session-{i % sessions}", f"course-{i % 7}", i)
+        for i in range(min(ops, sessions)):
+            recorder.timed("read", store.get_scores, f"session-{i}")
+        path = store.score_file if name == "json" else store.db_file
+        results[name] = dict(recorder.report(), file_bytes=os.path.getsize(path))
+    return results
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="chat-bench-")
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    chatbot = llm = cache = None
+
+    if args.target == "direct":
+        chatbot, llm, cache = build_chatbot(args, workdir)
+        connect = direct_sender(chatbot)
+        courses = chatbot.course_manager.get_courses()
+    elif args.target == "flask":
+        app_module = import_app(args, workdir)
+        components = app_module.services()
+        # The gateway's provider is a LazyProvider; building it here gives the stub to read stats from
+        chatbot, llm, cache = components.chatbot, components.llm.provider.provider, components.content_cache
+        connect = flask_sender(app_module)
+        courses = chatbot.course_manager.get_courses()
+    else:
+        import urllib.request
+        with urllib.request.urlopen(args.url + "/api/courses") as response:
+            courses = json.loads(response.read().decode("utf-8"))
+        connect = http_sender(args.url.rstrip("/"), int(time.time()))
+    if chatbot is not None:
+        instrument_stores(chatbot, recorder)
+
+    if args.trace_memory:
+        tracemalloc.start()
+    traced_before = tracemalloc.get_traced_memory()[0] if args.trace_memory else 0
+    outcomes = {"completed": 0, "stalled": 0, "failed": 0}
+    memory_curve = []
+    outcome_lock = threading.Lock()
+    # Each learner gets its own course and RNG up front so runs are reproducible
+    plans = [(i, rng.choice(courses), random.Random(rng.random())) for i in range(args.learners)]
+
+    def learner(plan):
+        learner_id, course, learner_rng = plan
+        try:
+            outcome = walk(connect(learner_id), learner_rng, course, args.topics, args.clarify_rate, recorder)
+        except Exception as e:
+            outcome = "failed"
+            if args.verbose:
+                print(f"learner {learner_id} failed: {e}", file=sys.stderr)
+        with outcome_lock:
+            outcomes[outcome] += 1
+            finished = sum(outcomes.values())
+        if chatbot is not None and finished % max(1, args.learners // 10) == 0:
+            memory_curve.append(dict(sample_memory(chatbot), learners_finished=finished))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(learner, plans))
+    wall = time.perf_counter() - start
+
+    messages = len(recorder.samples.get("all", []))
+    report = {
+        "config": dict(vars(args), workdir=workdir),
+        "wall_seconds": round(wall, 3),
+        "learners": dict(outcomes, total=args.learners),
+        "messages": messages,
+        "throughput": {
+            "messages_per_sec": round(messages / wall, 2) if wall else None,
+            "learners_per_sec": round(args.learners / wall, 2) if wall else None,
+        },
+        "latency": {"all": percentiles(recorder.samples.get("all", [])), "by_step": recorder.report("step.")},
+        "llm_error_replies": recorder.counts.get("llm_error_replies", 0),
+        "memory": {"max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss},
+        "store_io": recorder.report("io."),
+    }
+    if chatbot is not None:
+        report["memory"]["sessions"] = sample_memory(chatbot)
+        report["memory"]["growth"] = memory_curve
+        if args.trace_memory:
+            traced = tracemalloc.get_traced_memory()[0] - traced_before
+            report["memory"]["traced_bytes_per_learner"] = traced // max(1, args.learners)
+            tracemalloc.stop()
+        report["llm"] = llm.stats()
+        report["llm"]["tokens_per_message"] = round(
+            (report["llm"]["prompt_tokens"] + report["llm"]["completion_tokens"]) / messages, 1
+        ) if messages else None
+        if chatbot.quiz_manager.usage is not None:
+            report["llm_usage"] = chatbot.quiz_manager.usage.stats()
+        report["llm_gateway"] = chatbot.quiz_manager.llm.stats()
+        report["quiz_parsing"] = chatbot.quiz_manager.quiz_stats()
+        if cache is not None:
+            report["content_cache"] = cache.stats()
+        if chatbot.prefetcher is not None:
+            report["prefetch"] = chatbot.prefetcher.stats()
+    if args.score_io_ops:
+        report["store_io"]["score_file"] = score_file_io(workdir, args.score_io_ops)
+    return report
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the chat flow against the stub LLM provider")
+    parser.add_argument("--target", choices=("direct", "flask", "http"), default="direct",
+                        help="Chatbot.handle_message, /api/chat via the Flask test client, or a running server")
+    parser.add_argument("--url", default="http://localhost:5000", help="server for --target http")
+    parser.add_argument("--learners", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--topics", type=int, default=3, help="topics each learner completes")
+    parser.add_argument("--clarify-rate", type=float, default=0.2, help="share of topics where the learner asks for a simpler explanation")
+    parser.add_argument("--llm-latency", type=float, default=0.02, help="stub median latency in seconds")
+    parser.add_argument("--llm-latency-dist", choices=("fixed", "uniform", "lognormal", "exponential"), default="lognormal")
+    parser.add_argument("--llm-latency-spread", type=float, default=0.5)
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--llm-malformed-rate", type=float, default=0.0)
+    parser.add_argument("--llm-reply-words", type=int, default=220,
+                        help="length of stub explanations when the prompt doesn't ask for less")
+    parser.add_argument("--llm-workers", type=int, default=8)
+    parser.add_argument("--llm-rpm", type=int, default=0, help="gateway requests-per-minute budget (0: unlimited)")
+    parser.add_argument("--llm-tpm", type=int, default=0, help="gateway tokens-per-minute budget (0: unlimited)")
+    parser.add_argument("--score-store", choices=("json", "sqlite"), default="sqlite", help="direct target only")
+    parser.add_argument("--session-store", choices=("memory", "sqlite", "journal"), default="memory")
+    parser.add_argument("--no-cache", action="store_true", help="direct target: run without the content cache")
+    parser.add_argument("--no-prefetch", action="store_true", help="direct target: run without the prefetcher")
+    parser.add_argument("--score-io-ops", type=int, default=500, help="score store micro-benchmark size (0 to skip)")
+    parser.add_argument("--trace-memory", action="store_true", help="measure allocation growth with tracemalloc (slower)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
@@ -1,5 +1,31 @@
 from .chatbot import Chatbot
+from .async_chatbot import AsyncChatbot
 from .managers import CourseManager, QuizManager, ExplanationManager, ScoreManager
 from .models import SessionState
+from .cache import ContentCache
+from .catalog import Catalog, Topic
+from .clarifications import ClarificationCache
+from .prompts import PROMPTS, PromptTemplate, TokenMeter, UsageLedger, count_tokens, summarize_explanation
+from .quiz_parser import parse_quiz
+from .metrics import Metrics, metrics, span
+from .gateway import LLMGateway, AsyncLLMGateway, RateBudget, llm_priority, gateway_from_env, INTERACTIVE, BACKGROUND
+from .prefetch import Prefetcher
+from .session_store import SessionStore, InMemorySessionStore, SQLiteSessionStore, JournalSessionStore
+from .journal import EventJournal
+from .score_store import ScoreStore, JsonScoreStore, SQLiteScoreStore, migrate_json_scores
+from .aggregates import ScoreAggregates
+from .async_managers import AsyncQuizManager, AsyncExplanationManager, create_async_client
+from .llm import (CallConfig, LLMError, LLMProvider, AsyncLLMProvider, GroqProvider, AsyncGroqProvider,
+                  StubProvider, AsyncStubProvider, LazyProvider, AsyncLazyProvider, call_configs, call_configs_from_env, provider_from_env,
+                  stub_provider_from_env)
 
-__all__ = ['Chatbot', 'CourseManager', 'QuizManager', 'ExplanationManager', 'ScoreManager', 'SessionState']
\ No newline at end of file
+__all__ = ['Chatbot', 'CourseManager', 'QuizManager', 'ExplanationManager', 'ScoreManager', 'SessionState', 'ContentCache', 'ClarificationCache', 'Catalog', 'Topic',
+           'PROMPTS', 'PromptTemplate', 'TokenMeter', 'UsageLedger', 'count_tokens', 'summarize_explanation', 'parse_quiz', 'Prefetcher',
+           'SessionStore', 'InMemorySessionStore', 'SQLiteSessionStore', 'JournalSessionStore', 'EventJournal',
+           'ScoreStore', 'JsonScoreStore', 'SQLiteScoreStore', 'migrate_json_scores', 'ScoreAggregates',
+           'AsyncChatbot', 'AsyncQuizManager', 'AsyncExplanationManager', 'create_async_client',
+           'CallConfig', 'LLMError', 'LLMProvider', 'AsyncLLMProvider', 'GroqProvider', 'AsyncGroqProvider',
+           'StubProvider', 'AsyncStubProvider', 'LazyProvider', 'AsyncLazyProvider', 'call_configs', 'call_configs_from_env', 'provider_from_env',
+           'stub_provider_from_env',
+           'Metrics', 'metrics', 'span',
+           'LLMGateway', 'AsyncLLMGateway', 'RateBudget', 'llm_priority', 'gateway_from_env', 'INTERACTIVE', 'BACKGROUND']
\ No newline at end of file
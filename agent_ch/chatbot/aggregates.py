@@ -0,0 +1,165 @@
+import sqlite3
+import threading
+import time
+
+class ScoreAggregates:
+    """Running quiz totals per course, topic and user, kept up to date on every answer.
+
+    Each row holds attempts, correct answers, the best score reached and when it last
+    changed. Updates are keyed upserts of a handful of rows, so leaderboards and
+    progress views read precomputed numbers instead of scanning score history.
+    Course and topic rows are fed answer by answer from ScoreManager; user rows come
+    from UserManager, which only sees a session's running totals per course, so the
+    last totals seen per session and course are kept to turn them into increments.
+    """
+
+    def __init__(self, db_file="aggregates.db", busy_timeout=5.0):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        self._init_db()
+
+    def _init_db(self):
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            # scope is "course", "topic", "user" or "user_course"; unused key parts are ''
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS aggregates (
+                    scope TEXT NOT NULL,
+                    course TEXT NOT NULL,
+                    topic TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    correct INTEGER NOT NULL,
+                    best INTEGER NOT NULL,
+                    last_updated REAL NOT NULL,
+                    PRIMARY KEY (scope, course, topic, username)
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_aggregates_rank ON aggregates(scope, course, best DESC)")
+            # Replaced by per-course totals: a session's totals used to span every course it visited
+            self._conn.execute("DROP TABLE IF EXISTS session_totals")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS session_course_totals (
+                    username TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    course TEXT NOT NULL,
+                    answered INTEGER NOT NULL,
+                    correct INTEGER NOT NULL,
+                    PRIMARY KEY (username, session_id, course)
+                )"""
+            )
+
+    def _upsert(self, scope, course, topic, username, attempts, correct, best, now):
+        """Add to one aggregate row (lock held, inside a transaction)"""
+        self._conn.execute(
+            "INSERT INTO aggregates (scope, course, topic, username, attempts, correct, best, last_updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(scope, course, topic, username) DO UPDATE SET "
+            "attempts = attempts + excluded.attempts, correct = correct + excluded.correct, "
+            "best = MAX(best, excluded.best), last_updated = excluded.last_updated",
+            (scope, course, topic or "", username or "", attempts, correct, best, now),
+        )
+
+    def _transaction(self, apply):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                apply(time.time())
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def record_answer(self, course, topic, correct, quiz_score):
+        """Count one quiz answer for its course and topic; quiz_score is the correct answers
+        so far in the quiz on that topic, so `best` is the best quiz result seen"""
+        def apply(now):
+            self._upsert("course", course, "", "", 1, int(correct), quiz_score, now)
+            if topic:
+                self._upsert("topic", course, topic, "", 1, int(correct), quiz_score, now)
+        self._transaction(apply)
+
+    def record_user_sessions(self, rows):
+        """Fold (username, session_id, course, correct, answered, best) totals into the user rows.
+
+        Each row is one course's running totals in a session: correct answers, questions
+        answered and the best quiz score. Only the change since the totals last seen for
+        that session and course is added, so re-sending the same totals is harmless.
+        Totals lower than the ones seen mean the session started over (a restart or an
+        expired session reuses the id), so they count from zero.
+        """
+        def apply(now):
+            for username, session_id, course, correct, answered, best in rows:
+                previous = self._conn.execute(
+                    "SELECT answered, correct FROM session_course_totals WHERE username = ? AND session_id = ? AND course = ?",
+                    (username, session_id, course),
+                ).fetchone()
+                seen_answered, seen_correct = previous or (0, 0)
+                if correct < seen_correct or answered < seen_answered:
+                    seen_answered, seen_correct = 0, 0
+                gained = max(0, correct - seen_correct)
+                attempts = max(gained, answered - seen_answered)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO session_course_totals (username, session_id, course, answered, correct) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (username, session_id, course, seen_answered + attempts, correct),
+                )
+                if not attempts:
+                    continue
+                self._upsert("user", "", "", username, attempts, gained, best, now)
+                self._upsert("user_course", course, "", username, attempts, gained, best, now)
+        self._transaction(apply)
+
+    @staticmethod
+    def _as_dict(attempts, correct, best, last_updated):
+        return {
+            "attempts": attempts,
+            "correct": correct,
+            "accuracy": round(correct / attempts, 4) if attempts else 0.0,
+            "best": best,
+            "last_updated": last_updated,
+        }
+
+    def _select(self, where, params, order="", limit=None):
+        query = f"SELECT course, topic, username, attempts, correct, best, last_updated FROM aggregates WHERE {where}"
+        if order:
+            query += f" ORDER BY {order}"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    def leaderboard(self, course=None, limit=10):
+        """Top users by best score (then correct answers, then fewest attempts), overall or for one course"""
+        if course:
+            where, params = "scope = 'user_course' AND course = ?", (course,)
+        else:
+            where, params = "scope = 'user' AND course = ''", ()
+        rows = self._select(where, params, "best DESC, correct DESC, attempts ASC, last_updated ASC", limit)
+        return [
+            dict(self._as_dict(*row[3:]), rank=rank, username=row[2])
+            for rank, row in enumerate(rows, start=1)
+        ]
+
+    def course_stats(self, course):
+        """Totals for a course and each of its topics that has been quizzed"""
+        rows = self._select("scope IN ('course', 'topic') AND course = ?", (course,), "topic")
+        stats = {"course": course, "totals": None, "topics": {}}
+        for _, topic, _, *values in rows:
+            if topic:
+                stats["topics"][topic] = self._as_dict(*values)
+            else:
+                stats["totals"] = self._as_dict(*values)
+        return stats
+
+    def user_progress(self, username):
+        """A user's overall totals and per-course totals"""
+        rows = self._select("scope IN ('user', 'user_course') AND username = ?", (username,), "course")
+        progress = {"username": username, "totals": None, "courses": {}}
+        for course, _, _, *values in rows:
+            if course:
+                progress["courses"][course] = self._as_dict(*values)
+            else:
+                progress["totals"] = self._as_dict(*values)
+        return progress
@@ -0,0 +1,177 @@
+import asyncio
+from .chatbot import Chatbot, EXPLANATION_TIMEOUT_MESSAGE, TIMED_OUT
+from .metrics import span
+
+class AsyncChatbot(Chatbot):
+    """Chatbot whose LLM-bound handlers are coroutines, for use with the async managers.
+
+    Handlers that never call the LLM are inherited unchanged from Chatbot. A prefetcher,
+    if given, runs on its own (synchronous) managers in background threads. Session,
+    score and cache reads and writes block (SQLite, journal fsyncs), so they run in
+    worker threads rather than on the event loop.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.llm_semaphore = asyncio.Semaphore(self.max_llm_workers)
+
+    async def _bounded(self, coro, fallback):
+        """Await an LLM call under the concurrency limit; cancel it and return the fallback on timeout"""
+        async def run():
+            async with self.llm_semaphore:
+                return await coro
+        try:
+            return await asyncio.wait_for(run(), timeout=self.llm_timeout)
+        except asyncio.TimeoutError:
+            return fallback
+
+    async def handle_message(self, session_id, message):
+        """Main method to handle incoming messages"""
+        state = await asyncio.to_thread(self.get_or_create_session, session_id)
+        with span("handler", state=state.conversation_state):
+            response = await self._dispatch(state, session_id, message)
+        with span("store.session_write"):
+            await self.sessions.set_async(state.session_id, state)
+        return response
+
+    async def _dispatch(self, state, session_id, message):
+        """Route a message to the handler for the session's conversation state"""
+        if not message:
+            return {"response": "Please type a message."}
+
+        if state.conversation_state == "waiting_for_course":
+            return await self._handle_waiting_for_course(state, message)
+        elif state.conversation_state == "confirming_course":
+            return await self._handle_course_confirmation(state, message)
+        elif state.conversation_state == "awaiting_next_topic_permission":
+            return await self._handle_next_topic_permission(state, message)
+        elif state.conversation_state == "awaiting_clarification":
+            return await self._handle_clarification(state, message)
+        elif state.conversation_state == "awaiting_quiz_choice":
+            return self._handle_quiz_choice(state, message)
+        elif state.conversation_state == "quiz_question":
+            return await self._handle_quiz_answer(state, message, session_id)
+        elif state.conversation_state == "awaiting_next_quiz_question":
+            return self._handle_next_quiz_question(state)
+        else:
+            return await self._handle_default_case(state, message)
+
+    async def _select_course(self, state, course):
+        self._leave_course(state)
+        state.selected_course = course
+        state.topics = self.course_manager.get_topics(course)
+        state.current_topic_index = 0
+        state.conversation_state = "explaining_topic"
+        return {"response": await self._explain_next_topic(state)}
+
+    async def _handle_waiting_for_course(self, state, message):
+        matched = self.course_manager.get_matched_course(message)
+        if matched:
+            return await self._select_course(state, matched)
+        suggestion = self._suggest_course(state, message)
+        if suggestion:
+            return suggestion
+        courses = "\n".join(f"- {course}" for course in self.course_manager.get_courses())
+        return {"response": f"I couldn't find that course. Here are the available ones:\n\n{courses}"}
+
+    async def _handle_course_confirmation(self, state, message):
+        course, state.suggested_course = state.suggested_course, None
+        if message.lower() in ["yes", "y"] and course:
+            return await self._select_course(state, course)
+        state.conversation_state = "waiting_for_course"
+        return await self._handle_waiting_for_course(state, message)
+
+    async def _handle_next_topic_permission(self, state, message):
+        if message.lower() in ["yes", "y"]:
+            state.current_topic_index += 1
+            state.conversation_state = "explaining_topic"
+            return {"response": await self._explain_next_topic(state)}
+        else:
+            state.conversation_state = "awaiting_clarification"
+            state.current_topic_for_clarification = state.topics[state.current_topic_index]
+            return {"response": "Could you please specify which part you didn't understand?"}
+
+    async def _handle_clarification(self, state, message):
+        response = await self._simplify_current_topic(state, message)
+        state.conversation_state = "awaiting_quiz_choice"
+        return {"response": response}
+
+    async def _handle_quiz_answer(self, state, user_answer, session_id):
+        index = state.current_quiz_index
+        quiz_questions = state.quiz_questions
+
+        if index >= len(quiz_questions):
+            return {"response": "✅ You've already completed the quiz. Type 'yes' to proceed to the next topic."}
+
+        current_q = quiz_questions[index]
+        correct = current_q["answer"]
+        course = state.selected_course
+
+        explanation = current_q.get("explanation")
+        if not explanation:
+            explanation = self._take_prefetched_answer(state, current_q['question'])
+        if not explanation:
+            explanation = await self._bounded(
+                self.quiz_manager.get_answer_explanation(course, current_q['question'], correct),
+                "Error getting explanation: the request timed out."
+            )
+
+        return await asyncio.to_thread(self._score_quiz_answer, state, user_answer, session_id, explanation)
+
+    async def _handle_default_case(self, state, message):
+        matched = self.course_manager.get_matched_course(message)
+        if matched:
+            return await self._select_course(state, matched)
+        return self._suggest_course(state, message) or {"response": "I'm here to assist you! Please type a valid course name."}
+
+    async def _explain_next_topic(self, state):
+        topics = state.topics
+        index = state.current_topic_index
+
+        if index >= len(topics):
+            self._leave_course(state)
+            return "🎉 You've completed all the topics and quizzes. Well done!"
+
+        topic = topics[index]
+        course = state.selected_course
+
+        prefetched = self._take_prefetched_topic(state, course, topic)
+        remembered = None if prefetched else await asyncio.to_thread(self._remembered_explanation, state, topic)
+        if prefetched:
+            explanation, state.quiz_questions = prefetched
+            self._remember_explanation(state, course, topic, explanation)
+        elif remembered is not None:
+            explanation = remembered
+            state.quiz_questions = await self._bounded(self.quiz_manager.generate_quiz_questions(course, topic), [])
+        else:
+            explanation, state.quiz_questions = await asyncio.gather(
+                self._bounded(self.explanation_manager.fetch_topic_explanation(course, topic), TIMED_OUT),
+                self._bounded(self.quiz_manager.generate_quiz_questions(course, topic), [])
+            )
+            if explanation is TIMED_OUT:
+                explanation = EXPLANATION_TIMEOUT_MESSAGE
+            else:
+                self._remember_explanation(state, course, topic, explanation)
+
+        state.current_quiz_index = 0
+        state.conversation_state = "awaiting_quiz_choice"
+        self._prefetch_next_topic(state)
+
+        return f"**{topic}**:\n{explanation}\n\nWould you like to try a quiz on this topic? (yes/no)"
+
+    async def _simplify_current_topic(self, state, clarification):
+        topic = state.current_topic_for_clarification or state.topics[state.current_topic_index]
+        course = state.selected_course
+
+        remembered = await asyncio.to_thread(self._remembered_explanation, state, topic)
+        simple_explanation, state.quiz_questions = await asyncio.gather(
+            self._bounded(
+                self.explanation_manager.simplify_explanation(course, topic, clarification, remembered),
+                "Sorry, I couldn't fetch a simplified explanation: the request timed out."
+            ),
+            self._bounded(self.quiz_manager.generate_quiz_questions(course, topic), [])
+        )
+        state.current_quiz_index = 0
+        state.conversation_state = "awaiting_quiz_choice"
+
+        return f"Here's a simpler explanation:\n\n{simple_explanation}\n\nWould you like to try a quiz on this topic? (yes/no)"
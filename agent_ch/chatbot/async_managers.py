@@ -0,0 +1,96 @@
+import asyncio
+from .managers import QuizManager, ExplanationManager
+from .llm import AsyncGroqProvider
+
+def create_async_client(api_key, max_connections=100, max_keepalive_connections=20, timeout=60.0):
+    """Build one AsyncGroq client with a shared, keep-alive connection pool"""
+    import httpx
+    from groq import AsyncGroq, DefaultAsyncHttpxClient
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections
+        ),
+        timeout=timeout
+    )
+    return AsyncGroq(api_key=api_key, http_client=http_client)
+
+class AsyncQuizManager(QuizManager):
+    """QuizManager whose LLM calls are coroutines on an AsyncLLMProvider (or AsyncGroq client).
+
+    Content cache reads and writes are SQLite calls, so they run in a worker thread.
+    """
+    provider_class = AsyncGroqProvider
+
+    async def _request_quiz(self, messages, config):
+        """Send one quiz request and return the raw reply text"""
+        reply = await self.llm.complete(messages, config, json_mode=True)
+        return reply.strip()
+
+    async def generate_quiz_questions(self, course, topic):
+        """Generate quiz questions for a given topic, re-asking on replies that fail validation"""
+        variant, cached = await asyncio.to_thread(self._cached_quiz, course, topic)
+        if cached is not None:
+            return cached
+        messages = self._quiz_messages(course, topic)
+        config = self._config("quiz", course, topic)
+        try:
+            for _ in range(self.max_reasks + 1):
+                reply = await self._request_quiz(messages, config)
+                self._account("quiz", course, topic, messages, config, reply)
+                quiz_questions, errors = self._check_reply(reply)
+                if quiz_questions:
+                    await asyncio.to_thread(self.store_quiz, course, topic, variant, quiz_questions)
+                    return quiz_questions
+                messages = self._reask_messages(messages, reply, errors)
+            return []
+        except Exception as e:
+            return [{"question": f"Error generating quiz: {str(e)}", "answer": ""}]
+
+    async def get_answer_explanation(self, course, question, correct_answer):
+        """Get explanation for why an answer is correct"""
+        try:
+            messages = self._answer_messages(course, question, correct_answer)
+            config = self._config("answer", course)
+            explanation = (await self.llm.complete(messages, config)).strip()
+            self._account("answer", course, None, messages, config, explanation)
+            return explanation
+        except Exception as e:
+            return f"Error getting explanation: {str(e)}"
+
+class AsyncExplanationManager(ExplanationManager):
+    """ExplanationManager whose LLM calls are coroutines on an AsyncLLMProvider (or AsyncGroq client).
+
+    Content cache reads and writes are SQLite calls, so they run in a worker thread.
+    """
+    provider_class = AsyncGroqProvider
+
+    async def fetch_topic_explanation(self, course, topic):
+        """Fetch detailed explanation for a topic, checking the shared cache first"""
+        cached = await asyncio.to_thread(self._cached_explanation, course, topic)
+        if cached is not None:
+            return cached
+        try:
+            messages = self._explanation_messages(course, topic)
+            config = self._config("explanation", course, topic)
+            explanation = (await self.llm.complete(messages, config)).strip()
+            self._account("explanation", course, topic, messages, config, explanation)
+            await asyncio.to_thread(self._store_explanation, course, topic, explanation)
+            return explanation
+        except Exception as e:
+            return f"Error fetching explanation: {str(e)}"
+
+    async def simplify_explanation(self, course, topic, clarification, explanation=None):
+        """Provide a simplified explanation of a topic based on user's confusion"""
+        cached = self._cached_clarification(course, topic, clarification)
+        if cached is not None:
+            return cached
+        try:
+            messages = self._simplify_messages(course, topic, clarification, explanation)
+            config = self._config("simplify", course, topic)
+            simplified = (await self.llm.complete(messages, config)).strip()
+            self._account("simplify", course, topic, messages, config, simplified)
+            self._store_clarification(course, topic, clarification, simplified)
+            return simplified
+        except Exception as e:
+            return f"Sorry, I couldn't fetch a simplified explanation due to an error: {str(e)}"
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import random
+import sqlite3
+import threading
+import time
+from .metrics import span
+
+class ContentCache:
+    """Shared, SQLite-backed cache for generated topic content"""
+
+    def __init__(self, db_file="content_cache.db", ttl=7 * 24 * 3600, max_entries=5000, quiz_variants=3):
+        self.db_file = db_file
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.quiz_variants = max(1, quiz_variants)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self._init_db()
+
+    def _init_db(self):
+        """Create the cache table and indexes if they don't exist"""
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS content (
+                    key TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    course TEXT NOT NULL,
+                    topic TEXT NOT NULL,
+                    variant INTEGER NOT NULL DEFAULT 0,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_content_accessed ON content(accessed_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_content_created ON content(created_at)")
+
+    @staticmethod
+    def make_key(kind, model, course, topic, prompt_version, variant=0):
+        """Build a content-addressed key for a cache entry"""
+        raw = json.dumps([kind, model, course, topic, prompt_version, variant], separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, kind, model, course, topic, prompt_version, variant=0):
+        """Return a cached value, or None on a miss or expired entry"""
+        return self.get_by_key(self.make_key(kind, model, course, topic, prompt_version, variant))
+
+    def get_by_key(self, key):
+        """Return a cached value by its content-addressed key, or None"""
+        now = time.time()
+        with span("store.cache_read"), self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM content WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.ttl and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE content SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def peek(self, key):
+        """Return (value, age in seconds) for a live entry without counting a hit, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM content WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        age = time.time() - row[1]
+        if self.ttl and age > self.ttl:
+            return None
+        return row[0], age
+
+    def put(self, kind, model, course, topic, prompt_version, value, variant=0):
+        """Store a value and evict least recently used entries over capacity"""
+        key = self.make_key(kind, model, course, topic, prompt_version, variant)
+        now = time.time()
+        with span("store.cache_write"), self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO content "
+                "(key, kind, model, course, topic, variant, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, kind, model, course, topic, variant, value, now, now),
+            )
+            self._evict()
+        return key
+
+    def pick_quiz_variant(self):
+        """Choose which slot of the quiz variant pool to serve"""
+        return random.randrange(self.quiz_variants)
+
+    def _evict(self):
+        """Drop expired entries and trim the table to max_entries (LRU)"""
+        if self.ttl:
+            self._conn.execute("DELETE FROM content WHERE created_at < ?", (time.time() - self.ttl,))
+        if self.max_entries:
+            count = self._conn.execute("SELECT COUNT(*) FROM content").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM content WHERE key IN "
+                    "(SELECT key FROM content ORDER BY accessed_at ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def clear(self):
+        """Remove every cached entry"""
+        with self._lock:
+            self._conn.execute("DELETE FROM content")
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM content").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": size,
+        }
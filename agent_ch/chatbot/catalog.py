@@ -0,0 +1,106 @@
+import re
+from collections import namedtuple
+
+# Keys in data.json that describe the catalog rather than being courses
+RESERVED_KEYS = ("Courses", "Aliases")
+
+Topic = namedtuple("Topic", ["course", "name", "subtopics"])
+
+def normalize(text):
+    """Lowercase and collapse punctuation/whitespace for lookups"""
+    return " ".join(re.sub(r"[^\w+#]+", " ", text.lower()).split())
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def edit_distance(a, b, limit=None):
+    """Optimal string alignment distance (Levenshtein plus adjacent transpositions)"""
+    if abs(len(a) - len(b)) > (limit if limit is not None else max(len(a), len(b))):
+        return abs(len(a) - len(b))
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        row = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            row[j] = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], prev2[j - 2] + 1)
+        prev2, prev = prev, row
+    return prev[-1]
+
+class Catalog:
+    """Immutable, pre-indexed view of the course data.
+
+    Built once from data.json: exact and alias lookups are dict hits, and typos fall
+    back to a trigram index that narrows the candidates before edit distance is checked.
+    Topics are identified by (course, name), which stays the same across reloads.
+    """
+
+    def __init__(self, course_data):
+        # "Courses" sets the display order; courses missing from it are still served, after the listed ones
+        keys = [key for key in course_data if key not in RESERVED_KEYS]
+        listed = list(course_data.get("Courses") or [])
+        unlisted = [key for key in keys if key not in listed]
+        if listed and unlisted:
+            print(f"Courses missing from the \"Courses\" list in the course data, served last: {', '.join(unlisted)}")
+        self.courses = tuple(dict.fromkeys(
+            course for course in listed + unlisted
+            if course not in RESERVED_KEYS and isinstance(course_data.get(course), dict)
+        ))
+
+        self._topics = {
+            course: tuple(Topic(course, name, tuple(subtopics)) for name, subtopics in course_data[course].items())
+            for course in self.courses
+        }
+
+        # Every name a course can be typed as, normalized -> canonical course
+        names = {normalize(course): course for course in self.courses}
+        for alias, course in course_data.get("Aliases", {}).items():
+            if course in self.courses:
+                names.setdefault(normalize(alias), course)
+        self._names = names
+
+        self._trigram_index = {}
+        for name in names:
+            for gram in trigrams(name):
+                self._trigram_index.setdefault(gram, set()).add(name)
+
+    def match_course(self, user_input):
+        """Return the canonical course for a course name or alias, or None"""
+        if not user_input:
+            return None
+        return self._names.get(normalize(user_input))
+
+    def closest_course(self, user_input, max_distance=None):
+        """Return the course whose name is within a few typos of user input, or None.
+
+        A guess: "lava" and "hava" both come out as Java, so confirm it before acting on it.
+        """
+        if not user_input:
+            return None
+        key = normalize(user_input)
+        if len(key) < 3:
+            return None
+        limit = max_distance if max_distance is not None else max(1, len(key) // 4)
+        grams = trigrams(key)
+        counts = {}
+        for gram in grams:
+            for name in self._trigram_index.get(gram, ()):
+                counts[name] = counts.get(name, 0) + 1
+
+        best, best_distance = None, limit + 1
+        # Check the names sharing the most trigrams first
+        for name, _ in sorted(counts.items(), key=lambda item: -item[1])[:10]:
+            distance = edit_distance(key, name, limit)
+            if distance < best_distance:
+                best, best_distance = name, distance
+        return self._names[best] if best is not None else None
+
+    def topics(self, course):
+        """Return the Topic entries of a course, in order"""
+        return self._topics.get(course, ())
+
+    def topic_names(self, course):
+        return [topic.name for topic in self.topics(course)]
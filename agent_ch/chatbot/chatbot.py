@@ -1,29 +1,126 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from .models import SessionState
+from .session_store import InMemorySessionStore
 from .managers import CourseManager, QuizManager, ExplanationManager, ScoreManager
+from .metrics import span
+from .llm import llm_deadline
+
+EXPLANATION_TIMEOUT_MESSAGE = "Error fetching explanation: the request timed out."
+
+# Fallback _wait() returns for a call that did not finish in time
+TIMED_OUT = object()
 
 class Chatbot:
-    def __init__(self, course_manager, explanation_manager, quiz_manager, score_manager):
+    def __init__(self, course_manager, explanation_manager, quiz_manager, score_manager,
+                 max_llm_workers=8, llm_timeout=30, prefetcher=None, session_store=None):
         self.course_manager = course_manager
         self.explanation_manager = explanation_manager
         self.quiz_manager = quiz_manager
         self.score_manager = score_manager
-        self.sessions = {}
+        self.sessions = session_store if session_store is not None else InMemorySessionStore()
+        self.max_llm_workers = max_llm_workers
+        self.llm_timeout = llm_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_llm_workers, thread_name_prefix="llm")
+        self.prefetcher = prefetcher
+
+    def _submit(self, fn, *args):
+        """Start an LLM call on the shared, bounded executor, inside the caller's metrics context.
+
+        The call gets llm_timeout from when a worker picks it up; the gateway and the
+        provider stop it then, so a late call gives its worker and quota back.
+        """
+        return self.executor.submit(contextvars.copy_context().run, self._run_bounded, fn, args)
+
+    def _run_bounded(self, fn, args):
+        with llm_deadline(self.llm_timeout):
+            return fn(*args)
+
+    def _wait(self, future, fallback, deadline):
+        """Return a call's result, or the fallback if it is still queued for a worker at the deadline.
+
+        A call that already started is waited for: it stops itself llm_timeout after it started.
+        """
+        try:
+            return future.result(timeout=max(0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            if future.cancel():
+                return fallback
+        try:
+            return future.result(timeout=self.llm_timeout)
+        except FutureTimeoutError:
+            return fallback
+
+    def _prefetch_next_topic(self, state):
+        """Speculatively generate the topic after the current one"""
+        next_index = state.current_topic_index + 1
+        if self.prefetcher and next_index < len(state.topics):
+            self.prefetcher.schedule_topic(state.session_id, state.selected_course, state.topics[next_index])
+
+    def _take_prefetched_topic(self, state, course, topic):
+        """Return a prefetched (explanation, quiz_questions) pair for this topic, if any"""
+        if not self.prefetcher:
+            return None
+        return self.prefetcher.take_topic(state.session_id, course, topic)
+
+    def _take_prefetched_answer(self, state, question):
+        """Return the prefetched answer explanation for a quiz question, if any"""
+        if not self.prefetcher:
+            return None
+        return self.prefetcher.take_answer(state.session_id, question)
+
+    def _remembered_explanation(self, state, topic):
+        """Return the explanation this session already saw for a topic, if it can still be resolved"""
+        ref = state.explanations.get(topic)
+        if ref is None:
+            return None
+        return self.explanation_manager.resolve_explanation(ref)
+
+    def _remember_explanation(self, state, course, topic, explanation):
+        """Keep a reference (not a copy) of the explanation in the session"""
+        state.remember_explanation(topic, self.explanation_manager.explanation_ref(course, topic, explanation))
+
+    def memory_usage(self):
+        """Report session memory: count, total and average bytes"""
+        return self.sessions.memory_usage()
+
+    def _leave_course(self, state):
+        """Cancel speculative work once the learner leaves or finishes a course"""
+        if self.prefetcher:
+            self.prefetcher.cancel(state.session_id)
     
     def get_or_create_session(self, session_id):
         """Get existing session or create a new one"""
-        if session_id not in self.sessions:
-            self.sessions[session_id] = SessionState()
-        return self.sessions[session_id]
+        with span("store.session_read"):
+            state = self.sessions.get(session_id)
+        if state is None:
+            state = SessionState(session_id)
+            self.sessions.set(session_id, state)
+        return state
+
+    def save_session(self, state):
+        """Persist a session after its state machine has moved"""
+        with span("store.session_write"):
+            self.sessions.set(state.session_id, state)
     
     def handle_message(self, session_id, message):
         """Main method to handle incoming messages"""
         state = self.get_or_create_session(session_id)
+        with span("handler", state=state.conversation_state):
+            response = self._dispatch(state, session_id, message)
+        self.save_session(state)
+        return response
 
+    def _dispatch(self, state, session_id, message):
+        """Route a message to the handler for the session's conversation state"""
         if not message:
             return {"response": "Please type a message."}
 
         if state.conversation_state == "waiting_for_course":
             return self._handle_waiting_for_course(state, message)
+        elif state.conversation_state == "confirming_course":
+            return self._handle_course_confirmation(state, message)
         elif state.conversation_state == "awaiting_next_topic_permission":
             return self._handle_next_topic_permission(state, message)
         elif state.conversation_state == "awaiting_clarification":
@@ -36,19 +133,82 @@ class Chatbot:
             return self._handle_next_quiz_question(state)
         else:
             return self._handle_default_case(state, message)
-    
+
+    def handle_message_stream(self, session_id, message):
+        """Like handle_message, but yields the response text in chunks as the LLM produces it.
+
+        State transitions are committed only once the stream has been fully consumed.
+        """
+        state = self.get_or_create_session(session_id)
+        with span("handler", state=state.conversation_state):
+            yield from self._dispatch_stream(state, session_id, message)
+        self.save_session(state)
+
+    def _dispatch_stream(self, state, session_id, message):
+        if not message:
+            yield "Please type a message."
+            return
+
+        if state.conversation_state in ("waiting_for_course", "explaining_topic"):
+            matched = self.course_manager.get_matched_course(message)
+            if matched:
+                self._leave_course(state)
+                topics = self.course_manager.get_topics(matched)
+                yield from self._stream_next_topic(state, matched, topics, 0)
+                return
+        elif state.conversation_state == "confirming_course":
+            if message.lower() in ["yes", "y"] and state.suggested_course:
+                course, state.suggested_course = state.suggested_course, None
+                self._leave_course(state)
+                yield from self._stream_next_topic(state, course, self.course_manager.get_topics(course), 0)
+                return
+        elif state.conversation_state == "awaiting_next_topic_permission":
+            if message.lower() in ["yes", "y"]:
+                yield from self._stream_next_topic(
+                    state, state.selected_course, state.topics, state.current_topic_index + 1
+                )
+                return
+        elif state.conversation_state == "awaiting_clarification":
+            yield from self._stream_simplified_topic(state, message)
+            return
+
+        yield self._dispatch(state, session_id, message)["response"]
+
+
+    def _select_course(self, state, course):
+        self._leave_course(state)
+        state.selected_course = course
+        state.topics = self.course_manager.get_topics(course)
+        state.current_topic_index = 0
+        state.conversation_state = "explaining_topic"
+        return {"response": self._explain_next_topic(state)}
+
+    def _suggest_course(self, state, message):
+        """Ask before switching to the course a misspelled name looks like; returns the question, or None"""
+        suggested = self.course_manager.get_suggested_course(message)
+        if not suggested:
+            return None
+        state.suggested_course = suggested
+        state.conversation_state = "confirming_course"
+        return {"response": f"Did you mean {suggested}? (yes/no)"}
 
     def _handle_waiting_for_course(self, state, message):
         matched = self.course_manager.get_matched_course(message)
         if matched:
-            state.selected_course = matched
-            state.topics = self.course_manager.get_topics(matched)
-            state.current_topic_index = 0
-            state.conversation_state = "explaining_topic"
-            return {"response": self._explain_next_topic(state)}
-        else:
-            courses = "\n".join(f"- {course}" for course in self.course_manager.get_courses())
-            return {"response": f"I couldn't find that course. Here are the available ones:\n\n{courses}"}
+            return self._select_course(state, matched)
+        suggestion = self._suggest_course(state, message)
+        if suggestion:
+            return suggestion
+        courses = "\n".join(f"- {course}" for course in self.course_manager.get_courses())
+        return {"response": f"I couldn't find that course. Here are the available ones:\n\n{courses}"}
+
+    def _handle_course_confirmation(self, state, message):
+        course, state.suggested_course = state.suggested_course, None
+        if message.lower() in ["yes", "y"] and course:
+            return self._select_course(state, course)
+        # Anything else is another go at naming the course
+        state.conversation_state = "waiting_for_course"
+        return self._handle_waiting_for_course(state, message)
     
     def _handle_next_topic_permission(self, state, message):
         if message.lower() in ["yes", "y"]:
@@ -80,23 +240,40 @@ class Chatbot:
         quiz_questions = state.quiz_questions
 
         if index >= len(quiz_questions):
-            print(index, len(quiz_questions))
             return {"response": "✅ You've already completed the quiz. Type 'yes' to proceed to the next topic."}
 
         current_q = quiz_questions[index]
         correct = current_q["answer"]
         course = state.selected_course
 
-        explanation = self.quiz_manager.get_answer_explanation(course, current_q['question'], correct)
+        # Rationales normally arrive with the quiz; only older or partial quizzes need a call
+        explanation = current_q.get("explanation") or self._take_prefetched_answer(state, current_q['question'])
+        if not explanation:
+            explanation = self.quiz_manager.get_answer_explanation(course, current_q['question'], correct)
+
+        return self._score_quiz_answer(state, user_answer, session_id, explanation)
+
+    def _score_quiz_answer(self, state, user_answer, session_id, explanation):
+        """Grade the current question, record the score and advance the quiz"""
+        quiz_questions = state.quiz_questions
+        correct = quiz_questions[state.current_quiz_index]["answer"]
+        course = state.selected_course
 
         is_correct = user_answer.strip().upper() == correct.upper()
         if is_correct:
             state.score += 1
+            state.quiz_score += 1
+
+        state.answered += 1
+        course_score = state.record_answer(course, is_correct)[0]
 
         result = "✅ Correct!" if is_correct else f"❌ Incorrect. The correct answer is {correct}."
         state.current_quiz_index += 1
 
-        self.score_manager.update_score(session_id, course, state.score)
+        topic = state.topics[state.current_topic_index] if state.current_topic_index < len(state.topics) else None
+        self.score_manager.update_score(
+            session_id, course, course_score, topic=topic, correct=is_correct, quiz_score=state.quiz_score
+        )
 
         if state.current_quiz_index < len(quiz_questions):
             state.conversation_state = "awaiting_next_quiz_question"
@@ -118,12 +295,8 @@ class Chatbot:
     def _handle_default_case(self, state, message):
         matched = self.course_manager.get_matched_course(message)
         if matched:
-            state.selected_course = matched
-            state.topics = self.course_manager.get_topics(matched)
-            state.current_topic_index = 0
-            state.conversation_state = "explaining_topic"
-            return {"response": self._explain_next_topic(state)}
-        return {"response": "I'm here to assist you! Please type a valid course name."}
+            return self._select_course(state, matched)
+        return self._suggest_course(state, message) or {"response": "I'm here to assist you! Please type a valid course name."}
     
    
     def _explain_next_topic(self, state):
@@ -131,31 +304,94 @@ class Chatbot:
         index = state.current_topic_index
 
         if index >= len(topics):
+            self._leave_course(state)
             return "🎉 You've completed all the topics and quizzes. Well done!"
 
         topic = topics[index]
         course = state.selected_course
 
-        # Get explanation
-        if topic in state.explanations:
-            explanation = state.explanations[topic]
+        prefetched = self._take_prefetched_topic(state, course, topic)
+        if prefetched:
+            explanation, quiz_questions = prefetched
+            self._remember_explanation(state, course, topic, explanation)
         else:
-            explanation = self.explanation_manager.fetch_topic_explanation(course, topic)
-            state.explanations[topic] = explanation
+            # Explanation and quiz don't depend on each other: fetch them concurrently
+            deadline = time.monotonic() + self.llm_timeout
+            quiz_future = self._submit(self.quiz_manager.generate_quiz_questions, course, topic)
+            explanation = self._remembered_explanation(state, topic)
+            if explanation is None:
+                explanation_future = self._submit(self.explanation_manager.fetch_topic_explanation, course, topic)
+                explanation = self._wait(explanation_future, TIMED_OUT, deadline)
+                if explanation is TIMED_OUT:
+                    explanation = EXPLANATION_TIMEOUT_MESSAGE
+                else:
+                    self._remember_explanation(state, course, topic, explanation)
 
-        # Always generate new quiz questions
-        quiz_questions = self.quiz_manager.generate_quiz_questions(course, topic)
+            quiz_questions = self._wait(quiz_future, [], deadline)
         state.quiz_questions = quiz_questions  # Direct assignment of new questions
         state.current_quiz_index = 0
         state.conversation_state = "awaiting_quiz_choice"
+        self._prefetch_next_topic(state)
 
         return f"**{topic}**:\n{explanation}\n\nWould you like to try a quiz on this topic? (yes/no)"
-        
+
+    def _stream_next_topic(self, state, course, topics, index):
+        """Streaming counterpart of _explain_next_topic for a given course position"""
+        if index >= len(topics):
+            state.selected_course = course
+            state.topics = topics
+            state.current_topic_index = index
+            state.conversation_state = "explaining_topic"
+            self._leave_course(state)
+            yield "🎉 You've completed all the topics and quizzes. Well done!"
+            return
+
+        topic = topics[index]
+        yield f"**{topic}**:\n"
+
+        prefetched = self._take_prefetched_topic(state, course, topic)
+        if prefetched:
+            explanation, quiz_questions = prefetched
+            yield explanation
+        else:
+            # Generate the quiz while the explanation streams
+            quiz_future = self._submit(self.quiz_manager.generate_quiz_questions, course, topic)
+            try:
+                explanation = self._remembered_explanation(state, topic)
+                if explanation is not None:
+                    yield explanation
+                else:
+                    parts = []
+                    for delta in self.explanation_manager.stream_topic_explanation(course, topic):
+                        parts.append(delta)
+                        yield delta
+                    explanation = "".join(parts).strip()
+            except GeneratorExit:
+                quiz_future.cancel()
+                raise
+
+            quiz_questions = self._wait(quiz_future, [], time.monotonic() + self.llm_timeout)
+
+        # Stream finished: commit the transition in one go
+        state.selected_course = course
+        state.topics = topics
+        state.current_topic_index = index
+        self._remember_explanation(state, course, topic, explanation)
+        state.quiz_questions = quiz_questions
+        state.current_quiz_index = 0
+        state.conversation_state = "awaiting_quiz_choice"
+        self._prefetch_next_topic(state)
+
+        yield "\n\nWould you like to try a quiz on this topic? (yes/no)"
+
     def _start_quiz(self, state):
         if not state.quiz_questions:
             state.current_topic_index += 1
             state.conversation_state = "explaining_topic"
             return "No quiz questions available. Moving to the next topic..."
+        state.quiz_score = 0
+        if self.prefetcher:
+            self.prefetcher.schedule_answers(state.session_id, state.selected_course, state.quiz_questions)
         return f"Let's start the quiz!\n\n{state.quiz_questions[0]['question']}"
     
     def _send_next_quiz_question(self, state):
@@ -174,13 +410,41 @@ class Chatbot:
         topic = state.current_topic_for_clarification or state.topics[state.current_topic_index]
         course = state.selected_course
         
-        # Get simplified explanation
-        simple_explanation = self.explanation_manager.simplify_explanation(course, topic, clarification)
-        
-        # Generate new quiz questions after simplification
-        new_quiz_questions = self.quiz_manager.generate_quiz_questions(course, topic)
+        # Simplified explanation and fresh quiz questions are fetched concurrently
+        deadline = time.monotonic() + self.llm_timeout
+        quiz_future = self._submit(self.quiz_manager.generate_quiz_questions, course, topic)
+        simplify_future = self._submit(
+            self.explanation_manager.simplify_explanation, course, topic, clarification,
+            self._remembered_explanation(state, topic)
+        )
+        simple_explanation = self._wait(
+            simplify_future, "Sorry, I couldn't fetch a simplified explanation: the request timed out.", deadline
+        )
+        new_quiz_questions = self._wait(quiz_future, [], deadline)
         state.quiz_questions = new_quiz_questions  # Direct assignment of new questions
         state.current_quiz_index = 0
         state.conversation_state = "awaiting_quiz_choice"
         
         return f"Here's a simpler explanation:\n\n{simple_explanation}\n\nWould you like to try a quiz on this topic? (yes/no)"
+
+    def _stream_simplified_topic(self, state, clarification):
+        """Streaming counterpart of _simplify_current_topic"""
+        topic = state.current_topic_for_clarification or state.topics[state.current_topic_index]
+        course = state.selected_course
+
+        quiz_future = self._submit(self.quiz_manager.generate_quiz_questions, course, topic)
+        try:
+            yield "Here's a simpler explanation:\n\n"
+            yield from self.explanation_manager.stream_simplified_explanation(
+                course, topic, clarification, self._remembered_explanation(state, topic)
+            )
+        except GeneratorExit:
+            quiz_future.cancel()
+            raise
+
+        new_quiz_questions = self._wait(quiz_future, [], time.monotonic() + self.llm_timeout)
+        state.quiz_questions = new_quiz_questions
+        state.current_quiz_index = 0
+        state.conversation_state = "awaiting_quiz_choice"
+
+        yield "\n\nWould you like to try a quiz on this topic? (yes/no)"
@@ -0,0 +1,163 @@
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from .catalog import edit_distance
+
+# Words that carry the learner's confusion rather than what they are confused about
+FILLER_WORDS = frozenset("""
+    a about again am an and are bit can could confuse confused confuses confusing confusion did didn didnt do does doesnt don dont
+    explain explained explanation get getting got help how i im is it its just me mean means more my not
+    lost part please really simple simpler simply so some still terms that the this understand what whats
+    why with work works you
+""".split())
+
+def normalize_clarification(text):
+    """Lowercase, drop punctuation and filler words: "I didn't get append?" -> "append" """
+    words = re.sub(r"[^\w+#]+", " ", text.lower().replace("'", "")).split()
+    kept = [word for word in words if word not in FILLER_WORDS]
+    return " ".join(kept or words)
+
+def same_terms(a, b):
+    """Whether two normalized clarifications ask about the same things.
+
+    Similar spelling is not enough: "list and tuple" vs "tuple and set", or "range 10"
+    vs "range 1 10", are different questions. Numbers have to match exactly; other
+    words need a counterpart in the other text, allowing one typo in longer words.
+    """
+    words_a, words_b = set(a.split()), set(b.split())
+    if {w for w in words_a if w.isdigit()} != {w for w in words_b if w.isdigit()}:
+        return False
+
+    def covered(words, others):
+        return all(
+            word in others or (len(word) >= 4 and any(edit_distance(word, other, 1) <= 1 for other in others))
+            for word in words if not word.isdigit()
+        )
+    return covered(words_a, words_b) and covered(words_b, words_a)
+
+def _numpy():
+    """numpy, imported on first use: it is the slowest import in the app and only
+    needed once a clarification is asked"""
+    import numpy
+    return numpy
+
+class _TopicEntries:
+    """Vectors and answers cached for one (course, topic)"""
+
+    def __init__(self, dims):
+        np = _numpy()
+        self.ids = []
+        self.texts = []
+        self.answers = []
+        self.matrix = np.zeros((0, dims), dtype=np.float32)
+
+    def add(self, entry_id, text, answer, vector):
+        self.ids.append(entry_id)
+        self.texts.append(text)
+        self.answers.append(answer)
+        self.matrix = _numpy().vstack([self.matrix, vector])
+
+    def remove(self, entry_id):
+        row = self.ids.index(entry_id)
+        del self.ids[row], self.texts[row], self.answers[row]
+        self.matrix = _numpy().delete(self.matrix, row, axis=0)
+
+class ClarificationCache:
+    """Per-(course, topic) cache of simplified explanations, matched by similar wording.
+
+    Clarifications are normalized, turned into hashed character n-gram vectors and
+    compared by cosine similarity against the ones already answered for the same topic;
+    the closest match at or above `threshold` that also asks about the same terms (see
+    same_terms) is served instead of a new LLM call. Size is bounded overall
+    (`max_entries`) and per topic, evicting least recently used entries.
+    """
+
+    def __init__(self, threshold=0.9, max_entries=2000, max_per_topic=50, dims=1024, ngram=3):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_per_topic = max_per_topic
+        self.dims = dims
+        self.ngram = ngram
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._topics = {}            # (course, topic) -> _TopicEntries
+        self._lru = OrderedDict()    # entry id -> (course, topic), least recently used first
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def vectorize(self, text):
+        """Unit-length vector of the hashed character n-grams of normalized text"""
+        np = _numpy()
+        padded = f" {text} "
+        grams = [padded[i:i + self.ngram] for i in range(max(1, len(padded) - self.ngram + 1))]
+        indices = [zlib.crc32(gram.encode("utf-8")) % self.dims for gram in grams]
+        vector = np.bincount(indices, minlength=self.dims).astype(np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, course, topic, clarification):
+        """Return the cached answer to a similar clarification on this topic, or None"""
+        text = normalize_clarification(clarification)
+        vector = self.vectorize(text)
+        with self._lock:
+            entries = self._topics.get((course, topic))
+            if entries is None or not entries.ids:
+                self.misses += 1
+                return None
+            similarities = entries.matrix @ vector
+            for row in _numpy().argsort(-similarities):
+                if similarities[row] < self.threshold:
+                    break
+                if same_terms(text, entries.texts[row]):
+                    self.hits += 1
+                    self._lru.move_to_end(entries.ids[row])
+                    return entries.answers[row]
+            self.misses += 1
+            return None
+
+    def put(self, course, topic, clarification, answer):
+        """Remember the answer to a clarification"""
+        text = normalize_clarification(clarification)
+        vector = self.vectorize(text)
+        with self._lock:
+            entries = self._topics.setdefault((course, topic), _TopicEntries(self.dims))
+            if text in entries.texts:
+                return
+            entry_id = self._next_id
+            self._next_id += 1
+            entries.add(entry_id, text, answer, vector)
+            self._lru[entry_id] = (course, topic)
+            if len(entries.ids) > self.max_per_topic:
+                key = (course, topic)
+                self._evict(next(i for i, owner in self._lru.items() if owner == key))
+            while len(self._lru) > self.max_entries:
+                self._evict(next(iter(self._lru)))
+
+    def _evict(self, entry_id):
+        """Drop one entry (lock held)"""
+        key = self._lru.pop(entry_id)
+        entries = self._topics[key]
+        entries.remove(entry_id)
+        if not entries.ids:
+            del self._topics[key]
+        self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._topics.clear()
+            self._lru.clear()
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._lru),
+                "topics": len(self._topics),
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,391 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from contextvars import ContextVar
+from .llm import LLMProvider, AsyncLLMProvider, LLMTimeoutError, time_left
+from .metrics import metrics
+from .prompts import count_tokens, count_message_tokens
+
+# Queue priorities: lower goes first
+INTERACTIVE = 0
+BACKGROUND = 1   # prefetch and cache warm-up
+
+_priority = ContextVar("llm_priority", default=INTERACTIVE)
+
+@contextmanager
+def llm_priority(priority):
+    """Run LLM calls made in this block (and in contexts copied from it) at the given priority"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def is_rate_limit(error):
+    """True for a 429 from the API (groq.RateLimitError) or the stub's injected equivalent"""
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+def _retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def _text_tokens(messages, text=""):
+    """Local token count of a prompt and its reply"""
+    return count_message_tokens(messages) + count_tokens(text)
+
+class RateBudget:
+    """Sliding one-minute request and token budget, with a priority queue of waiting calls.
+
+    One budget is shared by every gateway in the process so the sync and async paths
+    draw on the same quota. A call waits until it is first in line (interactive turns
+    ahead of background work, then in arrival order) and the window has room for it.
+    A limit of 0 means unlimited.
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, window=60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self._events = deque()   # [admitted_at, tokens] per admitted call
+        self._window_tokens = 0
+        self._waiting = []       # heap of (priority, seq) tickets
+        self._seq = itertools.count()
+        self._blocked_until = 0.0
+        self._cond = threading.Condition()
+
+    def _expire(self, now):
+        while self._events and self._events[0][0] <= now - self.window:
+            self._window_tokens -= self._events.popleft()[1]
+
+    def _budget_wait(self, now, tokens):
+        """Seconds until the window has room for one more call of `tokens` (lock held)"""
+        wait = max(0.0, self._blocked_until - now)
+        if self.requests_per_minute and len(self._events) >= self.requests_per_minute:
+            oldest = self._events[len(self._events) - self.requests_per_minute]
+            wait = max(wait, oldest[0] + self.window - now)
+        # A call estimated at more than a whole minute's tokens waits for an empty window
+        tokens = min(tokens, self.tokens_per_minute)
+        if self.tokens_per_minute and self._events and self._window_tokens + tokens > self.tokens_per_minute:
+            remaining = self._window_tokens
+            for admitted_at, used in self._events:
+                remaining -= used
+                if remaining + tokens <= self.tokens_per_minute:
+                    wait = max(wait, admitted_at + self.window - now)
+                    break
+        return wait
+
+    def ticket(self, priority):
+        """A place in line for one call, to pass to acquire(); promote() can move it up while it waits"""
+        return [priority, next(self._seq)]
+
+    def _enqueue(self, priority, ticket=None):
+        with self._cond:
+            ticket = ticket or self.ticket(priority)
+            heapq.heappush(self._waiting, ticket)
+            return ticket
+
+    def promote(self, ticket, priority):
+        """Give a ticket a more urgent priority, e.g. when an interactive caller joins a background call"""
+        with self._cond:
+            if priority < ticket[0]:
+                ticket[0] = priority
+                if ticket in self._waiting:
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+
+    def _discard(self, ticket):
+        with self._cond:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def _try_admit(self, ticket, tokens):
+        """Admit the ticket if it is first in line and the budget allows.
+
+        Returns (event, None) once admitted, or (None, seconds to wait; None if not first in line).
+        """
+        now = time.monotonic()
+        self._expire(now)
+        if self._waiting[0] != ticket:
+            return None, None
+        wait = self._budget_wait(now, tokens)
+        if wait > 0:
+            return None, wait
+        heapq.heappop(self._waiting)
+        event = [now, tokens]
+        self._events.append(event)
+        self._window_tokens += tokens
+        self._cond.notify_all()
+        return event, None
+
+    def acquire(self, priority, tokens, ticket=None):
+        """Block until a call of about `tokens` may go out; returns a handle for settle().
+
+        Raises LLMTimeoutError if the caller's llm_deadline() passes first.
+        """
+        ticket = self._enqueue(priority, ticket)
+        try:
+            with self._cond:
+                while True:
+                    event, wait = self._try_admit(ticket, tokens)
+                    if event:
+                        return event
+                    timeout = min(wait, 1.0) if wait else 1.0
+                    left = time_left()
+                    self._cond.wait(timeout=timeout if left is None else min(timeout, left))
+        except BaseException:
+            self._discard(ticket)
+            raise
+
+    async def acquire_async(self, priority, tokens, ticket=None):
+        """acquire() for coroutines: polls instead of blocking the event loop"""
+        ticket = self._enqueue(priority, ticket)
+        try:
+            while True:
+                with self._cond:
+                    event, wait = self._try_admit(ticket, tokens)
+                if event:
+                    return event
+                await asyncio.sleep(min(wait, 0.05) if wait else 0.01)
+        except BaseException:
+            self._discard(ticket)
+            raise
+
+    def settle(self, event, tokens):
+        """Replace an admitted call's estimate with what it actually used"""
+        with self._cond:
+            self._expire(time.monotonic())
+            if self._events and event[0] >= self._events[0][0]:
+                self._window_tokens += tokens - event[1]
+            event[1] = tokens
+
+    def penalize(self, seconds):
+        """Hold every call back for a while, e.g. after the API answered 429"""
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            self._expire(now)
+            return {
+                "requests_in_window": len(self._events),
+                "tokens_in_window": self._window_tokens,
+                "waiting": len(self._waiting),
+                "blocked_for": max(0.0, round(self._blocked_until - now, 3)),
+            }
+
+class _Flight:
+    """One call in flight and the callers waiting for it"""
+
+    def __init__(self, priority):
+        self.priority = priority   # the most urgent priority among its callers
+        self.ticket = None         # its place in the RateBudget line while it waits
+        self.waiters = 1
+        self.future = None
+
+class _GatewayBase:
+    def __init__(self, provider, budget=None, max_retries=3, backoff_base=1.0, backoff_cap=30.0,
+                 expected_completion_tokens=512):
+        self.provider = provider
+        self.budget = budget if budget is not None else RateBudget()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.expected_completion_tokens = expected_completion_tokens
+        self.coalesced = 0
+        self.retries = 0
+        self._inflight = {}   # request key -> _Flight of the call already running
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(messages, config, json_mode):
+        raw = json.dumps([config.model, config.temperature, config.max_tokens, json_mode, messages], separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _estimate(self, messages, config):
+        return _text_tokens(messages) + (config.expected_tokens or config.max_tokens or self.expected_completion_tokens)
+
+    def _retry_delay(self, attempt, error):
+        """Seconds to back off after a 429: Retry-After if given, else exponential with jitter"""
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return retry_after
+        ceiling = min(self.backoff_cap, self.backoff_base * 2 ** attempt)
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    def _should_retry(self, attempt, error):
+        if not is_rate_limit(error) or attempt >= self.max_retries:
+            return False
+        self.retries += 1
+        metrics.inc("chatbot_llm_retries_total")
+        self.budget.penalize(self._retry_delay(attempt, error))
+        return True
+
+    def _join(self, key, start):
+        """Return (flight, is_leader): the in-flight call for key, or a new one whose future start(flight) makes.
+
+        A caller joining a call queued at a less urgent priority (an interactive turn
+        joining a prefetch) moves it up to its own priority.
+        """
+        priority = _priority.get()
+        with self._lock:
+            flight = self._inflight.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                metrics.inc("chatbot_llm_coalesced_total")
+                flight.waiters += 1
+                if priority < flight.priority:
+                    flight.priority = priority
+                    if flight.ticket is not None:
+                        self.budget.promote(flight.ticket, priority)
+                return flight, False
+            flight = self._inflight[key] = _Flight(priority)
+            flight.future = start(flight)
+            return flight, True
+
+    def _ticket(self, flight):
+        """A place in line for the flight's next attempt, at its callers' most urgent priority"""
+        with self._lock:
+            flight.ticket = self.budget.ticket(flight.priority)
+            return flight.ticket
+
+    def _leave(self, key, flight):
+        with self._lock:
+            if self._inflight.get(key) is flight:
+                del self._inflight[key]
+
+    def stats(self):
+        return dict(self.budget.stats(), coalesced=self.coalesced, retries=self.retries, in_flight=len(self._inflight))
+
+class LLMGateway(_GatewayBase, LLMProvider):
+    """Shared front for an LLMProvider: coalescing, quota and 429 retries.
+
+    Identical prompts already in flight are answered by the one call (single-flight).
+    Every call waits its turn in the RateBudget, so bursts queue instead of failing,
+    and a 429 backs the whole budget off (jittered, honouring Retry-After) before the
+    call is retried. Streams are budgeted and retried until their first chunk, but not
+    coalesced.
+    """
+
+    def _call(self, call, messages, config, flight):
+        for attempt in range(self.max_retries + 1):
+            with metrics.span("llm.queue"):
+                event = self.budget.acquire(flight.priority, self._estimate(messages, config), self._ticket(flight))
+            try:
+                result = call()
+            except Exception as e:
+                self.budget.settle(event, _text_tokens(messages))
+                if self._should_retry(attempt, e):
+                    continue
+                raise
+            self.budget.settle(event, _text_tokens(messages, result))
+            return result
+
+    def complete(self, messages, config, json_mode=False):
+        key = self._key(messages, config, json_mode)
+        flight, leader = self._join(key, lambda flight: Future())
+        if not leader:
+            try:
+                return flight.future.result(timeout=time_left())
+            except FutureTimeoutError:
+                raise LLMTimeoutError("LLM call timed out") from None
+        try:
+            result = self._call(lambda: self.provider.complete(messages, config, json_mode), messages, config, flight)
+        except Exception as e:
+            flight.future.set_exception(e)
+            raise
+        else:
+            flight.future.set_result(result)
+            return result
+        finally:
+            self._leave(key, flight)
+
+    def stream(self, messages, config):
+        priority = _priority.get()
+        for attempt in range(self.max_retries + 1):
+            with metrics.span("llm.queue"):
+                event = self.budget.acquire(priority, self._estimate(messages, config))
+            parts = []
+            try:
+                for delta in self.provider.stream(messages, config):
+                    parts.append(delta)
+                    yield delta
+            except Exception as e:
+                self.budget.settle(event, _text_tokens(messages, "".join(parts)))
+                if not parts and self._should_retry(attempt, e):
+                    continue
+                raise
+            self.budget.settle(event, _text_tokens(messages, "".join(parts)))
+            return
+
+class AsyncLLMGateway(_GatewayBase, AsyncLLMProvider):
+    """LLMGateway for an AsyncLLMProvider; pass the sync gateway's budget to share one quota.
+
+    A shared call runs as a task of its own that every caller awaits through a shield,
+    so a caller that times out or is cancelled leaves the others waiting on it; the
+    call itself is cancelled only once nobody is waiting for it any more.
+    """
+
+    async def _call(self, messages, config, json_mode, flight):
+        for attempt in range(self.max_retries + 1):
+            with metrics.span("llm.queue"):
+                event = await self.budget.acquire_async(flight.priority, self._estimate(messages, config), self._ticket(flight))
+            try:
+                result = await self.provider.complete(messages, config, json_mode)
+            except Exception as e:
+                self.budget.settle(event, _text_tokens(messages))
+                if self._should_retry(attempt, e):
+                    continue
+                raise
+            self.budget.settle(event, _text_tokens(messages, result))
+            return result
+
+    async def complete(self, messages, config, json_mode=False):
+        key = self._key(messages, config, json_mode)
+        flight, _ = self._join(key, lambda flight: asyncio.ensure_future(self._run(key, flight, messages, config, json_mode)))
+        try:
+            return await asyncio.shield(flight.future)
+        except asyncio.CancelledError:
+            with self._lock:
+                flight.waiters -= 1
+                abandoned = flight.waiters == 0
+            if abandoned:
+                flight.future.cancel()
+            raise
+
+    async def _run(self, key, flight, messages, config, json_mode):
+        try:
+            return await self._call(messages, config, json_mode, flight)
+        finally:
+            self._leave(key, flight)
+
+def gateway_from_env(provider, environ=os.environ):
+    """Wrap a provider in an LLMGateway configured from LLM_REQUESTS_PER_MINUTE,
+    LLM_TOKENS_PER_MINUTE and LLM_MAX_RETRIES.
+
+    Budgets default to Groq's free tier for llama3-8b-8192 (unlimited for the stub);
+    0 means unlimited.
+    """
+    default_rpm, default_tpm = (0, 0) if environ.get("LLM_PROVIDER", "groq") == "stub" else (30, 30000)
+    return LLMGateway(
+        provider,
+        RateBudget(
+            requests_per_minute=int(environ.get("LLM_REQUESTS_PER_MINUTE", default_rpm)),
+            tokens_per_minute=int(environ.get("LLM_TOKENS_PER_MINUTE", default_tpm))
+        ),
+        max_retries=int(environ.get("LLM_MAX_RETRIES", 3))
+    )
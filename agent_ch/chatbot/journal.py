@@ -0,0 +1,275 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+try:
+    import fcntl
+except ImportError:   # not on Windows; the directory is then not locked
+    fcntl = None
+
+SEGMENT_PATTERN = re.compile(r"^journal-(\d{8})\.log$")
+SNAPSHOT_FILE = "snapshot.jsonl"
+LOCK_FILE = "LOCK"
+
+def _fsync_directory(directory):
+    """Make a rename or unlink in the directory durable (not supported on every platform)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+class EventJournal:
+    """Append-only log of JSON-line records, written by one background thread.
+
+    Records are buffered and written in batches with a single fsync per batch
+    (group commit): the writer waits up to `commit_interval` after the first record
+    so concurrent appends share the fsync. `wait(seq)` blocks until a record is
+    durable. The log is split into numbered segments; `write_snapshot` stores a
+    full image of the state alongside the segment it supersedes, and the older
+    segments are then deleted (compaction).
+
+    One process writes a journal directory at a time: the directory is locked
+    (flock on its LOCK file) for as long as the journal is open, and opening a
+    directory another journal holds raises RuntimeError.
+    """
+
+    def __init__(self, directory, commit_interval=0.005, fsync=True):
+        self.directory = directory
+        self.commit_interval = commit_interval
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = self._lock_directory()
+        self.appended = 0      # sequence number of the last record appended
+        self.committed = 0     # sequence number of the last record made durable
+        self.batches = 0
+        self._buffer = []
+        self._async_waiters = []   # (seq, loop, future) of wait_async() callers
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()   # the open segment file
+        self._closed = False
+        segments = self.segments()
+        self.segment = segments[-1] + 1 if segments else 1
+        self._file = None
+        self._writer = threading.Thread(target=self._write_loop, name="journal-writer", daemon=True)
+        self._writer.start()
+
+    def _lock_directory(self):
+        lock_file = open(os.path.join(self.directory, LOCK_FILE), "a")
+        if fcntl is None:
+            return lock_file
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise RuntimeError(
+                f"journal directory {self.directory} is already open in another journal (another worker?); "
+                "give each process its own directory, or use SESSION_STORE=sqlite to share sessions"
+            )
+        return lock_file
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"journal-{number:08d}.log")
+
+    def segments(self):
+        """Numbers of the segment files on disk, oldest first"""
+        numbers = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def append(self, line):
+        """Queue one record (a JSON line without the newline); returns its sequence number"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("journal is closed")
+            self._buffer.append(line)
+            self.appended += 1
+            self._cond.notify_all()
+            return self.appended
+
+    def wait(self, seq, timeout=None):
+        """Block until record `seq` has been written and fsynced; returns False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.committed >= seq or self._closed, timeout)
+
+    async def wait_async(self, seq):
+        """wait() for coroutines: resolves once record `seq` is durable, without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._cond:
+            if self.committed >= seq or self._closed:
+                return True
+            self._async_waiters.append((seq, loop, future))
+        await future
+        return True
+
+    def _wake_async_waiters(self):
+        """Resolve the wait_async() futures whose records are durable (cond held)"""
+        ready = [waiter for waiter in self._async_waiters if waiter[0] <= self.committed or self._closed]
+        if not ready:
+            return
+        self._async_waiters = [waiter for waiter in self._async_waiters if waiter not in ready]
+        for _, loop, future in ready:
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:   # the loop has been closed
+                pass
+
+    def _commit(self):
+        """Write and fsync everything buffered so far (io lock held).
+
+        If that fails the batch goes back in front of the buffer, to be retried in a
+        new segment (the old one may end in a partial line), and nothing in it counts
+        as committed.
+        """
+        with self._cond:
+            batch, self._buffer = self._buffer, []
+            upto = self.appended
+        if batch:
+            try:
+                if self._file is None:
+                    self._file = open(self._segment_path(self.segment), "a", encoding="utf-8")
+                self._file.write("\n".join(batch) + "\n")
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+            except OSError:
+                self._abandon_segment()
+                with self._cond:
+                    self._buffer[:0] = batch
+                raise
+            self.batches += 1
+        with self._cond:
+            self.committed = upto
+            self._wake_async_waiters()
+            self._cond.notify_all()
+
+    def _abandon_segment(self):
+        """Stop writing to the current segment after a failed write (io lock held)"""
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+        self.segment += 1
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._buffer or self._closed)
+                if self._closed and not self._buffer:
+                    return
+            # Give concurrent appends a moment to join this batch
+            if self.commit_interval:
+                time.sleep(self.commit_interval)
+            try:
+                with self._io_lock:
+                    self._commit()
+            except OSError as e:
+                print(f"Error writing session journal: {e}")
+                if self._closed:
+                    return   # close() makes the last attempt
+                time.sleep(1.0)
+
+    def rotate(self):
+        """Commit what is buffered, then start a new segment; returns the new segment's number.
+
+        Records appended before the call are in the older segments, later ones in the new one.
+        """
+        with self._io_lock:
+            self._commit()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.segment += 1
+            return self.segment
+
+    def write_snapshot(self, lines, next_segment):
+        """Atomically replace the snapshot with `lines`, valid up to (not including) next_segment,
+        then delete the segments it covers"""
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"next_segment": next_segment, "time": time.time()}) + "\n")
+            for line in lines:
+                f.write(line + "\n")
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        if self.fsync:
+            _fsync_directory(self.directory)
+        for number in self.segments():
+            if number < next_segment:
+                os.remove(self._segment_path(number))
+
+    def _read_lines(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            for number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave the last line half written
+                    print(f"Skipping unreadable journal record at {path}:{number}")
+
+    def replay(self):
+        """Yield the snapshot's records, then every record journaled after it, in order"""
+        first_segment = 0
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if os.path.exists(path):
+            records = self._read_lines(path)
+            header = next(records, None)
+            if header is not None:
+                first_segment = header.get("next_segment", 0)
+                yield from records
+        for number in self.segments():
+            if number >= first_segment:
+                yield from self._read_lines(self._segment_path(number))
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def stats(self):
+        with self._cond:
+            return {
+                "appended": self.appended,
+                "committed": self.committed,
+                "batches": self.batches,
+                "segment": self.segment,
+            }
+
+    def close(self):
+        """Write out anything still buffered and stop the writer"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join()
+        with self._io_lock:
+            try:
+                self._commit()
+            finally:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._lock_file.close()   # releases the directory lock
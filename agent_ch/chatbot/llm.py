@@ -0,0 +1,432 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from .metrics import metrics
+from .prompts import count_tokens, count_message_tokens
+
+MODEL = "llama3-8b-8192"
+
+# Model settings for one kind of LLM call. expected_tokens is the completion size the
+# gateway reserves quota for (max_tokens when unset); it is never sent to the API.
+CallConfig = namedtuple("CallConfig", ["model", "temperature", "max_tokens", "expected_tokens"], defaults=[None, None])
+
+# The call sites the managers make, each configurable on its own
+CALL_SITES = ("explanation", "simplify", "quiz", "answer")
+
+# Output token budget per call site: explanations were unbounded and ran long
+DEFAULT_MAX_TOKENS = {"explanation": 700, "simplify": 300, "quiz": 700, "answer": 150}
+
+DEFAULT_CALL_CONFIGS = {site: CallConfig(MODEL, 0.7, DEFAULT_MAX_TOKENS[site]) for site in CALL_SITES}
+
+def call_configs(overrides=None):
+    """Default call configs with any per-site overrides applied"""
+    configs = dict(DEFAULT_CALL_CONFIGS)
+    configs.update(overrides or {})
+    return configs
+
+def call_configs_from_env(environ=os.environ):
+    """Read LLM_MODEL / LLM_TEMPERATURE, then LLM_<SITE>_MODEL / LLM_<SITE>_TEMPERATURE /
+    LLM_<SITE>_MAX_TOKENS overrides (a max_tokens of 0 means unlimited)"""
+    model = environ.get("LLM_MODEL", MODEL)
+    temperature = float(environ.get("LLM_TEMPERATURE", 0.7))
+    configs = {}
+    for site in CALL_SITES:
+        prefix = f"LLM_{site.upper()}_"
+        max_tokens = environ.get(prefix + "MAX_TOKENS")
+        configs[site] = CallConfig(
+            environ.get(prefix + "MODEL", model),
+            float(environ.get(prefix + "TEMPERATURE", temperature)),
+            (int(max_tokens) or None) if max_tokens else DEFAULT_MAX_TOKENS[site]
+        )
+    return configs
+
+class LLMError(Exception):
+    """A provider could not produce a completion"""
+
+class RateLimitError(LLMError):
+    """The provider refused the call for being over quota (HTTP 429)"""
+    status_code = 429
+
+class LLMTimeoutError(LLMError):
+    """The call ran past its llm_deadline()"""
+
+# Monotonic time by which LLM calls made in this context must finish, if any
+_deadline = ContextVar("llm_deadline", default=None)
+
+@contextmanager
+def llm_deadline(seconds):
+    """Give the LLM calls made in this block `seconds` to finish.
+
+    Providers pass what is left on as the request timeout and the gateway stops
+    queueing for quota once it runs out, so a late call frees its worker and its
+    share of the budget instead of running on after the caller gave up. A nested
+    deadline never extends an outer one.
+    """
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def time_left():
+    """Seconds left before the current llm_deadline(), or None without one; raises LLMTimeoutError once it has passed"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise LLMTimeoutError("LLM call timed out")
+    return left
+
+class LLMProvider:
+    """Interface for chat-completion backends used by QuizManager and ExplanationManager"""
+
+    def complete(self, messages, config, json_mode=False):
+        """Return the reply text for a list of chat messages"""
+        raise NotImplementedError
+
+    def stream(self, messages, config):
+        """Yield the reply text in pieces as it is generated"""
+        yield self.complete(messages, config)
+
+class AsyncLLMProvider:
+    """Coroutine version of LLMProvider, used by the async managers"""
+
+    async def complete(self, messages, config, json_mode=False):
+        raise NotImplementedError
+
+@contextmanager
+def _llm_call(config):
+    """Count and time one LLM call, including calls that raise"""
+    metrics.inc("chatbot_llm_calls_total", model=config.model)
+    try:
+        with metrics.span("llm", model=config.model):
+            yield
+    except Exception:
+        metrics.inc("chatbot_llm_errors_total", model=config.model)
+        raise
+
+def _record_usage(config, messages, text, usage=None):
+    """Count tokens as reported by the API, or counted locally when it doesn't say"""
+    if usage is not None:
+        prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+    else:
+        prompt_tokens = count_message_tokens(messages)
+        completion_tokens = count_tokens(text)
+    metrics.inc("chatbot_llm_tokens_total", prompt_tokens, model=config.model, kind="prompt")
+    metrics.inc("chatbot_llm_tokens_total", completion_tokens, model=config.model, kind="completion")
+
+def _request_params(messages, config, json_mode=False):
+    params = {"model": config.model, "messages": messages, "temperature": config.temperature}
+    if config.max_tokens:
+        params["max_tokens"] = config.max_tokens
+    if json_mode:
+        params["response_format"] = {"type": "json_object"}
+    timeout = time_left()
+    if timeout is not None:
+        params["timeout"] = timeout
+    return params
+
+class GroqProvider(LLMProvider):
+    """Chat completions from a Groq client"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def complete(self, messages, config, json_mode=False):
+        with _llm_call(config):
+            response = self.client.chat.completions.create(**_request_params(messages, config, json_mode))
+        text = response.choices[0].message.content
+        _record_usage(config, messages, text, getattr(response, "usage", None))
+        return text
+
+    def stream(self, messages, config):
+        parts = []
+        with _llm_call(config):
+            stream = self.client.chat.completions.create(stream=True, **_request_params(messages, config))
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        _record_usage(config, messages, "".join(parts))
+
+class AsyncGroqProvider(AsyncLLMProvider):
+    """Chat completions from an AsyncGroq client"""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def complete(self, messages, config, json_mode=False):
+        with _llm_call(config):
+            response = await self.client.chat.completions.create(**_request_params(messages, config, json_mode))
+        text = response.choices[0].message.content
+        _record_usage(config, messages, text, getattr(response, "usage", None))
+        return text
+
+# Filler vocabulary for stub replies
+_WORDS = (
+    "concept", "example", "structure", "process", "value", "function", "pattern", "rule",
+    "input", "output", "state", "system", "method", "model", "step", "result", "case",
+    "design", "detail", "principle", "approach", "component", "behaviour", "context",
+)
+
+class StubProvider(LLMProvider):
+    """Local, offline LLM stand-in for load tests and benchmarks.
+
+    Replies are deterministic for a given prompt and follow the formats the managers
+    ask for (markdown explanations, JSON quizzes with four options and a rationale).
+    Latency is drawn from a configurable distribution ("fixed", "uniform", "lognormal"
+    or "exponential", around `median_latency` seconds), and failures can be injected:
+    `failure_rate` raises LLMError, `rate_limit_rate` raises RateLimitError (429) and
+    `malformed_rate` returns an unparseable quiz. Replies keep to the length the
+    prompt asks for and are cut off at the call's max_tokens, like the real API.
+    """
+
+    def __init__(self, latency="lognormal", median_latency=0.8, latency_spread=0.5,
+                 failure_rate=0.0, malformed_rate=0.0, words=220, seed=None, rate_limit_rate=0.0):
+        self.latency = latency
+        self.median_latency = median_latency
+        self.latency_spread = latency_spread
+        self.failure_rate = failure_rate
+        self.malformed_rate = malformed_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.words = words
+        self.calls = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _sample_latency(self):
+        median, spread = self.median_latency, self.latency_spread
+        with self._lock:
+            if self.latency == "fixed":
+                return median
+            if self.latency == "uniform":
+                return self._random.uniform(median * (1 - spread), median * (1 + spread))
+            if self.latency == "exponential":
+                return self._random.expovariate(1 / median) if median else 0.0
+            return median * math.exp(self._random.gauss(0, spread))
+
+    def _roll(self, rate):
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    def _plan(self, messages, config, json_mode=False):
+        """Decide one call's outcome: returns (reply text, latency) or raises LLMError"""
+        with self._lock:
+            self.calls += 1
+        delay = max(0.0, self._sample_latency())
+        if self._roll(self.failure_rate):
+            with self._lock:
+                self.failures += 1
+            raise LLMError("stub provider: injected failure")
+        if self._roll(self.rate_limit_rate):
+            with self._lock:
+                self.failures += 1
+            raise RateLimitError("stub provider: injected rate limit")
+        if json_mode and self._roll(self.malformed_rate):
+            text = "Here are your questions: Q1 is about the topic."
+        else:
+            text = self._truncate(self.reply(messages, config, json_mode), config.max_tokens)
+        with self._lock:
+            self.prompt_tokens += count_message_tokens(messages)
+            self.completion_tokens += count_tokens(text)
+        return text, delay
+
+    @staticmethod
+    def _sleep(seconds):
+        """Simulate latency, giving up at the llm_deadline() like a request timeout would"""
+        left = time_left()
+        if left is not None and seconds > left:
+            time.sleep(left)
+            raise LLMTimeoutError("stub provider: request timed out")
+        time.sleep(seconds)
+
+    @staticmethod
+    def _truncate(text, max_tokens):
+        """Cut text off after max_tokens tokens"""
+        if not max_tokens or count_tokens(text) <= max_tokens:
+            return text
+        pieces, used = [], 0
+        for piece in re.findall(r"\S+\s*", text):
+            used += count_tokens(piece)
+            if used > max_tokens:
+                break
+            pieces.append(piece)
+        return "".join(pieces).rstrip()
+
+    def reply(self, messages, config, json_mode=False):
+        """The text a prompt produces, without latency or failures"""
+        system = next((m["content"] for m in messages if m["role"] == "system"), "")
+        prompt = next((m["content"] for m in messages if m["role"] == "user"), "")
+        seed = hashlib.sha256(json.dumps([config.model, messages]).encode("utf-8")).hexdigest()
+        rng = random.Random(seed)
+        course = _first_match(r"expert in ([^.]+)\.", system, "the course")
+        topic = _first_match(r"'([^']+)'", prompt, None) or _first_match(r"'([^']+)'", system, "answer")
+        if json_mode:
+            return self._quiz_reply(rng, course, topic)
+        asked = _first_match(r"at most about (\d+) words", system + prompt, None)
+        words = min(self.words, int(asked)) if asked else self.words
+        if "simpler terms" in prompt:
+            return self._paragraphs(rng, topic, words // 3, headings=False)
+        if "why this answer is correct" in prompt:
+            return self._sentences(rng, topic, 2)
+        return self._paragraphs(rng, topic, words, headings=True)
+
+    def _sentences(self, rng, topic, count):
+        sentences = []
+        for _ in range(count):
+            words = [rng.choice(_WORDS) for _ in range(rng.randint(8, 16))]
+            sentences.append(f"The {topic} {' '.join(words)}.")
+        return " ".join(sentences)
+
+    def _paragraphs(self, rng, topic, words, headings):
+        parts, written, section = [], 0, 1
+        while written < words:
+            if headings:
+                parts.append(f"**{topic}: part {section}**")
+            paragraph = self._sentences(rng, topic, rng.randint(2, 4))
+            parts.append(paragraph)
+            written += len(paragraph.split())
+            section += 1
+        return "\n\n".join(parts)
+
+    def _quiz_reply(self, rng, course, topic):
+        questions = []
+        for number in range(1, 3):
+            answer = rng.choice("ABCD")
+            questions.append({
+                "question": f"Which statement about {topic} in {course} is correct ({number})?",
+                "options": {
+                    letter: f"The {topic} {rng.choice(_WORDS)} {rng.choice(_WORDS)}"
+                    for letter in "ABCD"
+                },
+                "answer": answer,
+                "explanation": self._sentences(rng, topic, 2),
+            })
+        return json.dumps({"questions": questions})
+
+    def complete(self, messages, config, json_mode=False):
+        with _llm_call(config):
+            text, delay = self._plan(messages, config, json_mode)
+            self._sleep(delay)
+        _record_usage(config, messages, text)
+        return text
+
+    def stream(self, messages, config):
+        """Spread the sampled latency over the reply: a first-token wait, then word chunks"""
+        with _llm_call(config):
+            text, delay = self._plan(messages, config)
+            chunks = re.findall(r"\S+\s*", text) or [text]
+            self._sleep(delay / 2)
+            gap = delay / 2 / len(chunks)
+            for chunk in chunks:
+                yield chunk
+                self._sleep(gap)
+        _record_usage(config, messages, text)
+
+    def stats(self):
+        """Return call, injected-failure and token counts"""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "failures": self.failures,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+            }
+
+class AsyncStubProvider(StubProvider, AsyncLLMProvider):
+    """StubProvider whose latency is an asyncio sleep"""
+
+    async def complete(self, messages, config, json_mode=False):
+        with _llm_call(config):
+            text, delay = self._plan(messages, config, json_mode)
+            await asyncio.sleep(delay)
+        _record_usage(config, messages, text)
+        return text
+
+class _Lazy:
+    """Builds the wrapped provider with `factory` on first use, once per instance.
+
+    Construction (reading the API key, importing and configuring the client) is left
+    out of startup, and a misconfigured provider fails the LLM calls with LLMError
+    instead of the whole process.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._provider = None
+        self._lock = threading.Lock()
+
+    @property
+    def provider(self):
+        if self._provider is None:
+            with self._lock:
+                if self._provider is None:
+                    try:
+                        self._provider = self.factory()
+                    except Exception as e:
+                        raise LLMError(f"LLM provider unavailable: {e}") from e
+        return self._provider
+
+    @property
+    def ready(self):
+        """Whether the provider has been built"""
+        return self._provider is not None
+
+class LazyProvider(_Lazy, LLMProvider):
+    """LLMProvider that builds the real one on the first call"""
+
+    def complete(self, messages, config, json_mode=False):
+        return self.provider.complete(messages, config, json_mode)
+
+    def stream(self, messages, config):
+        yield from self.provider.stream(messages, config)
+
+class AsyncLazyProvider(_Lazy, AsyncLLMProvider):
+    """AsyncLLMProvider that builds the real one on the first call"""
+
+    async def complete(self, messages, config, json_mode=False):
+        return await self.provider.complete(messages, config, json_mode)
+
+def _first_match(pattern, text, default):
+    match = re.search(pattern, text)
+    return match.group(1).strip() if match else default
+
+def provider_from_env(environ=os.environ):
+    """The provider LLM_PROVIDER selects: "stub", or Groq (the default, which needs GROQ_API_KEY)"""
+    if environ.get("LLM_PROVIDER", "groq") == "stub":
+        return stub_provider_from_env(environ=environ)
+    api_key = environ.get("GROQ_API_KEY")
+    if not api_key:
+        raise ValueError("API key is missing! Please set the GROQ_API_KEY environment variable.")
+    from groq import Groq
+    return GroqProvider(Groq(api_key=api_key))
+
+def stub_provider_from_env(provider_class=StubProvider, environ=os.environ):
+    """Build a stub provider from LLM_STUB_* settings"""
+    seed = environ.get("LLM_STUB_SEED")
+    return provider_class(
+        latency=environ.get("LLM_STUB_LATENCY", "lognormal"),
+        median_latency=float(environ.get("LLM_STUB_MEDIAN_LATENCY", 0.8)),
+        latency_spread=float(environ.get("LLM_STUB_LATENCY_SPREAD", 0.5)),
+        failure_rate=float(environ.get("LLM_STUB_FAILURE_RATE", 0)),
+        malformed_rate=float(environ.get("LLM_STUB_MALFORMED_RATE", 0)),
+        rate_limit_rate=float(environ.get("LLM_STUB_RATE_LIMIT_RATE", 0)),
+        words=int(environ.get("LLM_STUB_WORDS", 220)),
+        seed=int(seed) if seed else None
+    )
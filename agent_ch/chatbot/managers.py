@@ -1,167 +1,411 @@
 import json
 import os
-from groq import Groq
+import threading
+import time
+from .score_store import JsonScoreStore
+from .catalog import Catalog
+from .quiz_parser import parse_quiz, format_question
+from .llm import MODEL, LLMProvider, AsyncLLMProvider, GroqProvider, call_configs
+from .metrics import span
+from .prompts import PROMPTS, count_tokens, count_message_tokens, meter_tokens, summarize_explanation
+
+# Explanations ask for a length that fits their token budget since v2
+PROMPT_VERSION = "v2"
+# Quizzes are JSON with per-question rationales since v2
+QUIZ_PROMPT_VERSION = "v2"
 
 class CourseManager:
-    def __init__(self, data_file="data.json"):
+    def __init__(self, data_file="data.json", reload_interval=2.0):
+        self.data_file = data_file
+        self.reload_interval = reload_interval
+        self._reload_lock = threading.Lock()
+        self._mtime = os.path.getmtime(data_file)
+        self._next_check = time.monotonic() + reload_interval
         self.course_data = self._load_course_data(data_file)
+        self.catalog = Catalog(self.course_data)
     
     def _load_course_data(self, data_file):
         """Load course data from JSON file"""
         with open(data_file, "r", encoding="utf-8") as file:
             return json.load(file)
+
+    def _maybe_reload(self):
+        """Swap in a freshly indexed catalog if data.json changed since the last check.
+
+        The new Catalog is built off to the side and published with one reference
+        assignment, so readers always see either the old or the new catalog in full.
+        Sessions keep the topic list they were given when they picked a course.
+        """
+        if not self.reload_interval or time.monotonic() < self._next_check:
+            return
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = time.monotonic() + self.reload_interval
+            mtime = os.path.getmtime(self.data_file)
+            if mtime == self._mtime:
+                return
+            # Remember the mtime even if parsing fails, so a bad edit is reported once
+            self._mtime = mtime
+            course_data = self._load_course_data(self.data_file)
+            self.catalog = Catalog(course_data)
+            self.course_data = course_data
+        except (OSError, ValueError) as e:
+            print(f"Error reloading course data, keeping the current catalog: {e}")
+        finally:
+            self._reload_lock.release()
     
     def get_courses(self):
         """Return list of available courses"""
-        return list(self.course_data.keys())
+        self._maybe_reload()
+        return list(self.catalog.courses)
     
     def get_matched_course(self, user_input):
-        """Find a course that matches user input"""
-        return next((course for course in self.course_data 
-                    if course.lower() == user_input.lower()), None)
+        """Find the course user input names, by name or alias"""
+        self._maybe_reload()
+        return self.catalog.match_course(user_input)
+
+    def get_suggested_course(self, user_input):
+        """Find a course user input may have misspelled, to offer rather than select"""
+        self._maybe_reload()
+        return self.catalog.closest_course(user_input)
     
     def get_topics(self, course_name):
         """Return topics for a given course"""
-        return list(self.course_data.get(course_name, {}).keys())
+        self._maybe_reload()
+        return self.catalog.topic_names(course_name)
+
+    def get_topic_entries(self, course_name):
+        """Return the course's Topic entries (course, name, subtopics)"""
+        self._maybe_reload()
+        return self.catalog.topics(course_name)
+
+QUIZ_JSON_FORMAT = """{"questions": [{"question": "Question?", "options": {"A": "Option1", "B": "Option2", "C": "Option3", "D": "Option4"}, "answer": "X", "explanation": "2 to 3 lines on why X is correct"}]}"""
+
+def _as_provider(llm, provider_class):
+    """Accept an LLM provider, or a bare client to wrap in provider_class"""
+    if isinstance(llm, (LLMProvider, AsyncLLMProvider)):
+        return llm
+    return provider_class(llm)
+
+class _CallSites:
+    """Prompt rendering, per-call budgets and token accounting shared by the managers"""
+
+    def _messages(self, site, **fields):
+        """Render a call site's prompt; the length it asks for follows the configured budget"""
+        return PROMPTS[site].render(self.configs[site].max_tokens, **fields)
+
+    def _config(self, site, course, topic=None):
+        """The site's CallConfig, with the quota to reserve (expected_tokens) adapted to the usage
+        seen for this course/topic; the max_tokens sent stays the configured one"""
+        config = self.configs[site]
+        if self.usage is None:
+            return config
+        return config._replace(expected_tokens=self.usage.expected_tokens(site, course, topic, config.max_tokens))
+
+    def _account(self, site, course, topic, messages, config, text):
+        """Record one LLM call's token counts in the usage ledger and any active TokenMeter"""
+        prompt_tokens, completion_tokens = count_message_tokens(messages), count_tokens(text)
+        meter_tokens(prompt_tokens + completion_tokens)
+        if self.usage is not None:
+            self.usage.record(site, course, topic, prompt_tokens, completion_tokens, config.max_tokens)
+
+class QuizManager(_CallSites):
+    provider_class = GroqProvider
 
-class QuizManager:
-    def __init__(self, groq_client):
-        self.client = groq_client
+    def __init__(self, llm, cache=None, max_reasks=2, configs=None, usage=None):
+        """llm is an LLMProvider (or a Groq client); configs overrides the per-call-site CallConfigs.
+
+        A UsageLedger (usage) records tokens per course/topic and sizes quota reservations by them.
+        """
+        self.llm = _as_provider(llm, self.provider_class)
+        self.configs = call_configs(configs)
+        self.cache = cache
+        self.max_reasks = max_reasks
+        self.usage = usage
+        self.parse_stats = {}   # model -> {"replies": n, "failures": n}
+        self._stats_lock = threading.Lock()
     
-    def generate_quiz_questions(self, course, topic):
-        """Generate quiz questions for a given topic"""
+    def _quiz_messages(self, course, topic):
+        """Build the prompt for quiz generation"""
+        return self._messages("quiz", course=course, topic=topic, json_format=QUIZ_JSON_FORMAT)
+
+    def _answer_messages(self, course, question, correct_answer):
+        """Build the prompt for an answer explanation"""
+        return self._messages("answer", course=course, question=question, correct_answer=correct_answer)
+
+    def quiz_key(self, course, topic, variant):
+        """Cache key of one quiz variant slot"""
+        return self.cache.make_key("quiz", self.configs["quiz"].model, course, topic, QUIZ_PROMPT_VERSION, variant)
+
+    def _cached_quiz(self, course, topic, variant=None):
+        """Pick a variant slot (unless given) and return (variant, cached questions or None)"""
+        if not self.cache:
+            return 0, None
+        if variant is None:
+            variant = self.cache.pick_quiz_variant()
+        cached = self.cache.get("quiz", self.configs["quiz"].model, course, topic, QUIZ_PROMPT_VERSION, variant)
+        return variant, json.loads(cached) if cached is not None else None
+
+    def store_quiz(self, course, topic, variant, quiz_questions):
+        """Save parsed questions into their variant slot, e.g. after adding rationales to them"""
+        if self.cache and quiz_questions:
+            self.cache.put("quiz", self.configs["quiz"].model, course, topic, QUIZ_PROMPT_VERSION, json.dumps(quiz_questions), variant)
+    
+    def _request_quiz(self, messages, config):
+        """Send one quiz request and return the raw reply text"""
+        return self.llm.complete(messages, config, json_mode=True).strip()
+
+    def _reask_messages(self, messages, reply, errors):
+        """Continue the conversation, telling the model what was wrong with its reply"""
+        return messages + [
+            {"role": "assistant", "content": reply},
+            {
+                "role": "user",
+                "content": "That reply did not match the required format (" + "; ".join(errors) + "). Reply again with only the JSON object:\n" + QUIZ_JSON_FORMAT
+            }
+        ]
+
+    def _check_reply(self, reply):
+        """Parse a reply, count it for the model's parse-failure rate, return (questions, errors)"""
+        with span("quiz_parse"):
+            questions, errors = parse_quiz(reply)
+        with self._stats_lock:
+            stats = self.parse_stats.setdefault(self.configs["quiz"].model, {"replies": 0, "failures": 0})
+            stats["replies"] += 1
+            if not questions:
+                stats["failures"] += 1
+        quiz_list = [
+            {"question": format_question(number, q), "answer": q["answer"], "explanation": q["explanation"]}
+            for number, q in enumerate(questions, start=1)
+        ]
+        return quiz_list, errors
+
+    def parse_failure_rate(self, model=None):
+        """Share of replies from a model (default: the quiz model) that yielded no valid question"""
+        stats = self.parse_stats.get(model or self.configs["quiz"].model)
+        return stats["failures"] / stats["replies"] if stats and stats["replies"] else 0.0
+
+    def quiz_stats(self):
+        """Return per-model reply/failure counts and failure rates"""
+        with self._stats_lock:
+            return {
+                model: dict(stats, failure_rate=stats["failures"] / stats["replies"] if stats["replies"] else 0.0)
+                for model, stats in self.parse_stats.items()
+            }
+    
+    def generate_quiz_questions(self, course, topic, variant=None, use_cache=True):
+        """Generate quiz questions for a given topic, served from the variant pool when cached.
+
+        A reply that fails validation is re-asked (up to max_reasks times) in the same
+        conversation, over the same provider, rather than thrown away. `variant` fills a
+        specific slot, and use_cache=False regenerates it even if it is cached.
+        """
+        variant, cached = self._cached_quiz(course, topic, variant) if use_cache else (variant or 0, None)
+        if cached is not None:
+            return cached
+        messages = self._quiz_messages(course, topic)
+        config = self._config("quiz", course, topic)
         try:
-            response = self.client.chat.completions.create(
-                model="llama3-8b-8192",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": f"You are an expert in {course}. Generate two quiz questions related to {topic} along with the correct answer."
-                    },
-                    {
-                        "role": "user", 
-                        "content": f"Provide two multiple-choice quiz questions for the topic '{topic}' in {course}. Format them as:\nQ1: Question?\nA) Option1\nB) Option2\nC) Option3\nD) Option4\nCorrect Answer: X\n\nQ2: Question?\nA) Option1\nB) Option2\nC) Option3\nD) Option4\nCorrect Answer: Y"
-                    }
-                ],
-                temperature=0.7
-            )
-            quiz_text = response.choices[0].message.content.strip()
-            return self._parse_quiz_questions(quiz_text)
+            for _ in range(self.max_reasks + 1):
+                reply = self._request_quiz(messages, config)
+                self._account("quiz", course, topic, messages, config, reply)
+                quiz_questions, errors = self._check_reply(reply)
+                if quiz_questions:
+                    self.store_quiz(course, topic, variant, quiz_questions)
+                    return quiz_questions
+                messages = self._reask_messages(messages, reply, errors)
+            return []
         except Exception as e:
             return [{"question": f"Error generating quiz: {str(e)}", "answer": ""}]
     
     def _parse_quiz_questions(self, quiz_text):
-        """Parse the generated quiz text into structured questions"""
-        quiz_list = []
-        current_question = ""
-        current_answer = ""
-
-        lines = quiz_text.split("\n")
-        for line in lines:
-            line = line.strip()
-            if line.startswith("Q"):
-                if current_question and current_answer:
-                    quiz_list.append({"question": current_question.strip(), "answer": current_answer.strip()})
-                current_question = line
-                current_answer = ""
-            elif line.startswith(("A)", "B)", "C)", "D)")):
-                current_question += "\n" + line
-            elif "Correct Answer:" in line:
-                current_answer = line.split("Correct Answer:")[-1].strip()
-
-        if current_question and current_answer:
-            quiz_list.append({"question": current_question.strip(), "answer": current_answer.strip()})
-
-        return quiz_list
+        """Parse a quiz reply into structured questions, dropping any that fail validation"""
+        return self._check_reply(quiz_text)[0]
     
     def get_answer_explanation(self, course, question, correct_answer):
         """Get explanation for why an answer is correct"""
         try:
-            response = self.client.chat.completions.create(
-                model="llama3-8b-8192",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": f"You are an expert in {course}. Provide a short, clear explanation for why the given answer is correct."
-                    },
-                    {
-                        "role": "user", 
-                        "content": f"Explain in 2 to 3 lines why this answer is correct:\n{question}\nAnswer: {correct_answer}"
-                    }
-                ],
-                temperature=0.7
-            )
-            return response.choices[0].message.content.strip()
+            messages = self._answer_messages(course, question, correct_answer)
+            config = self._config("answer", course)
+            explanation = self.llm.complete(messages, config).strip()
+            self._account("answer", course, None, messages, config, explanation)
+            return explanation
         except Exception as e:
             return f"Error getting explanation: {str(e)}"
 
-class ExplanationManager:
-    def __init__(self, groq_client):
-        self.client = groq_client
+class ExplanationManager(_CallSites):
+    provider_class = GroqProvider
+
+    def __init__(self, llm, cache=None, configs=None, clarification_cache=None, usage=None):
+        """llm is an LLMProvider (or a Groq client); configs overrides the per-call-site CallConfigs.
+
+        A ClarificationCache answers clarifications similar to ones already simplified for the same topic.
+        A UsageLedger (usage) records tokens per course/topic and sizes quota reservations by them.
+        """
+        self.llm = _as_provider(llm, self.provider_class)
+        self.configs = call_configs(configs)
+        self.cache = cache
+        self.clarification_cache = clarification_cache
+        self.usage = usage
+
+    def _explanation_messages(self, course, topic):
+        """Build the prompt for a detailed topic explanation"""
+        return self._messages("explanation", course=course, topic=topic)
+
+    def _simplify_messages(self, course, topic, clarification, explanation=None):
+        """Build the prompt for a simplified re-explanation, with the gist of the explanation the learner saw"""
+        context = ""
+        if explanation:
+            summary = summarize_explanation(explanation, focus=clarification)
+            if summary:
+                context = f"\n\nThe explanation the student was shown, in brief: {summary}"
+        return self._messages("simplify", course=course, topic=topic, clarification=clarification, context=context)
+
+    def _cached_clarification(self, course, topic, clarification):
+        """Return the simplified answer to a similar clarification, if one is cached"""
+        if not self.clarification_cache:
+            return None
+        return self.clarification_cache.get(course, topic, clarification)
+
+    def _store_clarification(self, course, topic, clarification, simplified):
+        if self.clarification_cache and simplified:
+            self.clarification_cache.put(course, topic, clarification, simplified)
+
+    def _cached_explanation(self, course, topic):
+        """Return the shared cached explanation for a topic, if any"""
+        if not self.cache:
+            return None
+        return self.cache.get("explanation", self.configs["explanation"].model, course, topic, PROMPT_VERSION)
+
+    def _store_explanation(self, course, topic, explanation):
+        """Save an explanation into the shared cache"""
+        if self.cache and explanation:
+            self.cache.put("explanation", self.configs["explanation"].model, course, topic, PROMPT_VERSION, explanation)
+
+    def explanation_key(self, course, topic):
+        """Cache key of a topic's explanation"""
+        return self.cache.make_key("explanation", self.configs["explanation"].model, course, topic, PROMPT_VERSION)
+
+    def explanation_ref(self, course, topic, explanation):
+        """What a session should remember for an explanation: its shared cache key, or the text when uncached"""
+        if self.cache:
+            return self.explanation_key(course, topic)
+        return explanation
+
+    def resolve_explanation(self, ref):
+        """Turn a reference from explanation_ref back into text (None if it has left the cache)"""
+        if self.cache:
+            # Not a lookup to count: the session already holds this entry's key
+            entry = self.cache.peek(ref)
+            return entry[0] if entry else None
+        return ref
+
+    def _stream_completion(self, messages, site, course, topic):
+        """Yield content deltas from a streamed completion for a call site"""
+        config = self._config(site, course, topic)
+        parts = []
+        for delta in self.llm.stream(messages, config):
+            parts.append(delta)
+            yield delta
+        self._account(site, course, topic, messages, config, "".join(parts))
         
-    def fetch_topic_explanation(self, course, topic):
-        """Fetch detailed explanation for a topic"""
+    def fetch_topic_explanation(self, course, topic, use_cache=True):
+        """Fetch detailed explanation for a topic, checking the shared cache first (unless use_cache is False)"""
+        cached = self._cached_explanation(course, topic) if use_cache else None
+        if cached is not None:
+            return cached
         try:
-            response = self.client.chat.completions.create(
-                model="llama3-8b-8192",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": f"You are an expert in {course}. Provide clear and detailed explanations about topics related to {course}."
-                    },
-                    {
-                        "role": "user", 
-                        "content": f"""Explain the topic '{topic}' in detail as it relates to {course}. 
-Use **bold formatting** for topic headings and subheadings, and use line breaks to separate different sections clearly."""
-                    }
-                ],
-                temperature=0.7
-            )
-            explanation = response.choices[0].message.content.strip()
+            messages = self._explanation_messages(course, topic)
+            config = self._config("explanation", course, topic)
+            explanation = self.llm.complete(messages, config).strip()
+            self._account("explanation", course, topic, messages, config, explanation)
+            self._store_explanation(course, topic, explanation)
             return explanation
         except Exception as e:
             return f"Error fetching explanation: {str(e)}"
 
-    def simplify_explanation(self, course, topic, clarification):
-        """Provide a simplified explanation of a topic based on user's confusion"""
+    def stream_topic_explanation(self, course, topic):
+        """Yield a topic explanation as it is generated; cached explanations come back in one piece"""
+        cached = self._cached_explanation(course, topic)
+        if cached is not None:
+            yield cached
+            return
+        parts = []
         try:
-            simplified_response = self.client.chat.completions.create(
-                model="llama3-8b-8192",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": f"You are an expert in {course}. Re-explain the specific part of '{topic}' that the student didn't understand: '{clarification}'. Keep it simple and clear."
-                    },
-                    {
-                        "role": "user", 
-                        "content": f"Please explain this part in simpler terms: {clarification}"
-                    }
-                ],
-                temperature=0.7
-            )
-            return simplified_response.choices[0].message.content.strip()
+            for delta in self._stream_completion(self._explanation_messages(course, topic), "explanation", course, topic):
+                parts.append(delta)
+                yield delta
+        except Exception as e:
+            yield f"Error fetching explanation: {str(e)}"
+            return
+        self._store_explanation(course, topic, "".join(parts).strip())
+
+    def simplify_explanation(self, course, topic, clarification, explanation=None):
+        """Provide a simplified explanation of a topic based on user's confusion.
+
+        explanation is the text the learner was shown, summarized into the prompt as context.
+        """
+        cached = self._cached_clarification(course, topic, clarification)
+        if cached is not None:
+            return cached
+        try:
+            messages = self._simplify_messages(course, topic, clarification, explanation)
+            config = self._config("simplify", course, topic)
+            simplified = self.llm.complete(messages, config).strip()
+            self._account("simplify", course, topic, messages, config, simplified)
+            self._store_clarification(course, topic, clarification, simplified)
+            return simplified
         except Exception as e:
             return f"Sorry, I couldn't fetch a simplified explanation due to an error: {str(e)}"
+
+    def stream_simplified_explanation(self, course, topic, clarification, explanation=None):
+        """Yield a simplified explanation as it is generated; similar earlier clarifications come back in one piece"""
+        cached = self._cached_clarification(course, topic, clarification)
+        if cached is not None:
+            yield cached
+            return
+        parts = []
+        try:
+            for delta in self._stream_completion(self._simplify_messages(course, topic, clarification, explanation), "simplify", course, topic):
+                parts.append(delta)
+                yield delta
+        except Exception as e:
+            yield f"Sorry, I couldn't fetch a simplified explanation due to an error: {str(e)}"
+            return
+        self._store_clarification(course, topic, clarification, "".join(parts).strip())
     
 class ScoreManager:
-    def __init__(self, score_file="score.json"):
+    def __init__(self, score_file="score.json", store=None, aggregates=None):
         self.score_file = score_file
+        self.store = store or JsonScoreStore(score_file)
+        self.aggregates = aggregates
     
-    def update_score(self, session_id, course, score):
-        """Update the score for a session and course"""
+    def update_score(self, session_id, course, score, topic=None, correct=None, quiz_score=None):
+        """Update the score for a session and course; when the answer is given (correct),
+        also count it in the course and topic aggregates, with quiz_score (correct answers
+        so far in this topic's quiz) as the score reached"""
         try:
-            if not os.path.exists(self.score_file):
-                with open(self.score_file, 'w') as f:
-                    json.dump({}, f)
-            
-            with open(self.score_file, 'r') as f:
-                scores = json.load(f)
-            
-            if session_id not in scores:
-                scores[session_id] = {}
-            scores[session_id][course] = score
-            
-            with open(self.score_file, 'w') as f:
-                json.dump(scores, f, indent=2)
+            with span("store.score_write"):
+                self.store.set_score(session_id, course, score)
         except Exception as e:
-            print(f"Error updating score file: {e}")
\ No newline at end of file
+            print(f"Error updating score store: {e}")
+        if self.aggregates is None or correct is None:
+            return
+        try:
+            with span("store.aggregates_write"):
+                self.aggregates.record_answer(course, topic, correct, int(correct) if quiz_score is None else quiz_score)
+        except Exception as e:
+            print(f"Error updating score aggregates: {e}")
+
+    def update_scores(self, updates):
+        """Write a batch of (session_id, course, score) updates in one transaction"""
+        try:
+            with span("store.score_write"):
+                self.store.set_scores(updates)
+        except Exception as e:
+            print(f"Error updating score store: {e}")
+
+    def get_scores(self, session_id):
+        """Return {course: score} for a session"""
+        return self.store.get_scores(session_id)
@@ -0,0 +1,170 @@
+import bisect
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+HELP = {
+    "chatbot_span_seconds": "Time spent in instrumented spans (LLM calls, store reads/writes, handlers, parsing)",
+    "chatbot_request_seconds": "End-to-end request latency",
+    "chatbot_requests_total": "Requests served",
+    "chatbot_slow_requests_total": "Requests slower than the slow-request threshold",
+    "chatbot_llm_calls_total": "LLM calls made",
+    "chatbot_llm_errors_total": "LLM calls that raised",
+    "chatbot_llm_coalesced_total": "LLM calls answered by an identical call already in flight",
+    "chatbot_llm_retries_total": "LLM calls retried after a rate-limit (429) response",
+    "chatbot_llm_tokens_total": "LLM tokens used (reported by the API, or counted locally)",
+}
+
+# The spans recorded for the request running in the current context
+_current_trace = ContextVar("chatbot_trace", default=None)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+class Metrics:
+    """In-process counters and histograms, rendered in the Prometheus text format.
+
+    Spans time a block of code into the `chatbot_span_seconds` histogram. Inside a
+    request (see `request`), spans are also collected per request so slow requests
+    can be logged with a breakdown of where the time went. Each worker process keeps
+    its own registry.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, slow_request_ms=None, slow_log=None):
+        self.buckets = tuple(buckets)
+        self.slow_request_ms = slow_request_ms
+        self.slow_log = slow_log
+        self._counters = {}     # (name, labels) -> value
+        self._histograms = {}   # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+
+    def configure(self, slow_request_ms=None, slow_log=None):
+        """Turn the slow-request log on (threshold in ms; log file path, or stderr when None)"""
+        self.slow_request_ms = slow_request_ms
+        self.slow_log = slow_log
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += seconds
+
+    @contextmanager
+    def span(self, name, **labels):
+        """Time a block into chatbot_span_seconds{span=name}, and into the current request's trace"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("chatbot_span_seconds", elapsed, span=name, **labels)
+            trace = _current_trace.get()
+            if trace is not None:
+                trace.append((name, elapsed))
+
+    @contextmanager
+    def request(self, route):
+        """Time a whole request; spans inside it (including on worker threads started
+        with a copied context) are kept for the slow-request log"""
+        trace = []
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            _current_trace.reset(token)
+            self.inc("chatbot_requests_total", route=route)
+            self.observe("chatbot_request_seconds", elapsed, route=route)
+            if self.slow_request_ms is not None and elapsed * 1000 >= self.slow_request_ms:
+                self.inc("chatbot_slow_requests_total", route=route)
+                self._log_slow_request(route, elapsed, trace)
+
+    def _log_slow_request(self, route, elapsed, trace):
+        totals = {}
+        for name, seconds in trace:
+            count, total = totals.get(name, (0, 0.0))
+            totals[name] = (count + 1, total + seconds)
+        record = json.dumps({
+            "time": time.time(),
+            "route": route,
+            "duration_ms": round(elapsed * 1000, 3),
+            "spans": {name: {"count": count, "ms": round(total * 1000, 3)} for name, (count, total) in totals.items()},
+        })
+        with self._log_lock:
+            if self.slow_log:
+                with open(self.slow_log, "a") as f:
+                    f.write(record + "\n")
+            else:
+                print(f"Slow request: {record}", file=sys.stderr)
+
+    def register_collector(self, collector):
+        """Add a callable returning [(name, type, help, labels dict, value)] sampled at render time"""
+        self._collectors.append(collector)
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(values)) for key, values in self._histograms.items())
+        lines = []
+        declared = set()
+
+        def declare(name, kind, help_text=None):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# HELP {name} {help_text or HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            declare(name, "counter")
+            lines.append(f"{name}{_label_text(labels)} {value}")
+        for (name, labels), values in histograms:
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_label_text(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(labels)} {values[-1]}")
+            lines.append(f"{name}_count{_label_text(labels)} {cumulative}")
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+                continue
+            for name, kind, help_text, labels, value in samples:
+                declare(name, kind, help_text)
+                lines.append(f"{name}{_label_text(tuple(sorted(labels.items())))} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+# Process-wide registry used by the chatbot package and the web app
+metrics = Metrics()
+span = metrics.span
@@ -1,12 +1,69 @@
+import sys
+
+def _deep_sizeof(value):
+    """Approximate memory footprint of a value and the containers/strings it holds"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_sizeof(k) + _deep_sizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_deep_sizeof(item) for item in value)
+    return size
+
 class SessionState:
-    def __init__(self):
+    FIELDS = (
+        "session_id", "conversation_state", "selected_course", "topics", "current_topic_index",
+        "explanations", "quiz_questions", "current_quiz_index", "score", "answered", "quiz_score",
+        "current_topic_for_clarification", "suggested_course", "course_scores",
+    )
+    __slots__ = FIELDS
+
+    # Most topics a session remembers explanation references for
+    MAX_EXPLANATIONS = 8
+
+    def __init__(self, session_id=None):
+        self.session_id = session_id
         self.conversation_state = "waiting_for_course"
         self.selected_course = None
         self.topics = []
         self.current_topic_index = 0
-        self.explanations = {}
-        self.quiz_data = {}
+        self.explanations = {}   # topic -> reference (shared cache key, or the text when uncached)
         self.quiz_questions = []
         self.current_quiz_index = 0
         self.score = 0
-        self.current_topic_for_clarification = None
\ No newline at end of file
+        self.answered = 0   # quiz questions answered this session
+        self.quiz_score = 0   # correct answers in the quiz in progress
+        self.current_topic_for_clarification = None
+        self.suggested_course = None   # course a misspelled name was taken for, awaiting a yes
+        self.course_scores = {}   # course -> [correct answers, questions answered, best quiz score]
+
+    def remember_explanation(self, topic, ref):
+        """Record the explanation reference for a topic, dropping the oldest past MAX_EXPLANATIONS"""
+        self.explanations.pop(topic, None)
+        self.explanations[topic] = ref
+        while len(self.explanations) > self.MAX_EXPLANATIONS:
+            del self.explanations[next(iter(self.explanations))]
+
+    def record_answer(self, course, correct):
+        """Count a quiz answer in its course's totals; call after updating quiz_score"""
+        totals = self.course_scores.setdefault(course, [0, 0, 0])
+        totals[0] += int(correct)
+        totals[1] += 1
+        totals[2] = max(totals[2], self.quiz_score)
+        return totals
+
+    def size_bytes(self):
+        """Approximate memory held by this session"""
+        return sys.getsizeof(self) + sum(_deep_sizeof(getattr(self, field)) for field in self.FIELDS)
+
+    def to_dict(self):
+        """Return a JSON-serializable snapshot of the session"""
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a session from to_dict() output"""
+        state = cls(data.get("session_id"))
+        for field in cls.FIELDS:
+            if field in data:
+                setattr(state, field, data[field])
+        return state
@@ -0,0 +1,207 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .gateway import BACKGROUND, llm_priority
+from .prompts import TokenMeter
+
+class Prefetcher:
+    """Speculatively generates the content a learner is about to need.
+
+    While a learner reads topic N (or takes its quiz), the explanation and quiz for
+    topic N+1 are generated in the background, along with the answer explanations for
+    the quiz in progress. Work is bounded by a global in-flight limit and a rough
+    tokens-per-minute budget, charged only for calls that reached the LLM; anything
+    over budget is simply not prefetched. Its LLM calls queue behind interactive ones
+    at a shared gateway. Jobs of sessions that stop asking are dropped after `max_age`
+    seconds, finished or not, so abandoned sessions don't keep their content alive.
+    """
+
+    def __init__(self, explanation_manager, quiz_manager, max_workers=2, max_in_flight=4,
+                 tokens_per_minute=20000, prefetch_answers=True, max_age=900):
+        self.explanation_manager = explanation_manager
+        self.quiz_manager = quiz_manager
+        self.max_in_flight = max_in_flight
+        self.tokens_per_minute = tokens_per_minute
+        self.prefetch_answers = prefetch_answers
+        self.max_age = max_age
+        self.scheduled = 0
+        self.used = 0
+        self.dropped = 0
+        self.expired = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._topics = {}    # session_id -> (course, topic, future)
+        self._answers = {}   # session_id -> {question: future}
+        self._touched = {}   # session_id -> when work was last scheduled for it
+        self._next_sweep = time.monotonic() + max_age / 10
+        self._running = 0
+        self._running_lock = threading.Lock()   # separate: done callbacks can fire under self._lock
+        self._window_start = time.monotonic()
+        self._window_tokens = 0
+
+    def _in_flight(self):
+        return self._running
+
+    def _submit(self, fn, *args):
+        """Run a job on the executor, counting it as in flight until it finishes or is cancelled"""
+        with self._running_lock:
+            self._running += 1
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        with self._running_lock:
+            self._running -= 1
+
+    def _sweep(self, now):
+        """Drop the jobs of sessions nothing was scheduled for in max_age seconds (lock held)"""
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.max_age / 10
+        stale = [session_id for session_id, touched in self._touched.items() if now - touched > self.max_age]
+        for session_id in stale:
+            del self._touched[session_id]
+            job = self._topics.pop(session_id, None)
+            futures = [job[2]] if job else []
+            futures += self._answers.pop(session_id, {}).values()
+            for future in futures:
+                future.cancel()
+            self.expired += bool(futures)
+
+    def _has_budget(self, slots=1):
+        """Check the concurrency limit and the current minute's token budget (lock held)"""
+        now = time.monotonic()
+        if now - self._window_start >= 60:
+            self._window_start = now
+            self._window_tokens = 0
+        if self.tokens_per_minute and self._window_tokens >= self.tokens_per_minute:
+            return False
+        return self._in_flight() + slots <= self.max_in_flight
+
+    def _charge(self, tokens):
+        """Count the tokens of the LLM calls a job made against the budget"""
+        with self._lock:
+            self._window_tokens += tokens
+
+    def _generate_topic(self, course, topic):
+        with llm_priority(BACKGROUND), TokenMeter() as meter:
+            try:
+                return self._generate_topic_content(course, topic)
+            finally:
+                self._charge(meter.tokens)
+
+    def _generate_topic_content(self, course, topic):
+        explanation = self.explanation_manager.fetch_topic_explanation(course, topic)
+        quiz_questions = self.quiz_manager.generate_quiz_questions(course, topic)
+        return explanation, quiz_questions
+
+    def _generate_answer(self, course, question, correct_answer):
+        with llm_priority(BACKGROUND), TokenMeter() as meter:
+            try:
+                return self.quiz_manager.get_answer_explanation(course, question, correct_answer)
+            finally:
+                self._charge(meter.tokens)
+
+    def schedule_topic(self, session_id, course, topic):
+        """Start generating a topic for a session, replacing any older speculative job"""
+        with self._lock:
+            now = time.monotonic()
+            self._sweep(now)
+            self._touched[session_id] = now
+            job = self._topics.get(session_id)
+            if job and job[0] == course and job[1] == topic:
+                return
+            if job:
+                job[2].cancel()
+                del self._topics[session_id]
+            if not self._has_budget():
+                self.dropped += 1
+                return
+            future = self._submit(self._generate_topic, course, topic)
+            self._topics[session_id] = (course, topic, future)
+            self.scheduled += 1
+
+    def take_topic(self, session_id, course, topic):
+        """Return a prefetched (explanation, quiz_questions) pair, or None.
+
+        Only a finished job is taken. For one still running the caller should make the
+        calls itself: at a shared gateway they join the job's calls in flight and move
+        them up to interactive priority, and what the job finishes lands in the cache.
+        A job still queued for a prefetch worker is cancelled.
+        """
+        with self._lock:
+            job = self._topics.get(session_id)
+            if not job or job[0] != course or job[1] != topic:
+                return None
+            del self._topics[session_id]
+        if not job[2].done():
+            job[2].cancel()
+            return None
+        try:
+            explanation, quiz_questions = job[2].result()
+        except Exception:
+            return None
+        if explanation.startswith("Error fetching explanation"):
+            return None
+        self.used += 1
+        return explanation, quiz_questions
+
+    def schedule_answers(self, session_id, course, quiz_questions):
+        """Start generating answer explanations for quiz questions that arrived without one"""
+        quiz_questions = [q for q in quiz_questions if not q.get("explanation")]
+        if not self.prefetch_answers or not quiz_questions:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._sweep(now)
+            self._touched[session_id] = now
+            for future in self._answers.pop(session_id, {}).values():
+                future.cancel()
+            if not self._has_budget(len(quiz_questions)):
+                self.dropped += 1
+                return
+            self._answers[session_id] = {
+                q["question"]: self._submit(self._generate_answer, course, q["question"], q["answer"])
+                for q in quiz_questions
+            }
+            self.scheduled += 1
+
+    def take_answer(self, session_id, question):
+        """Return the prefetched answer explanation for a question, or None if it isn't finished (see take_topic)"""
+        with self._lock:
+            future = self._answers.get(session_id, {}).pop(question, None)
+        if future is None:
+            return None
+        if not future.done():
+            future.cancel()
+            return None
+        try:
+            explanation = future.result()
+        except Exception:
+            return None
+        self.used += 1
+        return explanation
+
+    def cancel(self, session_id):
+        """Drop all speculative work for a session (e.g. the learner left the course)"""
+        with self._lock:
+            job = self._topics.pop(session_id, None)
+            answers = self._answers.pop(session_id, {})
+            self._touched.pop(session_id, None)
+        if job:
+            job[2].cancel()
+        for future in answers.values():
+            future.cancel()
+
+    def stats(self):
+        """Return scheduling counters"""
+        with self._lock:
+            in_flight = self._in_flight()
+        return {
+            "scheduled": self.scheduled,
+            "used": self.used,
+            "dropped": self.dropped,
+            "expired": self.expired,
+            "in_flight": in_flight,
+        }
@@ -0,0 +1,184 @@
+import re
+import threading
+from collections import deque
+from contextvars import ContextVar
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+def count_tokens(text):
+    """Local estimate of the tokens a Llama-style BPE vocabulary uses for text.
+
+    Words count one token per started six characters, other symbols one each. It
+    runs without a tokenizer download and is close enough for budgets and accounting.
+    """
+    return sum(
+        1 + (len(piece) - 1) // 6 if piece[0].isalnum() or piece[0] == "_" else 1
+        for piece in _TOKEN_PATTERN.findall(text)
+    )
+
+def count_message_tokens(messages):
+    """Tokens of a chat prompt, counting a few per message for the role framing"""
+    return sum(count_tokens(m["content"]) + 4 for m in messages)
+
+def words_for(max_tokens):
+    """Length in words to ask for so that a reply fits in max_tokens, with room for markdown"""
+    return max(20, max_tokens * 3 // 5 // 10 * 10)
+
+class PromptTemplate:
+    """System and user message templates for one call site, filled with str.format fields.
+
+    `{length}` becomes ", in at most about N words" for the call's token budget (or
+    nothing when the budget is unlimited), so the model aims for a reply it can
+    finish instead of being cut off by max_tokens.
+    """
+
+    def __init__(self, system, user):
+        self.system = system
+        self.user = user
+
+    def render(self, max_tokens=None, **fields):
+        fields.setdefault("length", f", in at most about {words_for(max_tokens)} words" if max_tokens else "")
+        return [
+            {"role": "system", "content": self.system.format(**fields)},
+            {"role": "user", "content": self.user.format(**fields)},
+        ]
+
+PROMPTS = {
+    "explanation": PromptTemplate(
+        "You are an expert in {course}. Provide clear and detailed explanations about topics related to {course}.",
+        "Explain the topic '{topic}' in detail as it relates to {course}{length}. \n"
+        "Use **bold formatting** for topic headings and subheadings, and use line breaks to separate different sections clearly."
+    ),
+    "simplify": PromptTemplate(
+        "You are an expert in {course}. Re-explain the specific part of '{topic}' that the student didn't understand: "
+        "'{clarification}'. Keep it simple and clear{length}.{context}",
+        "Please explain this part in simpler terms: {clarification}"
+    ),
+    "quiz": PromptTemplate(
+        "You are an expert in {course}. Generate two quiz questions related to {topic} along with the correct answer "
+        "and a short explanation of why it is correct. Respond with JSON only.",
+        "Provide two multiple-choice quiz questions for the topic '{topic}' in {course}. Return a JSON object of the form:\n{json_format}"
+    ),
+    "answer": PromptTemplate(
+        "You are an expert in {course}. Provide a short, clear explanation for why the given answer is correct.",
+        "Explain in 2 to 3 lines why this answer is correct:\n{question}\nAnswer: {correct_answer}"
+    ),
+}
+
+# Simplify prompts carry a summary of the explanation the learner saw, up to this many tokens
+SUMMARY_TOKENS = 100
+
+def summarize_explanation(text, max_tokens=SUMMARY_TOKENS, focus=""):
+    """Trim an explanation to its gist within max_tokens, for use as prompt context.
+
+    Sentences mentioning words from `focus` (the learner's clarification) come first,
+    then the opening sentence of each section; the kept sentences stay in their
+    original order. Markdown emphasis is dropped.
+    """
+    focus_words = {word for word in re.findall(r"\w+", focus.lower()) if len(word) > 3}
+    sentences = []   # (priority, position, sentence)
+    for block in re.split(r"\n\s*\n", text.replace("**", "")):
+        lines = [line.strip(" #-*") for line in block.strip().splitlines() if line.strip(" #-*")]
+        if not lines:
+            continue
+        for index, sentence in enumerate(_SENTENCE_END.split(" ".join(lines))):
+            words = set(re.findall(r"\w+", sentence.lower()))
+            priority = 0 if focus_words & words else 1 if index == 0 else 2
+            sentences.append((priority, len(sentences), sentence))
+    kept, used = [], 0
+    for priority, position, sentence in sorted(sentences):
+        tokens = count_tokens(sentence)
+        if used + tokens > max_tokens:
+            continue
+        kept.append((position, sentence))
+        used += tokens
+    return " ".join(sentence for _, sentence in sorted(kept))
+
+_meter = ContextVar("token_meter", default=None)
+
+class TokenMeter:
+    """Adds up the tokens of the LLM calls made inside `with TokenMeter() as meter:`.
+
+    Only calls that reach the LLM are counted (the managers report them as they
+    account for them); content served from a cache costs nothing.
+    """
+
+    def __init__(self):
+        self.tokens = 0
+
+    def __enter__(self):
+        self._token = _meter.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _meter.reset(self._token)
+
+def meter_tokens(tokens):
+    """Count tokens against the TokenMeter active in this context, if any"""
+    meter = _meter.get()
+    if meter is not None:
+        meter.tokens += tokens
+
+class UsageLedger:
+    """Token usage per call site, course and topic, feeding back into quota reservations.
+
+    Each call is recorded with its prompt and completion token counts. Once a
+    (site, course, topic) has `min_samples` completions, the completion size to
+    expect becomes the longest recent completion plus `headroom`, never above the
+    site's configured max_tokens nor below `floor` of it. The gateway reserves that
+    much of its per-minute token quota instead of the full max_tokens. It is only an
+    estimate: the max_tokens sent to the API, and the length the prompt asks for,
+    stay the configured ones, so a longer reply is never cut off because of it.
+    """
+
+    def __init__(self, window=20, min_samples=3, headroom=0.25, floor=0.25):
+        self.window = window
+        self.min_samples = min_samples
+        self.headroom = headroom
+        self.floor = floor
+        self._recent = {}   # (site, course, topic) -> deque of completion token counts
+        self._totals = {}   # (site, course, topic) -> [calls, prompt tokens, completion tokens, truncated]
+        self._lock = threading.Lock()
+
+    def expected_tokens(self, site, course, topic, max_tokens):
+        """The completion tokens to reserve quota for, given the site's configured max_tokens"""
+        if not max_tokens:
+            return max_tokens
+        with self._lock:
+            recent = self._recent.get((site, course, topic))
+            if not recent or len(recent) < self.min_samples:
+                return max_tokens
+            longest = max(recent)
+        adapted = int(longest * (1 + self.headroom))
+        return max(int(max_tokens * self.floor), min(max_tokens, adapted))
+
+    def record(self, site, course, topic, prompt_tokens, completion_tokens, max_tokens=None):
+        key = (site, course, topic)
+        truncated = bool(max_tokens) and completion_tokens >= max_tokens * 0.95
+        with self._lock:
+            self._recent.setdefault(key, deque(maxlen=self.window)).append(completion_tokens)
+            totals = self._totals.setdefault(key, [0, 0, 0, 0])
+            totals[0] += 1
+            totals[1] += prompt_tokens
+            totals[2] += completion_tokens
+            totals[3] += truncated
+
+    def stats(self, top=10):
+        """Per-site totals and averages, and the courses/topics that used the most tokens"""
+        with self._lock:
+            totals = {key: list(values) for key, values in self._totals.items()}
+        sites, topics = {}, {}
+        for (site, course, topic), (calls, prompt, completion, truncated) in totals.items():
+            site_totals = sites.setdefault(site, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "truncated": 0})
+            site_totals["calls"] += calls
+            site_totals["prompt_tokens"] += prompt
+            site_totals["completion_tokens"] += completion
+            site_totals["truncated"] += truncated
+            name = f"{course} / {topic}" if topic else course
+            topics[name] = topics.get(name, 0) + prompt + completion
+        for site_totals in sites.values():
+            calls = site_totals["calls"]
+            site_totals["avg_tokens_per_call"] = round((site_totals["prompt_tokens"] + site_totals["completion_tokens"]) / calls, 1)
+        heaviest = sorted(topics.items(), key=lambda item: item[1], reverse=True)[:top]
+        return {"sites": sites, "top_topics": [{"topic": name, "tokens": tokens} for name, tokens in heaviest]}
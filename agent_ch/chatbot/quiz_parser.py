@@ -0,0 +1,143 @@
+import json
+import re
+
+LETTERS = ("A", "B", "C", "D")
+
+# "B", "b)", "(B)", "Option B", "Answer: B", "The correct answer is B) <option text>"
+_ANSWER_PATTERN = re.compile(
+    r"^(?:(?:the\s+)?(?:correct\s+)?(?:answer|option)(?:\s+is)?\s*[:\-]?\s*)?\(?([A-D])\)?[).:]?(?:\s+(.*))?$",
+    re.IGNORECASE
+)
+# Option labels: "A", "a)", "(A)", "Option A", "Option A:"
+_OPTION_KEY_PATTERN = re.compile(r"^(?:option\s*)?\(?([A-D])\)?[).:]?$", re.IGNORECASE)
+
+def _extract_json(text):
+    """Find the JSON payload in a reply that may be wrapped in code fences or prose"""
+    text = text.strip()
+    fenced = re.search(r"```(?:json)?\s*(.*?)```", text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1).strip()
+    # Try the outermost bracket first: a bare list of questions starts with "[" but contains "{"
+    pairs = sorted((("{", "}"), ("[", "]")), key=lambda pair: text.find(pair[0]) % (len(text) + 1))
+    for opener, closer in pairs:
+        start, end = text.find(opener), text.rfind(closer)
+        if start != -1 and end > start:
+            try:
+                return json.loads(text[start:end + 1])
+            except ValueError:
+                continue
+    return None
+
+def _lower_keys(item):
+    return {str(key).strip().lower(): value for key, value in item.items()}
+
+def _normalize_options(options):
+    """Accept {"A": ...}, {"Option A": ...}, ["...", ...] or ["A) ...", ...] and return {letter: text}"""
+    if isinstance(options, dict):
+        normalized = {}
+        for key, value in options.items():
+            match = _OPTION_KEY_PATTERN.match(str(key).strip())
+            # Unrecognised labels are kept as they are, so validation reports them
+            normalized[match.group(1).upper() if match else str(key)] = str(value).strip()
+        return normalized
+    if isinstance(options, list):
+        normalized = {}
+        for letter, option in zip(LETTERS, options):
+            option = str(option).strip()
+            match = re.match(r"^(?:option\s*)?\(?([A-Da-d])[).:]\s*(.*)$", option, re.IGNORECASE)
+            if match:
+                normalized[match.group(1).upper()] = match.group(2).strip()
+            else:
+                normalized[letter] = option
+        return normalized
+    return {}
+
+def _same_text(a, b):
+    return " ".join(a.lower().strip(" .").split()) == " ".join(b.lower().strip(" .").split())
+
+def _normalize_answer(answer, options):
+    """Accept "B", "b)", "Option B", "Answer: B", "B) <option text>" or the option text itself.
+
+    Anything else is rejected ("" fails validation, so the quiz is re-asked) rather
+    than guessing a letter out of free text.
+    """
+    answer = str(answer or "").strip()
+    for letter, text in options.items():
+        if text and _same_text(text, answer):
+            return letter
+    match = _ANSWER_PATTERN.match(answer)
+    if not match:
+        return ""
+    letter, text = match.group(1).upper(), match.group(2)
+    if text and not _same_text(text, options.get(letter, "")):
+        return ""
+    return letter
+
+def validate_question(item):
+    """Check one question against the schema; returns (question dict or None, error or None)"""
+    if not isinstance(item, dict):
+        return None, "question is not an object"
+    item = _lower_keys(item)
+    question = str(item.get("question", "")).strip()
+    options = _normalize_options(item.get("options") or item.get("choices"))
+    answer = _normalize_answer(item.get("answer") or item.get("correct_answer") or item.get("correct"), options)
+    if not question:
+        return None, "missing question text"
+    if any(not options.get(letter) for letter in LETTERS):
+        return None, "needs exactly four options labelled A-D"
+    if answer not in LETTERS:
+        return None, "answer must be one of A, B, C, D"
+    return {
+        "question": question,
+        "options": {letter: options[letter] for letter in LETTERS},
+        "answer": answer,
+        "explanation": str(item.get("explanation", "")).strip(),
+    }, None
+
+def _parse_lines(text):
+    """Fallback for the plain "Q1: ... / A) ... / Correct Answer: X" layout"""
+    items, current = [], None
+    for line in text.splitlines():
+        line = line.strip()
+        if re.match(r"^Q\d+[:.)]", line):
+            current = {"question": re.sub(r"^Q\d+[:.)]\s*", "", line), "options": {}}
+            items.append(current)
+        elif current is not None and re.match(r"^[A-D][).:]\s", line):
+            current["options"][line[0]] = line[2:].strip()
+        elif current is not None and line.lower().startswith("correct answer"):
+            current["answer"] = line.split(":", 1)[-1].strip()
+        elif current is not None and line.lower().startswith("explanation"):
+            current["explanation"] = line.split(":", 1)[-1].strip()
+    return items
+
+def parse_quiz(text):
+    """Parse and validate a quiz reply.
+
+    Returns (questions, errors): the questions that passed validation, and a
+    description of every problem found, which is suitable for a re-ask prompt.
+    """
+    data = _extract_json(text)
+    if isinstance(data, dict):
+        data = _lower_keys(data)
+        items = data.get("questions") or data.get("quiz") or []
+    elif isinstance(data, list):
+        items = data
+    else:
+        items = _parse_lines(text)
+    if not items:
+        return [], ["no questions found; reply must be a JSON object with a 'questions' list"]
+
+    questions, errors = [], []
+    for number, item in enumerate(items, start=1):
+        question, error = validate_question(item)
+        if error:
+            errors.append(f"question {number}: {error}")
+        else:
+            questions.append(question)
+    return questions, errors
+
+def format_question(number, question):
+    """Render a validated question the way the chat displays it"""
+    lines = [f"Q{number}: {question['question']}"]
+    lines += [f"{letter}) {question['options'][letter]}" for letter in LETTERS]
+    return "\n".join(lines)
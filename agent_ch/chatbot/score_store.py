@@ -0,0 +1,153 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+class ScoreStore:
+    """Interface for score storage backends used by ScoreManager"""
+
+    def set_score(self, session_id, course, score):
+        """Record the score for one session and course"""
+        raise NotImplementedError
+
+    def set_scores(self, updates):
+        """Record many (session_id, course, score) updates at once"""
+        for session_id, course, score in updates:
+            self.set_score(session_id, course, score)
+
+    def get_scores(self, session_id):
+        """Return {course: score} for a session"""
+        raise NotImplementedError
+
+    def all_scores(self):
+        """Return the full {session_id: {course: score}} mapping"""
+        raise NotImplementedError
+
+class JsonScoreStore(ScoreStore):
+    """The original score.json format: the whole file is rewritten on every update"""
+
+    def __init__(self, score_file="score.json"):
+        self.score_file = score_file
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists(self.score_file):
+            return {}
+        with open(self.score_file, 'r') as f:
+            return json.load(f)
+
+    def _save(self, scores):
+        with open(self.score_file, 'w') as f:
+            json.dump(scores, f, indent=2)
+
+    def set_score(self, session_id, course, score):
+        self.set_scores([(session_id, course, score)])
+
+    def set_scores(self, updates):
+        with self._lock:
+            scores = self._load()
+            for session_id, course, score in updates:
+                scores.setdefault(session_id, {})[course] = score
+            self._save(scores)
+
+    def get_scores(self, session_id):
+        return self._load().get(session_id, {})
+
+    def all_scores(self):
+        return self._load()
+
+class SQLiteScoreStore(ScoreStore):
+    """Embedded SQLite score store: O(1) upserts, safe across worker processes (WAL mode)"""
+
+    def __init__(self, db_file="scores.db", busy_timeout=5.0):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        self._init_db()
+
+    def _init_db(self):
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS scores (
+                    session_id TEXT NOT NULL,
+                    course TEXT NOT NULL,
+                    score INTEGER NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (session_id, course)
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_scores_course ON scores(course)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def set_score(self, session_id, course, score):
+        self.set_scores([(session_id, course, score)])
+
+    def set_scores(self, updates):
+        now = time.time()
+        rows = [(session_id, course, score, now) for session_id, course, score in updates]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO scores (session_id, course, score, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(session_id, course) DO UPDATE SET score = excluded.score, updated_at = excluded.updated_at",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get_scores(self, session_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT course, score FROM scores WHERE session_id = ?", (session_id,)
+            ).fetchall()
+        return dict(rows)
+
+    def all_scores(self):
+        scores = {}
+        with self._lock:
+            rows = self._conn.execute("SELECT session_id, course, score FROM scores").fetchall()
+        for session_id, course, score in rows:
+            scores.setdefault(session_id, {})[course] = score
+        return scores
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+def migrate_json_scores(score_file, store):
+    """Import an existing score.json into a SQLite store once; returns the number of rows imported"""
+    if store.get_meta("migrated_from") == os.path.abspath(score_file):
+        return 0
+    if not os.path.exists(score_file):
+        return 0
+    try:
+        scores = JsonScoreStore(score_file).all_scores()
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"Error reading score file for migration: {e}")
+        return 0
+    updates = [
+        (session_id, course, score)
+        for session_id, courses in scores.items()
+        for course, score in courses.items()
+    ]
+    store.set_scores(updates)
+    store.set_meta("migrated_from", os.path.abspath(score_file))
+    return len(updates)
+
+if __name__ == "__main__":
+    import sys
+    source = sys.argv[1] if len(sys.argv) > 1 else "score.json"
+    target = sys.argv[2] if len(sys.argv) > 2 else "scores.db"
+    count = migrate_json_scores(source, SQLiteScoreStore(target))
+    print(f"Migrated {count} scores from {source} to {target}")
@@ -0,0 +1,346 @@
+import asyncio
+import atexit
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from .journal import EventJournal
+from .models import SessionState
+
+def serialize_session(state):
+    """Encode a SessionState as compact, compressed JSON"""
+    return zlib.compress(json.dumps(state.to_dict(), separators=(",", ":")).encode("utf-8"))
+
+def deserialize_session(data):
+    """Decode bytes produced by serialize_session"""
+    return SessionState.from_dict(json.loads(zlib.decompress(data).decode("utf-8")))
+
+class SessionStore:
+    """Interface for where Chatbot keeps per-learner SessionState objects"""
+
+    def get(self, session_id, default=None):
+        """Return the session, or default if it is unknown or has expired"""
+        raise NotImplementedError
+
+    def set(self, session_id, state):
+        """Save (or re-save after mutation) a session"""
+        raise NotImplementedError
+
+    async def set_async(self, session_id, state):
+        """set() for coroutines; by default the save runs in a worker thread"""
+        await asyncio.to_thread(self.set, session_id, state)
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def evict_idle(self):
+        """Drop sessions idle for longer than the TTL; returns how many were removed"""
+        raise NotImplementedError
+
+    def memory_usage(self):
+        """Return {"sessions", "total_bytes", "avg_bytes"} for the stored sessions"""
+        raise NotImplementedError
+
+class InMemorySessionStore(SessionStore):
+    """Per-process store with LRU capacity and idle TTL"""
+
+    def __init__(self, max_sessions=10000, ttl=6 * 3600, sweep_interval=60):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.time()
+        self._sessions = OrderedDict()   # session_id -> (state, last_seen)
+        self._lock = threading.Lock()
+
+    def get(self, session_id, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return default
+            state, last_seen = entry
+            if self.ttl and now - last_seen > self.ttl:
+                del self._sessions[session_id]
+                self._dropped(session_id)
+                return default
+            self._sessions[session_id] = (state, now)
+            self._sessions.move_to_end(session_id)
+            return state
+
+    def set(self, session_id, state):
+        with self._lock:
+            self._sessions[session_id] = (state, time.time())
+            self._sessions.move_to_end(session_id)
+            while self.max_sessions and len(self._sessions) > self.max_sessions:
+                self._dropped(self._sessions.popitem(last=False)[0])
+        if time.time() - self._last_sweep > self.sweep_interval:
+            self.evict_idle()
+
+    def delete(self, session_id):
+        with self._lock:
+            if self._sessions.pop(session_id, None) is not None:
+                self._dropped(session_id)
+
+    def _dropped(self, session_id):
+        """Called (lock held) whenever a session is removed, by delete, LRU or TTL"""
+
+    def evict_idle(self):
+        self._last_sweep = time.time()
+        if not self.ttl:
+            return 0
+        cutoff = time.time() - self.ttl
+        removed = 0
+        with self._lock:
+            # Entries are kept in last-seen order, so the idle ones are at the front
+            while self._sessions:
+                session_id, (_, last_seen) = next(iter(self._sessions.items()))
+                if last_seen >= cutoff:
+                    break
+                del self._sessions[session_id]
+                self._dropped(session_id)
+                removed += 1
+        return removed
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def items(self):
+        with self._lock:
+            return [(session_id, state) for session_id, (state, _) in self._sessions.items()]
+
+    def memory_usage(self):
+        sizes = [state.size_bytes() for _, state in self.items()]
+        total = sum(sizes)
+        return {"sessions": len(sizes), "total_bytes": total, "avg_bytes": total // len(sizes) if sizes else 0}
+
+class SQLiteSessionStore(SessionStore):
+    """Store shared by every worker process on a host, via one SQLite file in WAL mode"""
+
+    def __init__(self, db_file="sessions.db", ttl=6 * 3600, sweep_interval=60, busy_timeout=5.0):
+        self.db_file = db_file
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.time()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at)")
+
+    def get(self, session_id, default=None):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return default
+        data, updated_at = row
+        if self.ttl and time.time() - updated_at > self.ttl:
+            self.delete(session_id)
+            return default
+        return deserialize_session(data)
+
+    def set(self, session_id, state):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?)",
+                (session_id, serialize_session(state), time.time()),
+            )
+        if time.time() - self._last_sweep > self.sweep_interval:
+            self.evict_idle()
+
+    def delete(self, session_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def evict_idle(self):
+        self._last_sweep = time.time()
+        if not self.ttl:
+            return 0
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,)
+            )
+        return cursor.rowcount
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def memory_usage(self):
+        """Sizes here are of the compressed rows on disk"""
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM sessions"
+            ).fetchone()
+        return {"sessions": count, "total_bytes": total, "avg_bytes": total // count if count else 0}
+
+class JournalSessionStore(InMemorySessionStore):
+    """In-memory store made durable by an append-only EventJournal.
+
+    Each save journals only the fields that changed since the session was last
+    journaled, as one compact JSON line, and returns once the group-committed batch
+    holding it has been fsynced (unless durable=False; after `commit_timeout` seconds it
+    returns anyway and the journal keeps retrying); set_async awaits the fsync
+    without tying up a thread, so concurrent async saves share batches. On startup the sessions are
+    rebuilt by replaying the latest snapshot and the journal after it. Every
+    `snapshot_every` records a new snapshot is written in the background and the
+    segments it covers are deleted. Only one process may use a journal directory
+    (it is locked while open); use SQLiteSessionStore to share sessions between workers.
+    """
+
+    def __init__(self, directory="session_journal", max_sessions=10000, ttl=6 * 3600, sweep_interval=60,
+                 snapshot_every=5000, durable=True, commit_interval=0.005, fsync=True, commit_timeout=5.0):
+        super().__init__(max_sessions=max_sessions, ttl=ttl, sweep_interval=sweep_interval)
+        self.snapshot_every = snapshot_every
+        self.durable = durable
+        self.commit_timeout = commit_timeout
+        self.journal = EventJournal(directory, commit_interval=commit_interval, fsync=fsync)
+        self._encoded = {}   # session_id -> {field: JSON text as last journaled}
+        self._since_snapshot = 0
+        self._snapshot_lock = threading.Lock()
+        self.replayed = self._replay()
+        if self.replayed:
+            # Fold what was just replayed into a fresh snapshot
+            self.snapshot()
+        atexit.register(self.close)
+
+    @staticmethod
+    def _encode(value):
+        return json.dumps(value, separators=(",", ":"))
+
+    @staticmethod
+    def _record(session_id, fields, timestamp):
+        return '{"s":%s,"t":%.3f,"f":{%s}}' % (
+            json.dumps(session_id), timestamp, ",".join(f'"{field}":{text}' for field, text in fields)
+        )
+
+    def _replay(self):
+        """Rebuild sessions from the snapshot and journal; returns the number of records read"""
+        values = {}      # session_id -> {field: value}
+        last_seen = {}
+        records = 0
+        for record in self.journal.replay():
+            records += 1
+            session_id = record.get("s")
+            if record.get("d"):
+                values.pop(session_id, None)
+                last_seen.pop(session_id, None)
+                continue
+            values.setdefault(session_id, {}).update(record.get("f", {}))
+            last_seen[session_id] = record.get("t", 0.0)
+        now = time.time()
+        live = [
+            session_id for session_id in sorted(last_seen, key=last_seen.get)
+            if not self.ttl or now - last_seen[session_id] <= self.ttl
+        ]
+        if self.max_sessions:
+            live = live[-self.max_sessions:]
+        with self._lock:
+            for session_id in live:
+                data = values[session_id]
+                self._sessions[session_id] = (SessionState.from_dict(data), last_seen[session_id])
+                self._encoded[session_id] = {field: self._encode(value) for field, value in data.items()}
+        return records
+
+    def set(self, session_id, state):
+        seq = self._journal_changes(session_id, state)
+        if seq is not None and self.durable and not self.journal.wait(seq, self.commit_timeout):
+            self._commit_timed_out(session_id)
+
+    async def set_async(self, session_id, state):
+        seq = self._journal_changes(session_id, state)
+        if seq is not None and self.durable:
+            try:
+                await asyncio.wait_for(self.journal.wait_async(seq), self.commit_timeout)
+            except asyncio.TimeoutError:
+                self._commit_timed_out(session_id)
+
+    def _commit_timed_out(self, session_id):
+        # The session is saved in memory and the journal keeps retrying; don't hold the request for it
+        print(f"Session {session_id} not journaled after {self.commit_timeout}s; the journal writer is still retrying")
+
+    def _journal_changes(self, session_id, state):
+        """Store the session and queue a record of its changed fields; returns the record's sequence number"""
+        encoded = {field: self._encode(value) for field, value in state.to_dict().items()}
+        seq = None
+        with self._lock:
+            previous = self._encoded.get(session_id)
+            changed = [(field, text) for field, text in encoded.items() if previous is None or previous.get(field) != text]
+            if changed:
+                self._encoded[session_id] = encoded
+                seq = self.journal.append(self._record(session_id, changed, time.time()))
+                self._since_snapshot += 1
+        super().set(session_id, state)
+        if self.snapshot_every and self._since_snapshot >= self.snapshot_every and not self._snapshot_lock.locked():
+            threading.Thread(target=self._background_snapshot, name="session-snapshot", daemon=True).start()
+        return seq
+
+    def _dropped(self, session_id):
+        if self._encoded.pop(session_id, None) is not None:
+            self.journal.append('{"s":%s,"t":%.3f,"d":1}' % (json.dumps(session_id), time.time()))
+            self._since_snapshot += 1
+
+    def _background_snapshot(self):
+        if not self._snapshot_lock.acquire(blocking=False):
+            return
+        try:
+            self._write_snapshot()
+        except OSError as e:
+            print(f"Error writing session snapshot: {e}")
+        finally:
+            self._snapshot_lock.release()
+
+    def snapshot(self):
+        """Write a snapshot of every session and delete the journal segments it replaces"""
+        with self._snapshot_lock:
+            self._write_snapshot()
+
+    def _write_snapshot(self):
+        # Rotate (which fsyncs) outside the store lock. Everything in the older segments is
+        # already in self._encoded; later records replayed on top of the snapshot are harmless.
+        next_segment = self.journal.rotate()
+        with self._lock:
+            sessions = [
+                (session_id, self._encoded[session_id], last_seen)
+                for session_id, (_, last_seen) in self._sessions.items()
+                if session_id in self._encoded
+            ]
+            self._since_snapshot = 0
+        # Field encodings are replaced, never mutated, so they can be written outside the lock
+        lines = (self._record(session_id, fields.items(), last_seen) for session_id, fields, last_seen in sessions)
+        self.journal.write_snapshot(lines, next_segment)
+
+    def memory_usage(self):
+        usage = super().memory_usage()
+        usage["journal"] = self.journal.stats()
+        return usage
+
+    def close(self):
+        """Snapshot and stop the journal writer"""
+        if self.journal.closed:
+            return
+        try:
+            self.snapshot()
+        except OSError as e:
+            print(f"Error writing session snapshot: {e}")
+        try:
+            self.journal.close()
+        except OSError as e:
+            print(f"Error writing session journal: {e}")
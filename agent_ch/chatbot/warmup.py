@@ -0,0 +1,198 @@
+"""Pre-generate explanations, quiz variants and answer rationales for the whole catalog.
+
+Everything lands in the shared ContentCache, which the managers read before calling
+the LLM, so the first learner on a topic after a deploy gets a cache hit. Entries
+that are already fresh are skipped, so an interrupted run just picks up where it
+stopped when started again.
+
+    python -m chatbot.warmup --workers 4
+    python -m chatbot.warmup --course Python --max-age 86400
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .gateway import BACKGROUND, llm_priority
+
+class WarmUp:
+    """Walks the catalog and fills missing or stale cache entries with a bounded thread pool.
+
+    Each topic is one explanation job plus one quiz job; the quiz job fills its variant
+    slots one after another so the gateway doesn't coalesce them into the same reply.
+    """
+
+    def __init__(self, course_manager, explanation_manager, quiz_manager, cache, workers=4,
+                 max_age=None, progress=None):
+        self.course_manager = course_manager
+        self.explanation_manager = explanation_manager
+        self.quiz_manager = quiz_manager
+        self.cache = cache
+        self.workers = workers
+        self.max_age = max_age
+        self.progress = progress
+        self.counts = {"generated": 0, "skipped": 0, "failed": 0}
+        self._lock = threading.Lock()
+
+    def _fresh(self, key):
+        entry = self.cache.peek(key)
+        return entry is not None and (self.max_age is None or entry[1] <= self.max_age)
+
+    def _written_since(self, key, started):
+        """True if the entry was (re)written after `started` (a time.time() value)"""
+        entry = self.cache.peek(key)
+        return entry is not None and entry[1] <= time.time() - started
+
+    def _count(self, outcome, amount=1):
+        with self._lock:
+            self.counts[outcome] += amount
+
+    def _warm_explanation(self, course, topic):
+        if self._fresh(self.explanation_manager.explanation_key(course, topic)):
+            self._count("skipped")
+            return
+        started = time.time()
+        self.explanation_manager.fetch_topic_explanation(course, topic, use_cache=False)
+        written = self._written_since(self.explanation_manager.explanation_key(course, topic), started)
+        self._count("generated" if written else "failed")
+
+    def _warm_quiz(self, course, topic):
+        for variant in range(self.cache.quiz_variants):
+            key = self.quiz_manager.quiz_key(course, topic, variant)
+            if self._fresh(key):
+                self._count("skipped")
+                continue
+            started = time.time()
+            quiz_questions = self.quiz_manager.generate_quiz_questions(course, topic, variant, use_cache=False)
+            if not self._written_since(key, started):
+                self._count("failed")
+                continue
+            self._fill_rationales(course, topic, variant, quiz_questions)
+            self._count("generated")
+
+    def _fill_rationales(self, course, topic, variant, quiz_questions):
+        """Add answer rationales to any question that came back without one"""
+        missing = [q for q in quiz_questions if not q.get("explanation")]
+        for question in missing:
+            explanation = self.quiz_manager.get_answer_explanation(course, question["question"], question["answer"])
+            if not explanation.startswith("Error getting explanation"):
+                question["explanation"] = explanation
+        if missing:
+            self.quiz_manager.store_quiz(course, topic, variant, quiz_questions)
+
+    def _run_job(self, job):
+        kind, course, topic = job
+        with llm_priority(BACKGROUND):
+            if kind == "explanation":
+                self._warm_explanation(course, topic)
+            else:
+                self._warm_quiz(course, topic)
+
+    def jobs(self, courses=None):
+        """Every (kind, course, topic) to check, in catalog order"""
+        return [
+            (kind, course, topic)
+            for course in (courses or self.course_manager.get_courses())
+            for topic in self.course_manager.get_topics(course)
+            for kind in ("explanation", "quiz")
+        ]
+
+    def entries(self, jobs):
+        """Number of cache entries the jobs cover (each quiz job fills every variant slot)"""
+        return sum(1 if kind == "explanation" else self.cache.quiz_variants for kind, _, _ in jobs)
+
+    def run(self, courses=None):
+        """Warm the cache and return a summary with counts, elapsed time and throughput"""
+        jobs = self.jobs(courses)
+        total = self.entries(jobs)
+        start = time.monotonic()
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="warmup")
+        futures = [executor.submit(self._run_job, job) for job in jobs]
+        interrupted = False
+        try:
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Error warming up content: {e}")
+                if self.progress:
+                    self.progress(self.summary(total, start))
+        except KeyboardInterrupt:
+            interrupted = True
+            for future in futures:
+                future.cancel()
+        finally:
+            executor.shutdown(wait=True)
+        return dict(self.summary(total, start), interrupted=interrupted)
+
+    def summary(self, total, start):
+        elapsed = time.monotonic() - start
+        with self._lock:
+            counts = dict(self.counts)
+        done = sum(counts.values())
+        return dict(
+            counts,
+            total=total,
+            done=done,
+            elapsed=round(elapsed, 2),
+            generated_per_sec=round(counts["generated"] / elapsed, 2) if elapsed else 0.0,
+        )
+
+def print_progress(summary):
+    percent = summary["done"] * 100 / summary["total"] if summary["total"] else 100
+    print(
+        f"\r[{summary['done']}/{summary['total']}] {percent:5.1f}%  "
+        f"generated {summary['generated']}  skipped {summary['skipped']}  failed {summary['failed']}  "
+        f"{summary['generated_per_sec']}/s",
+        end="", file=sys.stderr, flush=True
+    )
+
+def main(argv=None):
+    from .cache import ContentCache
+    from .gateway import gateway_from_env
+    from .llm import call_configs_from_env, provider_from_env
+    from .managers import CourseManager, ExplanationManager, QuizManager
+
+    parser = argparse.ArgumentParser(description="Pre-generate topic content into the content cache")
+    parser.add_argument("--data-file", default="data.json")
+    parser.add_argument("--course", action="append", help="only warm this course (repeatable)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WARMUP_WORKERS", 4)))
+    parser.add_argument("--max-age", type=float, help="regenerate entries older than this many seconds")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    # Same settings as app.py, so the warmed cache is the one the app reads
+    cache = ContentCache(
+        os.getenv("CONTENT_CACHE_DB", "content_cache.db"),
+        ttl=int(os.getenv("CONTENT_CACHE_TTL", 7 * 24 * 3600)),
+        max_entries=int(os.getenv("CONTENT_CACHE_MAX_ENTRIES", 5000)),
+        quiz_variants=int(os.getenv("QUIZ_VARIANTS", 3))
+    )
+    llm = gateway_from_env(provider_from_env())
+    configs = call_configs_from_env()
+    course_manager = CourseManager(args.data_file)
+    courses = [course_manager.get_matched_course(name) or name for name in args.course or []]
+
+    warmup = WarmUp(
+        course_manager,
+        ExplanationManager(llm, cache, configs=configs),
+        QuizManager(llm, cache, configs=configs),
+        cache,
+        workers=args.workers,
+        max_age=args.max_age,
+        progress=None if args.json else print_progress
+    )
+    summary = warmup.run(courses)
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print(file=sys.stderr)
+        state = "Interrupted" if summary["interrupted"] else "Done"
+        print(f"{state}: {summary['generated']} generated, {summary['skipped']} already fresh, "
+              f"{summary['failed']} failed in {summary['elapsed']}s ({summary['generated_per_sec']} entries/s)")
+    return 1 if summary["failed"] or summary["interrupted"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
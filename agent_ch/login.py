@@ -1,12 +1,138 @@
+import atexit
 import json
 import os
 import hashlib
+import sqlite3
+import threading
 from datetime import datetime  # Added for timestamp
+from chatbot.metrics import span
+
+class UserStore:
+    """SQLite-backed user and session store shared safely by multiple worker processes"""
+
+    def __init__(self, db_file="users.db", busy_timeout=5.0):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        self._init_db()
+
+    def _init_db(self):
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS users (
+                    username TEXT PRIMARY KEY,
+                    password_hash TEXT NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS user_sessions (
+                    username TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    course TEXT NOT NULL,
+                    score INTEGER NOT NULL,
+                    last_updated TEXT NOT NULL,
+                    PRIMARY KEY (username, session_id, course)
+                )"""
+            )
+
+    def get_password_hash(self, username):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT password_hash FROM users WHERE username = ?", (username,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def add_user(self, username, password_hash):
+        """Insert a user; returns False if the username is taken"""
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, password_hash)
+                )
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def user_exists(self, username):
+        return self.get_password_hash(username) is not None
+
+    def write_sessions(self, rows):
+        """Upsert (username, session_id, course, score, last_updated) rows in one transaction"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO user_sessions (username, session_id, course, score, last_updated) "
+                    "VALUES (?, ?, ?, ?, ?) ON CONFLICT(username, session_id, course) "
+                    "DO UPDATE SET score = excluded.score, last_updated = excluded.last_updated",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get_sessions(self, username):
+        """Return sessions in the users.json shape: {session_id: {course: score, "last_updated": ts}}"""
+        sessions = {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT session_id, course, score, last_updated FROM user_sessions "
+                "WHERE username = ? ORDER BY last_updated",
+                (username,),
+            ).fetchall()
+        for session_id, course, score, last_updated in rows:
+            session = sessions.setdefault(session_id, {})
+            session[course] = score
+            session["last_updated"] = last_updated
+        return sessions
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None
+
+    def import_users(self, users):
+        """Bulk-load users in the legacy users.json format"""
+        session_rows = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for username, user in users.items():
+                    password_hash = user.get("password") or user.get("password_hash")
+                    if not password_hash:
+                        continue
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?)",
+                        (username, password_hash),
+                    )
+                    for session_id, session in user.get("sessions", {}).items():
+                        last_updated = session.get("last_updated", "")
+                        for course, score in session.items():
+                            if course != "last_updated":
+                                session_rows.append((username, session_id, course, score, last_updated))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if session_rows:
+            self.write_sessions(session_rows)
 
 class UserManager:
-    def __init__(self, users_file="users.json"):
+    def __init__(self, users_file="users.json", users_db="users.db", flush_interval=1.0, aggregates=None):
         self.users_file = users_file
-        self.users = self._load_users()
+        self.store = UserStore(users_db)
+        self.flush_interval = flush_interval
+        self.aggregates = aggregates
+        self._pending = {}
+        self._pending_totals = {}   # (username, session_id, course) -> latest totals for the aggregates
+        self._pending_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._migrate_users()
+        self._writer = threading.Thread(target=self._write_behind, name="user-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
     
     def _load_users(self):
         """Load users from JSON file"""
@@ -17,15 +143,49 @@ class UserManager:
                 return json.load(f)
         except (json.JSONDecodeError, FileNotFoundError):
             return {}
-    
-    def _save_users(self):
-        """Save users to JSON file"""
-        with open(self.users_file, "w") as f:
-            json.dump(self.users, f, indent=2)
+
+    def _migrate_users(self):
+        """Import the legacy users.json into an empty store"""
+        if self.store.is_empty():
+            self.store.import_users(self._load_users())
+
+    def _write_behind(self):
+        """Background loop that flushes queued session updates"""
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write all queued session updates in a single transaction"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+            totals, self._pending_totals = self._pending_totals, {}
+        if pending:
+            try:
+                with span("store.user_sessions_write"):
+                    self.store.write_sessions(list(pending.values()))
+            except Exception as e:
+                print(f"Error writing user sessions: {e}")
+                with self._pending_lock:
+                    for key, row in pending.items():
+                        self._pending.setdefault(key, row)
+        if totals and self.aggregates is not None:
+            try:
+                with span("store.aggregates_write"):
+                    self.aggregates.record_user_sessions(list(totals.values()))
+            except Exception as e:
+                print(f"Error updating user aggregates: {e}")
+                with self._pending_lock:
+                    for key, row in totals.items():
+                        self._pending_totals.setdefault(key, row)
+
+    def close(self):
+        """Stop the writer thread and flush anything still queued"""
+        self._stop.set()
+        self.flush()
     
     def register_user(self, username, password):
         """Register a new user"""
-        if username in self.users:
+        if self.store.user_exists(username):
             return False, "Username already exists"
         
         if len(password) < 6:
@@ -33,22 +193,15 @@ class UserManager:
         
         # Hash the password before storing
         hashed_password = hashlib.sha256(password.encode()).hexdigest()
-        self.users[username] = {
-            "password": hashed_password,
-            "sessions": {}
-        }
-        self._save_users()
+        if not self.store.add_user(username, hashed_password):
+            return False, "Username already exists"
         return True, "Registration successful"
     
     def authenticate_user(self, username, password):
-        # Reload users to get latest data
-        self.users = self._load_users()
-        
-        user = self.users.get(username)
-        if not user:
+        stored_password_hash = self.store.get_password_hash(username)
+        if stored_password_hash is None:
             return False, "User not found"
         
-        stored_password_hash = user.get("password")
         if not stored_password_hash:
             return False, "Corrupted user data: no password found"
         
@@ -62,23 +215,23 @@ class UserManager:
 
     def get_user_sessions(self, username):
         """Get user's session data"""
-        return self.users.get(username, {}).get("sessions", {})
+        self.flush()
+        return self.store.get_sessions(username)
     
-    def update_user_session(self, username, session_id, course, score):
-        """Update user's session data with timestamp"""
-        if username not in self.users:
-            return
-        
-        if "sessions" not in self.users[username]:
-            self.users[username]["sessions"] = {}
+    def update_user_session(self, username, session_id, course, score, answered=0, best=0):
+        """Queue an update of the user's session data; it is written behind the request.
 
-        if session_id not in self.users[username]["sessions"]:
-            self.users[username]["sessions"][session_id] = {}
-        
-        # Update score for the course
-        self.users[username]["sessions"][session_id][course] = score
-        
-        # Update the last updated timestamp
-        self.users[username]["sessions"][session_id]["last_updated"] = str(datetime.now())
-        
-        self._save_users()
+        score, answered and best are the session's totals for this course: correct
+        answers, questions answered and the best quiz score, for the per-user aggregates.
+        """
+        with self._pending_lock:
+            self._pending[(username, session_id, course)] = (
+                username, session_id, course, score, str(datetime.now())
+            )
+            if self.aggregates is not None:
+                self._pending_totals[(username, session_id, course)] = (username, session_id, course, score, answered, best)
+
+    def get_user_progress(self, username):
+        """Return the user's aggregated quiz totals, overall and per course"""
+        self.flush()
+        return self.aggregates.user_progress(username)
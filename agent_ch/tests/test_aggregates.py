@@ -0,0 +1,39 @@
+from chatbot.aggregates import ScoreAggregates
+from chatbot.models import SessionState
+from login import UserManager
+
+def totals(attempts, correct, best):
+    return {"attempts": attempts, "correct": correct, "best": best}
+
+def picked(row):
+    return {key: row[key] for key in ("attempts", "correct", "best")}
+
+def test_switching_course_mid_session_keeps_each_course_apart(tmp_path):
+    aggregates = ScoreAggregates(str(tmp_path / "aggregates.db"))
+    users = UserManager(str(tmp_path / "users.json"), str(tmp_path / "users.db"), flush_interval=60, aggregates=aggregates)
+    state = SessionState("s1")
+
+    def quiz(course, answers):
+        state.quiz_score = 0
+        for correct in answers:
+            state.quiz_score += int(correct)
+            users.update_user_session("ana", "s1", course, *state.record_answer(course, correct))
+
+    # Both courses within one flush interval
+    quiz("Python", [True, True, False])
+    quiz("Java", [True])
+    users.flush()
+    quiz("Python", [True])
+    users.close()
+
+    progress = aggregates.user_progress("ana")
+    assert picked(progress["courses"]["Python"]) == totals(4, 3, 2)
+    assert picked(progress["courses"]["Java"]) == totals(1, 1, 1)
+    assert picked(progress["totals"]) == totals(5, 4, 2)
+
+def test_resent_totals_are_not_counted_twice(tmp_path):
+    aggregates = ScoreAggregates(str(tmp_path / "aggregates.db"))
+    row = ("ana", "s1", "Python", 2, 3, 2)
+    aggregates.record_user_sessions([row])
+    aggregates.record_user_sessions([row])
+    assert picked(aggregates.user_progress("ana")["totals"]) == totals(3, 2, 2)
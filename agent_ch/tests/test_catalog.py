@@ -0,0 +1,45 @@
+from chatbot.catalog import Catalog
+from chatbot.chatbot import Chatbot
+from chatbot.llm import StubProvider
+from chatbot.managers import CourseManager, ExplanationManager, QuizManager, ScoreManager
+
+CATALOG = Catalog({
+    "Courses": ["Python", "Java"],
+    "Aliases": {"core java": "Java"},
+    "Python": {"Introduction": ["Syntax"], "Lists": ["Slicing"]},
+    "Java": {"Introduction": ["JVM"]},
+})
+
+def test_matches_names_and_aliases_only():
+    assert CATALOG.match_course("python") == "Python"
+    assert CATALOG.match_course("Core  Java") == "Java"
+    assert CATALOG.match_course("lava") is None
+
+def test_misspelled_names_are_only_suggested():
+    assert CATALOG.closest_course("lava") == "Java"
+    assert CATALOG.closest_course("pyhton") == "Python"
+    assert CATALOG.closest_course("cobol") is None
+
+def test_topics_are_identified_by_course_and_name():
+    rebuilt = Catalog({"Courses": ["Java", "Python"], "Java": {"Introduction": ["JVM"]},
+                       "Python": {"Introduction": ["Syntax"], "Lists": ["Slicing"]}})
+    assert rebuilt.topics("Python") == CATALOG.topics("Python")
+
+def chatbot():
+    llm = StubProvider(latency="fixed", median_latency=0)
+    return Chatbot(CourseManager(), ExplanationManager(llm), QuizManager(llm), ScoreManager())
+
+def test_chatbot_asks_before_switching_to_a_suggested_course():
+    bot = chatbot()
+    assert bot.handle_message("s1", "lava")["response"] == "Did you mean Java? (yes/no)"
+    assert bot.get_or_create_session("s1").selected_course is None
+
+    assert bot.handle_message("s1", "yes")["response"].startswith("**")
+    assert bot.get_or_create_session("s1").selected_course == "Java"
+
+def test_chatbot_takes_no_for_an_answer():
+    bot = chatbot()
+    bot.handle_message("s1", "lava")
+    assert "available" in bot.handle_message("s1", "no")["response"]
+    state = bot.get_or_create_session("s1")
+    assert state.selected_course is None and state.suggested_course is None
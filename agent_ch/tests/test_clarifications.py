@@ -0,0 +1,37 @@
+import pytest
+from chatbot.clarifications import ClarificationCache, normalize_clarification
+
+pytest.importorskip("numpy")
+
+def cache_with(clarification):
+    cache = ClarificationCache()
+    cache.put("Python", "Lists", clarification, "cached answer")
+    return cache
+
+@pytest.mark.parametrize("asked, again", [
+    ("I didn't get append", "What does append do?"),
+    ("Can you explain slicing again please", "slicing??"),
+    ("I don't understand list comprehensions", "i dont understand list comprehension"),
+    ("what is the append method", "explain the append method"),
+])
+def test_serves_rewordings_of_the_same_question(asked, again):
+    cache = cache_with(asked)
+    assert cache.get("Python", "Lists", again) == "cached answer"
+
+@pytest.mark.parametrize("asked, other", [
+    ("difference between list and tuple", "difference between tuple and set"),
+    ("why use range(10)", "why use range(1, 10)"),
+    ("what is list[0]", "what is list[-1]"),
+    ("explain sort", "explain sorted"),
+])
+def test_does_not_serve_a_similar_but_different_question(asked, other):
+    cache = cache_with(asked)
+    assert cache.get("Python", "Lists", other) is None
+    assert cache.stats()["misses"] == 1
+
+def test_answers_are_kept_per_topic():
+    cache = cache_with("I didn't get append")
+    assert cache.get("Python", "Tuples", "I didn't get append") is None
+
+def test_normalize_drops_filler_words():
+    assert normalize_clarification("I didn't get append?") == "append"
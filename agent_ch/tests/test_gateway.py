@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import time
+import pytest
+from chatbot.gateway import AsyncLLMGateway, LLMGateway, RateBudget, BACKGROUND, llm_priority
+from chatbot.llm import AsyncLLMProvider, CallConfig, LLMProvider, LLMTimeoutError, StubProvider, llm_deadline
+
+CONFIG = CallConfig("test-model", 0.0, 100)
+
+def prompt(text):
+    return [{"role": "user", "content": text}]
+
+class SlowAsyncProvider(AsyncLLMProvider):
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = 0
+        self.cancelled = 0
+
+    async def complete(self, messages, config, json_mode=False):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return "reply to " + messages[-1]["content"]
+
+class RecordingProvider(LLMProvider):
+    def __init__(self):
+        self.order = []
+        self._lock = threading.Lock()
+
+    def complete(self, messages, config, json_mode=False):
+        with self._lock:
+            self.order.append(messages[-1]["content"])
+        return "reply to " + messages[-1]["content"]
+
+def test_follower_survives_the_leader_timing_out():
+    provider = SlowAsyncProvider(0.3)
+    gateway = AsyncLLMGateway(provider)
+
+    async def follower():
+        await asyncio.sleep(0.05)
+        return await asyncio.wait_for(gateway.complete(prompt("Python"), CONFIG), timeout=1.0)
+
+    async def main():
+        leader = asyncio.wait_for(gateway.complete(prompt("Python"), CONFIG), timeout=0.1)
+        return await asyncio.gather(leader, follower(), return_exceptions=True)
+
+    leader_result, follower_result = asyncio.run(main())
+    assert isinstance(leader_result, asyncio.TimeoutError)
+    assert follower_result == "reply to Python"
+    assert provider.calls == 1 and provider.cancelled == 0
+    assert gateway.coalesced == 1
+
+def test_call_is_cancelled_once_nobody_waits_for_it():
+    provider = SlowAsyncProvider(0.3)
+    gateway = AsyncLLMGateway(provider)
+
+    async def main():
+        try:
+            await asyncio.wait_for(gateway.complete(prompt("Python"), CONFIG), timeout=0.05)
+        except asyncio.TimeoutError:
+            pass
+        await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    assert provider.cancelled == 1
+    assert gateway.stats()["in_flight"] == 0
+
+def test_interactive_caller_joining_a_background_call_raises_its_priority():
+    provider = RecordingProvider()
+    # One call per 0.3s window, so later calls queue and go out in priority order
+    gateway = LLMGateway(provider, RateBudget(requests_per_minute=1, window=0.3))
+    gateway.complete(prompt("warm-up"), CONFIG)
+
+    def prefetch():
+        with llm_priority(BACKGROUND):
+            gateway.complete(prompt("next topic"), CONFIG)
+
+    threads = [
+        threading.Thread(target=prefetch),
+        threading.Thread(target=gateway.complete, args=(prompt("other learner"), CONFIG)),
+        threading.Thread(target=gateway.complete, args=(prompt("next topic"), CONFIG)),
+    ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join(timeout=5)
+
+    # The joined prefetch had been queued before the other interactive call
+    assert provider.order == ["warm-up", "next topic", "other learner"]
+    assert gateway.coalesced == 1
+
+def test_async_interactive_caller_raises_a_queued_background_call():
+    provider = RecordingProvider()
+
+    class AsyncRecording(AsyncLLMProvider):
+        async def complete(self, messages, config, json_mode=False):
+            return provider.complete(messages, config, json_mode)
+
+    gateway = AsyncLLMGateway(AsyncRecording(), RateBudget(requests_per_minute=1, window=0.3))
+
+    async def background():
+        with llm_priority(BACKGROUND):
+            return await gateway.complete(prompt("next topic"), CONFIG)
+
+    async def later(coro, delay):
+        await asyncio.sleep(delay)
+        return await coro
+
+    async def main():
+        await gateway.complete(prompt("warm-up"), CONFIG)
+        await asyncio.gather(
+            background(),
+            later(gateway.complete(prompt("other learner"), CONFIG), 0.05),
+            later(gateway.complete(prompt("next topic"), CONFIG), 0.1),
+        )
+
+    asyncio.run(main())
+    assert provider.order == ["warm-up", "next topic", "other learner"]
+
+def test_call_queued_past_its_deadline_gives_up_its_place():
+    provider = RecordingProvider()
+    gateway = LLMGateway(provider, RateBudget(requests_per_minute=1, window=5))
+    gateway.complete(prompt("warm-up"), CONFIG)
+
+    started = time.monotonic()
+    with llm_deadline(0.1), pytest.raises(LLMTimeoutError):
+        gateway.complete(prompt("late"), CONFIG)
+    assert time.monotonic() - started < 1
+    assert provider.order == ["warm-up"]
+    assert gateway.stats()["waiting"] == 0 and gateway.stats()["in_flight"] == 0
+
+def test_stub_call_stops_at_its_deadline():
+    provider = StubProvider(latency="fixed", median_latency=2)
+    started = time.monotonic()
+    with llm_deadline(0.1), pytest.raises(LLMTimeoutError):
+        provider.complete(prompt("Python"), CONFIG)
+    assert time.monotonic() - started < 1
+
+def test_call_larger_than_the_token_budget_waits_for_an_empty_window():
+    provider = RecordingProvider()
+    gateway = LLMGateway(provider, RateBudget(tokens_per_minute=100, window=0.3))
+    gateway.complete(prompt("warm-up"), CallConfig("test-model", 0.0, 10))
+
+    started = time.monotonic()
+    gateway.complete(prompt("long answer"), CallConfig("test-model", 0.0, 500))
+    assert time.monotonic() - started >= 0.2
+    assert provider.order == ["warm-up", "long answer"]
@@ -0,0 +1,43 @@
+import os
+import time
+from chatbot.journal import EventJournal
+from chatbot.models import SessionState
+from chatbot.session_store import JournalSessionStore
+
+def failing_fsync(times):
+    real_fsync = os.fsync
+    calls = []
+
+    def fsync(fd):
+        calls.append(fd)
+        if len(calls) <= times:
+            raise OSError("disk full")
+        real_fsync(fd)
+    return fsync
+
+def test_failed_batch_is_retried_before_it_counts_as_committed(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, "fsync", failing_fsync(1))
+    journal = EventJournal(str(tmp_path), commit_interval=0)
+    first = journal.append('{"n":1}')
+
+    assert not journal.wait(first, timeout=0.3)
+    assert journal.committed == 0
+    second = journal.append('{"n":2}')
+    assert journal.wait(second, timeout=5)
+    journal.close()
+
+    reopened = EventJournal(str(tmp_path))
+    records = list(reopened.replay())
+    reopened.close()
+    assert records[-2:] == [{"n": 1}, {"n": 2}]
+
+def test_save_does_not_hang_while_the_journal_cannot_write(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, "fsync", failing_fsync(1000))
+    store = JournalSessionStore(str(tmp_path), commit_interval=0, commit_timeout=0.2)
+    started = time.monotonic()
+    store.set("s1", SessionState("s1"))
+    assert time.monotonic() - started < 1
+    assert store.get("s1") is not None
+    assert store.journal.committed == 0
+    monkeypatch.undo()
+    store.close()
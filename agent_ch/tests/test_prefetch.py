@@ -0,0 +1,35 @@
+import time
+from chatbot.gateway import LLMGateway
+from chatbot.llm import StubProvider
+from chatbot.managers import ExplanationManager, QuizManager
+from chatbot.prefetch import Prefetcher
+
+def setup(latency):
+    gateway = LLMGateway(StubProvider(latency="fixed", median_latency=latency))
+    explanations = ExplanationManager(gateway)
+    return gateway, explanations, Prefetcher(explanations, QuizManager(gateway))
+
+def test_takes_a_finished_job():
+    gateway, explanations, prefetcher = setup(0)
+    prefetcher.schedule_topic("s1", "Python", "Lists")
+    while prefetcher.stats()["in_flight"]:
+        time.sleep(0.01)
+
+    explanation, quiz_questions = prefetcher.take_topic("s1", "Python", "Lists")
+    assert explanation and quiz_questions
+    assert prefetcher.stats()["used"] == 1
+
+def test_does_not_wait_for_an_unfinished_job():
+    gateway, explanations, prefetcher = setup(0.3)
+    prefetcher.schedule_topic("s1", "Python", "Lists")
+    time.sleep(0.05)   # the job's explanation call is now in flight
+
+    started = time.monotonic()
+    assert prefetcher.take_topic("s1", "Python", "Lists") is None
+    assert time.monotonic() - started < 0.05
+
+    # The turn's own call joins the job's call instead of starting another
+    explanation = explanations.fetch_topic_explanation("Python", "Lists")
+    assert not explanation.startswith("Error")
+    assert gateway.coalesced == 1
+    assert prefetcher.stats()["used"] == 0
@@ -0,0 +1,110 @@
+import json
+import pytest
+from chatbot.quiz_parser import parse_quiz, validate_question, format_question
+
+OPTIONS = {"A": "A tuple", "B": "A list", "C": "A dict", "D": "A set"}
+
+def question(**fields):
+    item = {"question": "Which type is mutable and ordered?", "options": dict(OPTIONS), "answer": "B",
+            "explanation": "Lists can be changed in place."}
+    item.update(fields)
+    return item
+
+def reply(*items):
+    return json.dumps({"questions": list(items)})
+
+def test_parses_well_formed_reply():
+    questions, errors = parse_quiz(reply(question(), question(question="Which type is immutable?", answer="A")))
+    assert errors == []
+    assert [q["answer"] for q in questions] == ["B", "A"]
+    assert questions[0]["options"] == OPTIONS
+    assert questions[0]["explanation"] == "Lists can be changed in place."
+
+def test_extracts_json_from_code_fences_and_prose():
+    text = "Sure! Here is your quiz:\n```json\n" + reply(question()) + "\n```\nGood luck!"
+    questions, errors = parse_quiz(text)
+    assert len(questions) == 1 and errors == []
+
+def test_accepts_a_bare_list_of_questions():
+    questions, errors = parse_quiz(json.dumps([question()]))
+    assert len(questions) == 1 and errors == []
+
+@pytest.mark.parametrize("answer", [
+    "B", "b", "b)", "(B)", "B.", "Option B", "Answer: B", "The correct answer is B", "B) A list", "A list", "a LIST.",
+])
+def test_accepts_answer_spellings(answer):
+    parsed, error = validate_question(question(answer=answer))
+    assert error is None
+    assert parsed["answer"] == "B"
+
+@pytest.mark.parametrize("answer", [
+    "A list is mutable",    # free text that merely starts with a letter
+    "B) A dict",            # letter and option text disagree
+    "Both A and B",
+    "E",
+    "",
+    None,
+])
+def test_rejects_answers_that_are_not_a_letter_or_an_option(answer):
+    parsed, error = validate_question(question(answer=answer))
+    assert parsed is None
+    assert error == "answer must be one of A, B, C, D"
+
+def test_answer_under_alternative_keys():
+    item = question()
+    del item["answer"]
+    item["correct_answer"] = "Option C"
+    parsed, error = validate_question(item)
+    assert error is None and parsed["answer"] == "C"
+
+@pytest.mark.parametrize("options", [
+    {"Option A": "A tuple", "Option B": "A list", "Option C": "A dict", "Option D": "A set"},
+    {"a)": "A tuple", "(b)": "A list", "C:": "A dict", "d": "A set"},
+    ["A) A tuple", "B) A list", "C) A dict", "D) A set"],
+    ["Option A: A tuple", "Option B: A list", "Option C: A dict", "Option D: A set"],
+    ["A tuple", "A list", "A dict", "A set"],
+])
+def test_accepts_option_layouts(options):
+    parsed, error = validate_question(question(options=options))
+    assert error is None
+    assert parsed["options"] == OPTIONS
+
+@pytest.mark.parametrize("options", [
+    {"A": "A tuple", "B": "A list", "C": "A dict"},
+    {"1": "A tuple", "2": "A list", "3": "A dict", "4": "A set"},
+    {"A": "A tuple", "B": "", "C": "A dict", "D": "A set"},
+    None,
+])
+def test_rejects_incomplete_options(options):
+    parsed, error = validate_question(question(options=options))
+    assert parsed is None
+    assert error == "needs exactly four options labelled A-D"
+
+def test_reports_each_invalid_question_and_keeps_the_valid_ones():
+    questions, errors = parse_quiz(reply(question(question=""), question(), "not a question"))
+    assert len(questions) == 1
+    assert errors == ["question 1: missing question text", "question 3: question is not an object"]
+
+@pytest.mark.parametrize("text", ["", "I can't help with that.", "{\"questions\": []}", "{\"questions\": [", "[]"])
+def test_replies_without_questions(text):
+    questions, errors = parse_quiz(text)
+    assert questions == []
+    assert errors == ["no questions found; reply must be a JSON object with a 'questions' list"]
+
+def test_falls_back_to_the_plain_text_layout():
+    text = (
+        "Q1: Which type is mutable and ordered?\n"
+        "A) A tuple\nB) A list\nC) A dict\nD) A set\n"
+        "Correct Answer: B\n"
+        "Explanation: Lists can be changed in place.\n"
+    )
+    questions, errors = parse_quiz(text)
+    assert errors == []
+    assert questions[0]["answer"] == "B"
+    assert questions[0]["explanation"] == "Lists can be changed in place."
+
+def test_format_question():
+    parsed, _ = validate_question(question())
+    assert format_question(2, parsed) == (
+        "Q2: Which type is mutable and ordered?\nA) A tuple\nB) A list\nC) A dict\nD) A set"
+    )